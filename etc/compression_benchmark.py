@@ -0,0 +1,136 @@
+"""
+Compares the size of the files honeycomb writes with each compression
+codec, and how quickly they are written and read, on a few representative
+DataFrames. Files are written locally, so nothing is uploaded to S3.
+
+Usage:
+    python etc/compression_benchmark.py [num_rows]
+"""
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+import fastavro
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.orc as orc
+import pyarrow.parquet as pq
+
+from honeycomb import file_writing, meta
+
+num_repeats = 3
+
+
+def gen_frames(num_rows):
+    rng = np.random.default_rng(0)
+    return {
+        'numeric': pd.DataFrame({
+            'id': np.arange(num_rows),
+            'price': rng.normal(250000, 50000, num_rows).round(2),
+            'beds': rng.integers(1, 6, num_rows),
+            'updated_at': pd.Timestamp('2021-01-01') + pd.to_timedelta(
+                rng.integers(0, 10 ** 6, num_rows), unit='s')
+        }),
+        'text': pd.DataFrame({
+            'state': rng.choice(['TX', 'CA', 'NY', 'FL', 'WA'], num_rows),
+            'address': ['{} Main St'.format(i) for i in
+                        rng.integers(1, 10 ** 5, num_rows)],
+            'description': [' '.join(rng.choice(
+                ['sunny', 'spacious', 'quiet', 'renovated', 'cozy'], 8))
+                for _ in range(num_rows)]
+        }),
+        'nested': pd.DataFrame({
+            'id': np.arange(num_rows),
+            'rooms': [[{'name': 'room', 'sqft': int(sqft)}
+                       for sqft in rng.integers(80, 400, 3)]
+                      for _ in range(num_rows)]
+        })
+    }
+
+
+def write_parquet(df, local_path, compression):
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                   local_path, compression=compression,
+                   use_deprecated_int96_timestamps=True)
+
+
+def read_parquet(local_path):
+    pq.read_table(local_path)
+
+
+def write_orc(df, local_path, compression):
+    # Hive writes ORC files itself, so this approximates it with pyarrow
+    orc.write_table(pa.Table.from_pandas(df, preserve_index=False),
+                    local_path, compression=(
+                        'uncompressed' if compression == 'none'
+                        else compression))
+
+
+def read_orc(local_path):
+    orc.read_table(local_path)
+
+
+def write_avro(df, local_path, compression):
+    file_writing.write_avro(
+        df, local_path, codec=meta.compression_codecs['avro'][compression])
+
+
+def read_avro(local_path):
+    with open(local_path, 'rb') as f:
+        for _ in fastavro.reader(f):
+            pass
+
+
+formats = {
+    'parquet': (write_parquet, read_parquet),
+    'orc': (write_orc, read_orc),
+    'avro': (write_avro, read_avro)
+}
+
+
+def time_best_of(fn, *args):
+    best = None
+    for _ in range(num_repeats):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmark(num_rows=100000):
+    results = []
+    with TemporaryDirectory() as tmpdir:
+        for frame_name, df in gen_frames(num_rows).items():
+            df_bytes = df.memory_usage(deep=True).sum()
+            for storage_type, (write_fn, read_fn) in formats.items():
+                for compression in meta.compression_codecs[storage_type]:
+                    local_path = os.path.join(tmpdir, '{}_{}.{}'.format(
+                        frame_name, compression, storage_type))
+                    try:
+                        write_secs = time_best_of(
+                            write_fn, df, local_path, compression)
+                    except (ValueError, pa.ArrowNotImplementedError) as e:
+                        # Codecs whose libraries are not installed
+                        print('Skipping {} {}: {}'.format(
+                            storage_type, compression, e))
+                        continue
+                    read_secs = time_best_of(read_fn, local_path)
+                    results.append({
+                        'frame': frame_name,
+                        'storage_type': storage_type,
+                        'compression': compression,
+                        'file_mb': os.path.getsize(local_path) / 1024 ** 2,
+                        'write_mb_per_s': df_bytes / 1024 ** 2 / write_secs,
+                        'read_mb_per_s': df_bytes / 1024 ** 2 / read_secs
+                    })
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with pd.option_context('display.max_rows', None,
+                           'display.float_format', '{:.2f}'.format):
+        print(run_benchmark(num_rows))
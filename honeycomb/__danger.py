@@ -43,21 +43,8 @@ def __nuke_partition(table_name, schema, partition_values):
     partition_string = ', '.join([
         '{}=\'{}\''.format(partition_key, partition_value)
         for partition_key, partition_value in partition_values.items()])
-    partition_metadata = hive.run_lake_query(
-        'DESCRIBE FORMATTED {}.{} PARTITION ({})'.format(
-            schema, table_name, partition_string),
-        engine='hive'
-    )
-
-    # The DataFrame returned by DESCRIBE queries are not organized like a
-    # normal DataFrame, hence the inaccurate column names
-    partition_location = partition_metadata.loc[
-        partition_metadata['col_name'].str.strip() == 'Location:',
-        'data_type'
-    ].values[0]
-
-    uri_prefix = 's3://'
-    bucket, path = partition_location[len(uri_prefix):].split('/', 1)
+    bucket, path = meta.get_partition_s3_location(table_name, schema,
+                                                  partition_values)
     path = meta.ensure_path_ends_w_slash(path)
 
     hive.run_lake_query(
@@ -2,12 +2,18 @@ from .config import get_option, set_option
 
 from . import analysis
 from .hive import run_lake_query
-from .append_table import append_df_to_table
+from .append_table import append_df_to_table, append_dfs_to_table
+from .compaction import compact
 from .create_table.create_table_from_df import create_table_from_df
 from .create_table.ctas import ctas
 from .create_table.flash_update_table_from_df import flash_update_table_from_df
 from .describe_table import describe_table
+from .ingest_files import ingest_files
+from .merge_table import merge_df_into_table
 from .meta import get_table_storage_type, get_table_s3_location
+from .orc import OrcBatchWriter
+from .schema_cache import SchemaCache
+from .table_writer import TableWriter
 from . import alter_table, check
 from .extras import bigquery, salesforce
 from .extras.get_ssm_secret import get_ssm_secret
@@ -20,9 +26,16 @@ __all__ = [
     'alter_table',
     'analysis',
     'append_df_to_table',
+    'append_dfs_to_table',
     'check',
+    'compact',
+    'OrcBatchWriter',
+    'SchemaCache',
+    'TableWriter',
     'flash_update_table_from_df',
     'get_ssm_secret',
+    'ingest_files',
+    'merge_df_into_table',
     'run_lake_query',
     'create_table_from_df',
     'ctas',
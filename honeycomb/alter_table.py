@@ -10,10 +10,7 @@ def add_partition(table_name, schema, partition_values, partition_path=None):
 
     partition_strings = build_partition_strings(partition_values)
     if partition_path is None:
-        # Datetimes cast to str will by default provide an invalid path
-        partition_path = '/'.join(
-            [val if not isinstance(val, datetime)
-             else str(val.date()) for val in partition_values.values()]) + '/'
+        partition_path = gen_partition_path(partition_values)
     else:
         partition_path = meta.validate_table_path(partition_path, table_name)
 
@@ -34,10 +31,98 @@ def add_partition(table_name, schema, partition_values, partition_path=None):
             'Partition ({}) already exists in table.'.format(
                 partition_strings)
         )
+        # Existing partitions may have been relocated (such as by
+        # compaction) or created by Hive itself, so the path they are
+        # actually stored at is used instead
+        partition_path = get_partition_subpath(table_name, schema,
+                                               partition_values)
 
     return partition_path
 
 
+def gen_partition_path(partition_values):
+    """
+    Generates the path that a new partition is stored at by default,
+    relative to the path of its table
+    """
+    # Datetimes cast to str will by default provide an invalid path
+    return '/'.join(
+        [val if not isinstance(val, datetime)
+         else str(val.date()) for val in partition_values.values()]) + '/'
+
+
+def get_partition_subpath(table_name, schema, partition_values):
+    """
+    Gets the path of an existing partition, relative to the path of the
+    table that contains it
+
+    Args:
+        table_name (str): The table containing the partition
+        schema (str): The schema the table is in
+        partition_values (dict<str:str>):
+            Mapping from partition name to partition value, identifying the
+            partition
+    Raises:
+        ValueError: If the partition is not stored within the table's folder
+    """
+    _, table_path = meta.get_table_s3_location(table_name, schema)
+    table_path = meta.ensure_path_ends_w_slash(table_path)
+    _, partition_path = meta.get_partition_s3_location(
+        table_name, schema, partition_values)
+    partition_path = meta.ensure_path_ends_w_slash(partition_path)
+
+    if not partition_path.startswith(table_path):
+        raise ValueError(
+            'Partition ({}) is not stored within the folder of its table, '
+            'and cannot be written to.'.format(
+                build_partition_strings(partition_values)))
+    return partition_path[len(table_path):]
+
+
+def set_table_location(table_name, schema, bucket, path):
+    """
+    Points a table at a new S3 location. Only the table's metadata is
+    changed - no files are moved.
+
+    Args:
+        table_name (str): The table to relocate
+        schema (str): The schema the table is in
+        bucket (str): The bucket of the table's new location
+        path (str): The path of the table's new location
+    """
+    set_location_query = (
+        'ALTER TABLE {}.{} SET LOCATION \'s3://{}/{}\''.format(
+            schema, table_name, bucket, meta.ensure_path_ends_w_slash(path))
+    )
+    inform(set_location_query)
+    hive.run_lake_query(set_location_query, engine='hive')
+
+
+def set_partition_location(table_name, schema, partition_values,
+                           bucket, path):
+    """
+    Points a partition at a new S3 location. Only the partition's metadata
+    is changed - no files are moved.
+
+    Args:
+        table_name (str): The table containing the partition
+        schema (str): The schema the table is in
+        partition_values (dict<str:str>):
+            Mapping from partition name to partition value, identifying the
+            partition to relocate
+        bucket (str): The bucket of the partition's new location
+        path (str): The path of the partition's new location
+    """
+    set_location_query = (
+        'ALTER TABLE {}.{} PARTITION ({}) '
+        'SET LOCATION \'s3://{}/{}\''.format(
+            schema, table_name, build_partition_strings(partition_values),
+            bucket, meta.ensure_path_ends_w_slash(path))
+    )
+    inform(set_location_query)
+    hive.run_lake_query(set_location_query, engine='hive')
+
+
 def build_partition_strings(partition_values):
     partition_strings = [
         '{}="{}"'.format(partition_key, str(partition_value))
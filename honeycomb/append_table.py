@@ -1,15 +1,28 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
 import rivet as rv
 
-from honeycomb import check, meta, dtype_mapping
+from honeycomb import check, meta, dtype_mapping, lake_files
 from honeycomb.alter_table import add_partition
-from honeycomb.orc import append_df_to_orc_table
+from honeycomb.bucketing import get_next_copy_numbers, write_bucketed_df
+from honeycomb.file_writing import infer_avro_schema, write_df
+from honeycomb.inform import inform
+from honeycomb.orc import append_df_to_orc_table, OrcBatchWriter
 
 
 def append_df_to_table(df, table_name, schema=None, dtypes=None,
                        filename=None, overwrite_file=False, timezones=None,
                        copy_df=True, partition_values=None,
                        require_identical_columns=True, avro_schema=None,
-                       hive_functions=None):
+                       hive_functions=None, sort_by=None,
+                       bucketed_by=None, num_buckets=None, sorted_by=None,
+                       idempotent=False):
     """
     Uploads a dataframe to S3 and appends it to an already existing table.
     Queries existing table metadata to
@@ -48,11 +61,36 @@ def append_df_to_table(df, table_name, schema=None, dtypes=None,
             if they should lead to an error being raised.
         avro_schema (dict, optional):
             Schema to use when writing a DataFrame to an Avro file. If not
-            provided, one will be auto-generated.
+            provided, the table's own schema is used, or one is
+            auto-generated if the table's schema does not match the
+            DataFrame's columns.
         hive_functions (dict<str:str> or dict<str:dict>):
             Specifications on what hive functions to apply to which columns.
             Only usable when working with ORC tables. See 'orc.py'
             for additional documentation
+        sort_by (list<str>, optional):
+            Columns to sort the appended data by. If not provided, the
+            columns recorded in the table's properties when it was
+            created are used, if any
+        bucketed_by (list<str>, optional):
+            The columns the table is bucketed by. Bucketing is determined
+            from the table itself, so this is only used to confirm that the
+            table is bucketed as expected
+        num_buckets (int, optional):
+            The number of buckets in the table. See 'bucketed_by'
+        sorted_by (list<str>, optional):
+            Columns that rows within each bucket are sorted by.
+            See 'bucketed_by'
+        idempotent (bool, default False):
+            Whether to name the file after a hash of the DataFrame's
+            contents, so that if the same DataFrame has already been
+            appended - such as by a previous attempt of a retried job - it
+            is detected and not appended again. Not usable with ORC or
+            bucketed tables. As with other appends, a filename must be
+            provided outside the experimental zone
+    Returns:
+        bool: Whether the DataFrame was appended. Only False if
+            'idempotent' is True and it had already been appended
     """
     # Less memory efficient, but prevents original DataFrame from modification
     if copy_df:
@@ -60,6 +98,223 @@ def append_df_to_table(df, table_name, schema=None, dtypes=None,
 
     table_name, schema = meta.prep_schema_and_table(table_name, schema)
 
+    # Gets the table's S3 location, storage type, and column order.
+    # We need to know where to write the data to be appended, and
+    # the format and column order to write it in
+    target = get_append_target(table_name, schema, sort_by,
+                               bucketed_by, num_buckets, sorted_by)
+    df, filename = prep_df_and_filename_for_target(
+        df, target, filename, dtypes, timezones, partition_values,
+        require_identical_columns, idempotent)
+
+    # If the data is to be appended into a partition, we must get the
+    # subpath of the partition if it exists, or create
+    # the partition if it doesn't
+    path = target['path']
+    if partition_values:
+        path += add_partition(table_name, schema, partition_values)
+
+    return write_df_to_target(df, target, path, filename, partition_values,
+                              overwrite_file, avro_schema, hive_functions,
+                              idempotent)
+
+
+def append_dfs_to_table(dfs, table_name, schema=None, dtypes=None,
+                        filename=None, overwrite_file=False, timezones=None,
+                        copy_df=False, partition_values=None,
+                        require_identical_columns=True, avro_schema=None,
+                        hive_functions=None, sort_by=None,
+                        bucketed_by=None, num_buckets=None, sorted_by=None,
+                        max_in_flight=1, idempotent=False):
+    """
+    Appends an iterable of DataFrames to an already existing table, without
+    ever needing to hold all of them in memory at once. Each DataFrame
+    is stored as its own file.
+
+    Table metadata, column order, and partition state are resolved once,
+    rather than once per DataFrame. While one DataFrame is being
+    prepared, up to 'max_in_flight' previously prepared DataFrames are
+    serialized and uploaded in the background, so memory usage stays at
+    roughly 'max_in_flight' + 1 DataFrames regardless of how many are
+    provided in total.
+
+    If appending any of the DataFrames fails, any DataFrames before it
+    will already have been appended (except for ORC tables, which are only
+    appended to once all DataFrames have been staged).
+
+    Args:
+        dfs (iterable<pd.DataFrame>):
+            The DataFrames to append. Can be a generator, in which case
+            DataFrames will only be produced as they are needed
+        table_name (str): The name of the table to append to
+        schema (str, optional): Name of the schema containing the table
+        dtypes (dict<str:str>, optional): A dictionary specifying dtypes for
+            specific columns to be cast to prior to uploading.
+        filename (str, optional):
+            Name to base the names of the stored files on. An index is added
+            to the name of each file. Can be left blank if writing to the
+            experimental zone, in which case a name will be generated.
+        overwrite_file (bool):
+            Whether to overwrite files if files with matching names
+            are already present in S3.
+        timezones (dict<str, str>):
+            Dictionary from datetime columns to the timezone they
+            represent. See 'append_df_to_table' for further details.
+        copy_df (bool, default False):
+            Whether the operations performed on each DataFrame should be
+            performed on the original or a copy. Unlike with
+            'append_df_to_table', this defaults to False, as DataFrames
+            passed in this way are generally not used again afterwards
+        partition_values (dict<str:str>, optional):
+            List of tuples containing partition keys and values to
+            store the DataFrames under. If there is no partiton at the value,
+            it will be created.
+        require_identical_columns (bool, default True):
+            Whether extra/missing columns should be allowed and handled, or
+            if they should lead to an error being raised.
+        avro_schema (dict, optional):
+            Schema to use when writing DataFrames to Avro files. If not
+            provided, the table's own schema is used, or one is generated
+            from the first DataFrame and used for all of them.
+        hive_functions (dict<str:str> or dict<str:dict>):
+            Specifications on what hive functions to apply to which columns.
+            Only usable when working with ORC tables. See 'orc.py'
+            for additional documentation
+        sort_by (list<str>, optional):
+            Columns to sort the appended data by. If not provided, the
+            columns recorded in the table's properties when it was
+            created are used, if any
+        bucketed_by (list<str>, optional):
+            The columns the table is bucketed by. Bucketing is determined
+            from the table itself, so this is only used to confirm that the
+            table is bucketed as expected
+        num_buckets (int, optional):
+            The number of buckets in the table. See 'bucketed_by'
+        sorted_by (list<str>, optional):
+            Columns that rows within each bucket are sorted by.
+            See 'bucketed_by'
+        max_in_flight (int, default 1):
+            The maximum number of DataFrames being serialized and uploaded
+            at any one time
+        idempotent (bool, default False):
+            Whether to name each file after a hash of its DataFrame's
+            contents, and skip DataFrames that have already been appended.
+            See 'append_df_to_table'
+    """
+    table_name, schema = meta.prep_schema_and_table(table_name, schema)
+
+    target = get_append_target(table_name, schema, sort_by,
+                               bucketed_by, num_buckets, sorted_by)
+    storage_type = target['storage_type']
+    if idempotent:
+        validate_idempotent_target(target)
+
+    if filename is None:
+        # Raises outside the experimental zone, where a filename is required
+        filename = meta.gen_filename_if_allowed(schema, storage_type)
+        if idempotent:
+            # Files appended idempotently are named by their contents, so
+            # they need no timestamp to be unique
+            filename = 'part.' + storage_type
+    validate_filename_for_target(filename, target)
+    filename_stem = filename[:-len(storage_type) - 1]
+
+    if storage_type == 'orc':
+        # Staging every DataFrame and converting them all at once is far
+        # cheaper than converting each DataFrame individually
+        with OrcBatchWriter(table_name, schema, hive_functions,
+                            target['sort_by']) as writer:
+            for df in dfs:
+                writer.add(df, partition_values, dtypes, timezones, copy_df)
+        return
+
+    path = target['path']
+    if partition_values:
+        path += add_partition(table_name, schema, partition_values)
+
+    if target['bucketing']:
+        # Each DataFrame is given its own copy of each bucket. These are
+        # determined upfront, as files are written concurrently
+        base_copy_nums = get_next_copy_numbers(
+            target['bucket'], path, target['bucketing']['num_buckets'])
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        try:
+            for i, df in enumerate(dfs):
+                if copy_df:
+                    df = df.copy()
+                df = prep_df_for_appending(df, target, dtypes, timezones,
+                                           partition_values,
+                                           require_identical_columns)
+                if storage_type == 'avro' and avro_schema is None:
+                    avro_schema = get_table_avro_schema(target, df)
+
+                # Waiting on the oldest upload bounds the number of
+                # DataFrames held in memory
+                if len(in_flight) >= max_in_flight:
+                    in_flight.popleft().result()
+
+                if target['bucketing']:
+                    in_flight.append(executor.submit(
+                        write_df_to_buckets, df, path, target, avro_schema,
+                        [copy_num + i for copy_num in base_copy_nums]))
+                else:
+                    chunk_path = path + '{}_{:05d}.{}'.format(
+                        filename_stem, i, storage_type)
+                    if idempotent:
+                        chunk_path = path + add_content_hash_to_filename(
+                            chunk_path[len(path):], df, storage_type)
+                        if rv.exists(chunk_path, target['bucket']):
+                            inform('s3://{}/{} already exists, so DataFrame '
+                                   '{} has already been appended.'.format(
+                                       target['bucket'], chunk_path, i))
+                            continue
+                    in_flight.append(executor.submit(
+                        write_df_to_table_path, df, chunk_path, target,
+                        overwrite_file, avro_schema))
+                # Releasing this reference lets the DataFrame be freed as
+                # soon as its upload completes
+                del df
+
+            while in_flight:
+                in_flight.popleft().result()
+        except Exception as e:
+            for future in in_flight:
+                future.cancel()
+            raise e
+
+
+def get_append_target(table_name, schema, sort_by=None, bucketed_by=None,
+                      num_buckets=None, sorted_by=None):
+    """
+    Gathers the information about an existing table that is needed to
+    append to it
+
+    Args:
+        table_name (str): The table to be appended to
+        schema (str): The schema containing the table
+        sort_by (list<str>, optional):
+            Columns to sort appended data by, overriding those recorded in
+            the table's properties
+        bucketed_by (list<str>, optional):
+            The columns the table is expected to be bucketed by
+        num_buckets (int, optional):
+            The number of buckets the table is expected to have
+        sorted_by (list<str>, optional):
+            The columns the table's buckets are expected to be sorted by
+    Returns:
+        dict:
+            The table's 'bucket', 'path', 'storage_type', 'bucketing' and
+            'col_defs' (as returned by 'meta.get_table_metadata'), along with
+            its column order under 'col_order', the columns to sort by under
+            'sort_by', and whether it has narrow column types under
+            'narrow_types'
+    Raises:
+        ValueError: If the table does not exist
+        ValueError:
+            If bucketing is specified and does not match the table's
+    """
     table_exists = check.table_existence(table_name, schema)
     if not table_exists:
         raise ValueError(
@@ -67,62 +322,341 @@ def append_df_to_table(df, table_name, schema=None, dtypes=None,
                 schema=schema,
                 table_name=table_name))
 
-    # Gets the table's S3 location and storage type from metadata
-    # We need to know where to write the data to be appended, and
-    # the format to write it in
-    table_metadata = meta.get_table_metadata(table_name, schema)
+    target = meta.get_table_metadata(table_name, schema)
+    target['table_name'] = table_name
+    target['schema'] = schema
+    target['path'] = meta.ensure_path_ends_w_slash(target['path'])
+    target['col_order'] = meta.get_table_column_order(table_name, schema)
+    target['sort_by'] = sort_by or meta.get_sort_by(
+        target.get('tblproperties', {}))
+    # Parquet tables with narrow column types must be written with
+    # matching physical types. See 'dtype_mapping.map_db_to_arrow_schema'
+    target['narrow_types'] = bool(
+        target['storage_type'] == 'parquet' and
+        target['col_defs'] is not None and
+        dtype_mapping.has_narrow_db_dtypes(target['col_defs']))
+
+    if bucketed_by or num_buckets or sorted_by:
+        # Hive reports column names in lowercase
+        expected_bucketing = {
+            'bucketed_by': [col.lower() for col in bucketed_by or []],
+            'num_buckets': num_buckets,
+            'sorted_by': ([col.lower() for col in sorted_by]
+                          if sorted_by else None)
+        }
+        if target['bucketing'] != expected_bucketing:
+            raise ValueError(
+                'The bucketing specified does not match the bucketing of '
+                'the table. Table bucketing: {}'.format(target['bucketing']))
+    return target
+
+
+def prep_df_and_filename_for_target(df, target, filename, dtypes,
+                                    timezones, partition_values,
+                                    require_identical_columns, idempotent):
+    """
+    Validates the filename a DataFrame is to be appended under, or generates
+    one, and prepares the DataFrame to be appended. Nothing is written, so
+    this can be safely retried with a refreshed target.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to prepare
+        target (dict): The table being appended to, from 'get_append_target'
+        filename (str): The name to store the DataFrame under, if provided
+        dtypes (dict<str:str>): Dtypes for specific columns to be cast to
+        timezones (dict<str, str>):
+            Dictionary from datetime columns to the timezone they represent
+        partition_values (dict<str:str>):
+            The partition the DataFrame is being appended to
+        require_identical_columns (bool):
+            Whether extra/missing columns should be allowed and handled, or
+            if they should lead to an error being raised.
+        idempotent (bool):
+            Whether the file is to be named after the DataFrame's contents
+    Returns:
+        tuple<pd.DataFrame, str>: The prepared DataFrame, and its filename
+    """
+    storage_type = target['storage_type']
+    if idempotent:
+        validate_idempotent_target(target)
 
-    bucket = table_metadata['bucket']
-    path = table_metadata['path']
-    storage_type = table_metadata['storage_type']
     if filename is None:
-        filename = meta.gen_filename_if_allowed(schema, storage_type)
-    if not filename.endswith(storage_type):
+        # Raises outside the experimental zone, where a filename is required.
+        # Files appended idempotently are named after their contents alone
+        generated_filename = meta.gen_filename_if_allowed(target['schema'],
+                                                          storage_type)
+        if not idempotent:
+            filename = generated_filename
+    if filename is not None:
+        validate_filename_for_target(filename, target)
+
+    df = prep_df_for_appending(df, target, dtypes, timezones,
+                               partition_values, require_identical_columns)
+    if idempotent:
+        filename = add_content_hash_to_filename(filename, df, storage_type)
+    return df, filename
+
+
+def write_df_to_target(df, target, path, filename, partition_values,
+                       overwrite_file, avro_schema, hive_functions,
+                       idempotent):
+    """
+    Writes a prepared DataFrame to a table, in the way its storage format
+    and bucketing require
+
+    Args:
+        df (pd.DataFrame): The prepared DataFrame to write
+        target (dict): The table being appended to, from 'get_append_target'
+        path (str): The path of the table/partition to write to
+        filename (str): The name to store the DataFrame under
+        partition_values (dict<str:str>):
+            The partition the DataFrame is being appended to
+        overwrite_file (bool):
+            Whether to overwrite the file if it already exists
+        avro_schema (dict): Schema to use if writing an Avro file
+        hive_functions (dict<str:str> or dict<str:dict>):
+            Hive functions to apply to columns of ORC tables
+        idempotent (bool):
+            Whether to skip the DataFrame if a file named after its contents
+            already exists
+    Returns:
+        bool: Whether the DataFrame was appended
+    """
+    storage_type = target['storage_type']
+    if idempotent and rv.exists(path + filename, target['bucket']):
+        inform('s3://{}/{} already exists, so the DataFrame has already been '
+               'appended.'.format(target['bucket'], path + filename))
+        return False
+
+    if storage_type == 'avro' and avro_schema is None:
+        avro_schema = get_table_avro_schema(target, df)
+
+    if storage_type == 'orc':
+        append_df_to_orc_table(df, target['table_name'], target['schema'],
+                               target['bucket'], path, filename,
+                               partition_values, hive_functions,
+                               target['sort_by'])
+
+    elif target['bucketing']:
+        # Bucketed tables are written as one file per bucket, named as
+        # Hive requires, so the filename provided is not used
+        copy_nums = get_next_copy_numbers(
+            target['bucket'], path, target['bucketing']['num_buckets'])
+        write_df_to_buckets(df, path, target, avro_schema, copy_nums)
+
+    else:
+        write_df_to_table_path(df, path + filename, target,
+                               overwrite_file, avro_schema)
+    return True
+
+
+def validate_idempotent_target(target):
+    """
+    Checks that a table's files are named by honeycomb, so that appends to
+    it can be identified by the content hash in their names
+    """
+    if target['storage_type'] == 'orc' or target['bucketing']:
+        raise ValueError('Idempotent appends are not available for ORC or '
+                         'bucketed tables, as their files are named by Hive.')
+
+
+def hash_df_contents(df):
+    """
+    Computes a hash of a DataFrame's column names and values, without its
+    index. Values are hashed by pandas in a vectorized pass over each column,
+    except for columns of unhashable values such as lists and dicts, which
+    are hashed by their string representations.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to hash
+    Returns:
+        str: The hash, as 16 hexadecimal characters
+    """
+    digest = hashlib.sha1(
+        json.dumps([str(col) for col in df.columns]).encode())
+    for col in df.columns:
+        try:
+            col_hashes = pd.util.hash_pandas_object(df[col], index=False)
+        except TypeError:
+            col_hashes = pd.util.hash_pandas_object(df[col].astype(str),
+                                                    index=False)
+        digest.update(col_hashes.to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def add_content_hash_to_filename(filename, df, storage_type):
+    """
+    Adds the hash of a DataFrame's contents to a filename, or names the
+    file after the hash alone if no filename is provided
+    """
+    content_hash = hash_df_contents(df)
+    if filename is None:
+        return '{}.{}'.format(content_hash, storage_type)
+    filename_stem, extension = os.path.splitext(filename)
+    return '{}_{}{}'.format(filename_stem, content_hash, extension)
+
+
+def validate_filename_for_target(filename, target):
+    """Checks that a filename's extension matches the table's storage type"""
+    if not filename.endswith(target['storage_type']):
         raise ValueError(
             'The type specified in the filename does not match the '
             'filetype of the table.'
         )
-    path = meta.ensure_path_ends_w_slash(path)
 
+
+def prep_df_for_appending(df, target, dtypes, timezones, partition_values,
+                          require_identical_columns):
+    """
+    Applies special dtype handling to a DataFrame, reorders its columns
+    to match the table it is being appended to, and sorts its rows if the
+    table's files are sorted
+
+    Args:
+        df (pd.DataFrame): The DataFrame to prepare
+        target (dict): The table being appended to, from 'get_append_target'
+        dtypes (dict<str:str>): Dtypes for specific columns to be cast to
+        timezones (dict<str, str>):
+            Dictionary from datetime columns to the timezone they represent
+        partition_values (dict<str:str>):
+            The partition the DataFrame is being appended to
+        require_identical_columns (bool):
+            Whether extra/missing columns should be allowed and handled, or
+            if they should lead to an error being raised.
+    """
     df = dtype_mapping.special_dtype_handling(
-        df, spec_dtypes=dtypes, spec_timezones=timezones, schema=schema)
+        df, spec_dtypes=dtypes, spec_timezones=timezones,
+        schema=target['schema'])
 
     # Columns being in the same order as the table is either
     # mandatory or highly advisible, depending on storage format.
-    df = reorder_columns_for_appending(df, table_name, schema,
-                                       partition_values, storage_type,
-                                       require_identical_columns)
+    df = reorder_columns_for_appending(df, target['table_name'],
+                                       target['schema'], partition_values,
+                                       target['storage_type'],
+                                       require_identical_columns,
+                                       table_col_order=target['col_order'])
 
-    # If the data is to be appended into a partition, we must get the
-    # subpath of the partition if it exists, or create
-    # the partition if it doesn't
-    if partition_values:
-        path += add_partition(table_name, schema, partition_values)
+    # ORC data is sorted by Hive as it is converted
+    if target['sort_by'] and target['storage_type'] != 'orc':
+        df = meta.sort_df(df, target['sort_by'])
 
-    if storage_type == 'orc':
-        append_df_to_orc_table(df, table_name, schema,
-                               bucket, path, filename,
-                               partition_values, hive_functions)
+    if target['narrow_types']:
+        df = dtype_mapping.prep_df_for_arrow_schema(
+            df, dtype_mapping.map_db_to_arrow_schema(df, target['col_defs']))
+    return df
+
+
+def get_table_avro_schema(target, df):
+    """
+    Gets the Avro schema an Avro table was created with, so that appended
+    files are written with the same schema the table reads them with. If
+    the table has no schema in its properties, or its schema's fields do not
+    match the DataFrame's columns, a schema is inferred from the DataFrame.
+
+    Args:
+        target (dict): The table being appended to, from 'get_append_target'
+        df (pd.DataFrame): The prepared DataFrame being written
+    Returns:
+        dict: The Avro schema
+    """
+    tblproperties = target.get('tblproperties') or {}
+    avro_schema = None
+    try:
+        if 'avro.schema.literal' in tblproperties:
+            # Single quotes within the literal are escaped in its DDL
+            avro_schema = json.loads(re.sub(
+                r"\\+'", "'", tblproperties['avro.schema.literal']))
+        elif 'avro.schema.url' in tblproperties:
+            bucket, key = meta.split_s3_uri(
+                tblproperties['avro.schema.url'])
+            avro_schema = json.loads(lake_files.read_object(bucket, key))
+    except ValueError:
+        avro_schema = None
+
+    if (avro_schema is None or
+            [field['name'] for field in avro_schema.get('fields', [])] !=
+            list(df.columns)):
+        return infer_avro_schema(df)
+    return avro_schema
 
-    else:
-        path += filename
 
-        if rv.exists(path, bucket) and not overwrite_file:
-            raise KeyError('A file already exists at s3://{}/{}, '
-                           'Which will be overwritten by this operation. '
-                           'Specify a different filename to proceed.'.format(
-                               bucket, path
-                           ))
+def get_storage_settings(target, avro_schema, df):
+    """
+    Gets the settings to pass to rivet when writing to a table
+
+    Args:
+        target (dict): The table being appended to, from 'get_append_target'
+        avro_schema (dict): Schema to use if writing an Avro file
+        df (pd.DataFrame): The prepared DataFrame being written
+    """
+    # Copied so that table-specific settings don't leak into the defaults
+    storage_settings = dict(
+        meta.storage_type_specs[target['storage_type']]['settings'])
+    # Files are compressed with the codec the table was created with
+    storage_settings.update(meta.get_compression_settings(
+        target['storage_type'], target.get('tblproperties')))
+    if avro_schema is not None:
+        storage_settings['schema'] = avro_schema
+    elif target['narrow_types'] or (
+            target['storage_type'] == 'csv' and
+            target['col_defs'] is not None and
+            dtype_mapping.has_complex_db_dtypes(target['col_defs'])):
+        # Fields of structs in CSV files are identified by their position,
+        # so they are written in the order the table declares them in
+        storage_settings['schema'] = dtype_mapping.map_db_to_arrow_schema(
+            df, target['col_defs'])
+    return storage_settings
+
+
+def write_df_to_buckets(df, path, target, avro_schema, copy_nums):
+    """
+    Writes a prepared DataFrame to the buckets of a bucketed, non-ORC table
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        path (str): The path of the table/partition to write to
+        target (dict): The table being appended to, from 'get_append_target'
+        avro_schema (dict): Schema to use if writing Avro files
+        copy_nums (list<int>):
+            The copy number to name each bucket's file with
+    """
+    bucketing = target['bucketing']
+    write_bucketed_df(df, target['bucket'], path, target['storage_type'],
+                      get_storage_settings(target, avro_schema, df),
+                      bucketing['bucketed_by'], bucketing['num_buckets'],
+                      bucketing['sorted_by'], copy_nums,
+                      col_defs=target['col_defs'])
+
+
+def write_df_to_table_path(df, path, target, overwrite_file, avro_schema):
+    """
+    Writes a prepared DataFrame to a file in the storage location of
+    a non-ORC table
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        path (str): The path to write the file to, including filename
+        target (dict): The table being appended to, from 'get_append_target'
+        overwrite_file (bool):
+            Whether to overwrite the file if it already exists
+        avro_schema (dict): Schema to use if writing an Avro file
+    """
+    bucket = target['bucket']
+    if rv.exists(path, bucket) and not overwrite_file:
+        raise KeyError('A file already exists at s3://{}/{}, '
+                       'Which will be overwritten by this operation. '
+                       'Specify a different filename to proceed.'.format(
+                           bucket, path
+                       ))
 
-        storage_settings = meta.storage_type_specs[storage_type]['settings']
-        if avro_schema is not None:
-            storage_settings['schema'] = avro_schema
-        rv.write(df, path, bucket, show_progressbar=False, **storage_settings)
+    write_df(df, path, bucket, target['storage_type'],
+             get_storage_settings(target, avro_schema, df))
 
 
 def reorder_columns_for_appending(df, table_name, schema,
                                   partition_values, storage_type,
-                                  require_identical_columns):
+                                  require_identical_columns,
+                                  table_col_order=None):
     """
     Serialized formats such as Parquet don't necessarily have to worry
     about column order, but text-based formats like CSV rely entirely
@@ -154,8 +688,12 @@ def reorder_columns_for_appending(df, table_name, schema,
         require_identical_columns (bool):
             Whether extra/missing columns should be allowed and handled, or
             if they should lead to an error being raised.
+        table_col_order (list<str>, optional):
+            The table's column order, if it has already been retrieved.
+            If not provided, it will be queried for.
     """
-    table_col_order = meta.get_table_column_order(table_name, schema)
+    if table_col_order is None:
+        table_col_order = meta.get_table_column_order(table_name, schema)
     # Hive returns column names as all lowercase, so we have to compare based
     # on lowercase DataFrame columns as well
     df_col_order = df.columns.str.lower()
@@ -0,0 +1,339 @@
+from concurrent.futures import ThreadPoolExecutor
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype, is_integer_dtype
+
+from honeycomb import lake_files, meta
+from honeycomb.file_writing import write_df
+
+
+"""
+Notes on bucketing
+
+Hive assigns each row of a bucketed table to a bucket by hashing the values
+of its bucketing columns. For tables with 'bucketing_version' 2 (the default
+since Hive 3), each value is hashed with Murmur3, the hashes of multiple
+columns are combined as 'hash = 31 * hash + field_hash', and the bucket
+is '(hash & INT_MAX) % num_buckets'. Null values hash to 0.
+
+Hive only trusts a table's bucketing if every row in a bucket's files was
+assigned to that bucket by the same function, and if those files are named
+with the bucket's number - '000003_0' for bucket 3. Files appended to a
+bucket afterwards are named as copies, such as '000003_0_copy_1'.
+
+The hashing below is vectorized with numpy, and only supports the column
+types that bucketing columns are realistically made of in honeycomb -
+integers and STRING, including categorical columns of them. Hive hashes
+integers as the big-endian bytes of their own type, so TINYINT, SMALLINT,
+INT and BIGINT values are hashed as 1, 2, 4 and 8 bytes respectively. The
+table's column definitions determine the width; without them, integers are
+hashed as BIGINT, which every integer dtype is mapped to by default.
+"""
+
+murmur3_seed = 104729
+murmur3_c1 = 0xcc9e2d51
+murmur3_c2 = 0x1b873593
+murmur3_m = 5
+murmur3_n = 0xe6546b64
+
+# The number of bytes Hive hashes the values of each integer type as
+hive_int_widths = {'tinyint': 1, 'smallint': 2, 'int': 4, 'bigint': 8}
+
+bucket_filename_template = '{:06d}_0{}.{}'
+bucket_copy_suffix_template = '_copy_{}'
+bucket_filename_regex = r'^(\d{6})_0(?:_copy_(\d+))?\.'
+
+
+def validate_bucketing(df, bucketed_by, num_buckets, sorted_by=None):
+    """
+    Checks that bucketing arguments are complete, and refer to columns
+    present in a DataFrame
+
+    Raises:
+        ValueError:
+            If only some of the bucketing arguments are provided, or any of
+            the columns are not present in the DataFrame
+    """
+    if not bucketed_by or not num_buckets:
+        raise ValueError(
+            '"bucketed_by" and "num_buckets" must be provided together.')
+    if int(num_buckets) < 1:
+        raise ValueError('"num_buckets" must be a positive integer.')
+
+    df_cols = set(df.columns.str.lower())
+    missing_cols = [col for col in bucketed_by + (sorted_by or [])
+                    if col.lower() not in df_cols]
+    if missing_cols:
+        raise ValueError(
+            'Columns to bucket or sort by are not present in the '
+            'DataFrame: {}'.format(', '.join(missing_cols)))
+
+
+def rotl32(x, r):
+    """Rotates the bits of an array of 32-bit integers to the left"""
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+
+def murmur3_32(data):
+    """
+    Hashes each row of a 2D array of bytes with Hive's Murmur3 function.
+    Every row must be of the same length.
+
+    Args:
+        data (np.ndarray<uint8>): The bytes to hash, one value per row
+    Returns:
+        np.ndarray<uint32>: The hash of each row
+    """
+    n_rows, length = data.shape
+    h = np.full(n_rows, murmur3_seed, dtype=np.uint32)
+
+    with np.errstate(over='ignore'):
+        n_blocks = length // 4
+        for i in range(n_blocks):
+            block = data[:, i * 4:(i + 1) * 4].astype(np.uint32)
+            k = (block[:, 0] | (block[:, 1] << np.uint32(8)) |
+                 (block[:, 2] << np.uint32(16)) |
+                 (block[:, 3] << np.uint32(24)))
+            k *= np.uint32(murmur3_c1)
+            k = rotl32(k, 15)
+            k *= np.uint32(murmur3_c2)
+            h ^= k
+            h = rotl32(h, 13)
+            h = h * np.uint32(murmur3_m) + np.uint32(murmur3_n)
+
+        tail = data[:, n_blocks * 4:]
+        if tail.shape[1]:
+            # Hive's implementation sign-extends the trailing bytes before
+            # combining them, so this must as well to produce the same hash
+            tail = tail.view(np.int8).astype(np.int32).view(np.uint32)
+            k = np.zeros(n_rows, dtype=np.uint32)
+            for i in range(tail.shape[1]):
+                k ^= tail[:, i] << np.uint32(8 * i)
+            k *= np.uint32(murmur3_c1)
+            k = rotl32(k, 15)
+            k *= np.uint32(murmur3_c2)
+            h ^= k
+
+        h ^= np.uint32(length)
+        h ^= h >> np.uint32(16)
+        h *= np.uint32(0x85ebca6b)
+        h ^= h >> np.uint32(13)
+        h *= np.uint32(0xc2b2ae35)
+        h ^= h >> np.uint32(16)
+
+    return h
+
+
+def hash_int_col(col, width=8):
+    """
+    Hashes an integer column the way Hive hashes integer values - as the
+    big-endian bytes of the value, at the width of its Hive type
+
+    Args:
+        col (pd.Series): The column to hash
+        width (int, default 8):
+            The number of bytes in the column's Hive type. 8 for BIGINT
+    Returns:
+        np.ndarray<uint32>: The hash of each value, with nulls hashing to 0
+    """
+    nulls = col.isna().to_numpy()
+    values = col.to_numpy(dtype=np.int64, na_value=0)
+    hashes = murmur3_32(values.astype('>i{}'.format(width)).view(
+        np.uint8).reshape(-1, width))
+    hashes[nulls] = 0
+    return hashes
+
+
+def hash_string_col(col):
+    """
+    Hashes a string column the way Hive hashes STRING values - as their
+    UTF-8 encoded bytes. Values are grouped by their encoded length, so that
+    each group can be hashed as a single 2D array.
+
+    Args:
+        col (pd.Series): The column to hash
+    Returns:
+        np.ndarray<uint32>: The hash of each value, with nulls hashing to 0
+    """
+    hashes = np.zeros(len(col), dtype=np.uint32)
+    encoded = col.str.encode('utf-8').reset_index(drop=True)
+    encoded = encoded[encoded.notna()]
+    lengths = encoded.str.len()
+
+    for length, group in encoded.groupby(lengths):
+        length = int(length)
+        if length:
+            data = np.frombuffer(b''.join(group), dtype=np.uint8)
+        else:
+            data = np.zeros(0, dtype=np.uint8)
+        hashes[group.index.to_numpy()] = murmur3_32(
+            data.reshape(len(group), length))
+    return hashes
+
+
+def hash_col(col, db_dtype=None):
+    """
+    Hashes a column the way Hive would hash it for bucketing
+
+    Args:
+        col (pd.Series): The column to hash
+        db_dtype (str, optional):
+            The column's type in the table. Determines the width integers
+            are hashed at. If not provided, integers are hashed as BIGINT
+    Raises:
+        TypeError: If the column is not of a supported type
+    """
+    if col.dtype.name == 'category':
+        # Only the categories are hashed, and each value takes the hash of
+        # its category. Missing values have a code of -1, and hash to 0
+        category_hashes = np.append(
+            hash_col(pd.Series(col.cat.categories, name=col.name),
+                     db_dtype), 0)
+        return category_hashes[col.cat.codes.to_numpy()]
+    elif is_integer_dtype(col.dtype):
+        return hash_int_col(col, hive_int_widths.get(
+            str(db_dtype).strip().lower(), 8))
+    elif infer_dtype(col, skipna=True) in ['string', 'empty']:
+        return hash_string_col(col)
+    else:
+        raise TypeError(
+            'Column \'{}\' cannot be bucketed by. Only integer and string '
+            'columns are supported as bucketing columns.'.format(col.name))
+
+
+def assign_buckets(df, bucketed_by, num_buckets, col_defs=None):
+    """
+    Determines which bucket each row of a DataFrame belongs in, matching the
+    buckets Hive would assign. See notes above for further details.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to assign buckets to
+        bucketed_by (list<str>): The columns to bucket by
+        num_buckets (int): The number of buckets
+        col_defs (pd.DataFrame, optional):
+            The table's column definitions, with 'col_name' and 'dtype'
+            columns. Determines the width integer columns are hashed at
+    Returns:
+        np.ndarray<int64>: The bucket of each row
+    """
+    lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+    db_dtypes = {}
+    if col_defs is not None:
+        db_dtypes = dict(zip(
+            col_defs['col_name'].astype(str).str.strip('`').str.lower(),
+            col_defs['dtype'].astype(str)))
+
+    hashes = np.zeros(len(df), dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for col in bucketed_by:
+            hashes = (hashes * np.uint32(31) +
+                      hash_col(df[lower_to_orig_col_map[col.lower()]],
+                               db_dtypes.get(col.lower())))
+    return ((hashes & np.uint32(0x7fffffff)) % num_buckets).astype(np.int64)
+
+
+def split_df_into_buckets(df, bucketed_by, num_buckets, sorted_by=None,
+                          col_defs=None):
+    """
+    Splits a DataFrame into the rows belonging to each of its buckets,
+    sorting each bucket's rows if 'sorted_by' is provided
+
+    Returns:
+        list<pd.DataFrame>: The rows of each bucket, indexed by bucket number
+    """
+    buckets = assign_buckets(df, bucketed_by, num_buckets, col_defs)
+
+    sort_keys = pd.DataFrame({'_bucket': buckets})
+    if sorted_by:
+        lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+        for i, col in enumerate(sorted_by):
+            sort_keys[i] = df[lower_to_orig_col_map[col.lower()]].to_numpy()
+    order = sort_keys.sort_values(list(sort_keys.columns),
+                                  kind='stable').index.to_numpy()
+    df = df.take(order)
+    df.index = pd.RangeIndex(len(df))
+
+    bounds = np.searchsorted(buckets[order], np.arange(num_buckets + 1))
+    return [df.iloc[bounds[i]:bounds[i + 1]] for i in range(num_buckets)]
+
+
+def get_next_copy_numbers(bucket, path, num_buckets):
+    """
+    Determines the copy number each bucket's next file must be named with,
+    based on the files already present in a table or partition
+
+    Returns:
+        list<int>: The next copy number of each bucket, 0 if it has no files
+    """
+    path = meta.ensure_path_ends_w_slash(path)
+    next_copies = [0] * num_buckets
+    for file in lake_files.list_data_files(bucket, path):
+        match = re.match(bucket_filename_regex, file['key'][len(path):])
+        if match:
+            bucket_num = int(match.group(1))
+            copy_num = int(match.group(2) or 0)
+            if bucket_num < num_buckets:
+                next_copies[bucket_num] = max(next_copies[bucket_num],
+                                              copy_num + 1)
+    return next_copies
+
+
+def gen_bucket_filename(bucket_num, copy_num, storage_type):
+    """Generates the filename Hive expects for a file in a bucket"""
+    copy_suffix = (bucket_copy_suffix_template.format(copy_num)
+                   if copy_num else '')
+    return bucket_filename_template.format(bucket_num, copy_suffix,
+                                           storage_type)
+
+
+def write_bucketed_df(df, bucket, path, storage_type, storage_settings,
+                      bucketed_by, num_buckets, sorted_by=None,
+                      copy_nums=None, max_workers=8, col_defs=None):
+    """
+    Writes a DataFrame to a bucketed table/partition, with one file per
+    bucket, named as Hive expects
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        bucket (str): The S3 bucket containing the table
+        path (str): The path of the table/partition the files are written to
+        storage_type (str): The storage format of the table
+        storage_settings (dict): The settings to pass to rivet when writing
+        bucketed_by (list<str>): The columns to bucket by
+        num_buckets (int): The number of buckets
+        sorted_by (list<str>, optional):
+            The columns to sort rows within each bucket by. If not provided,
+            rows keep their original relative order within each bucket
+        copy_nums (list<int>, optional):
+            The copy number to name each bucket's file with, if appending to
+            existing buckets. See 'get_next_copy_numbers'. If not provided,
+            the buckets are assumed to be empty, and a file is written for
+            every bucket, even if no rows belong in it
+        max_workers (int, default 8):
+            The maximum number of files to be written at once
+        col_defs (pd.DataFrame, optional):
+            The table's column definitions. Required for rows to be
+            assigned to the correct buckets if the table has TINYINT,
+            SMALLINT, or INT bucketing columns
+    """
+    path = meta.ensure_path_ends_w_slash(path)
+    appending = copy_nums is not None
+    if not appending:
+        copy_nums = [0] * num_buckets
+
+    bucket_dfs = split_df_into_buckets(df, bucketed_by, num_buckets,
+                                       sorted_by, col_defs)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                write_df, bucket_df,
+                path + gen_bucket_filename(bucket_num, copy_nums[bucket_num],
+                                           storage_type),
+                bucket, storage_type, storage_settings)
+            for bucket_num, bucket_df in enumerate(bucket_dfs)
+            if not (appending and bucket_df.empty)
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,392 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from tempfile import TemporaryDirectory
+
+import fastavro
+import pandas as pd
+import pyarrow as pa
+from pyarrow import orc
+import pyarrow.parquet as pq
+
+from honeycomb import check, lake_files, meta
+from honeycomb.alter_table import set_partition_location, set_table_location
+from honeycomb.inform import inform
+
+
+"""
+Notes on compaction
+
+Every append to a table adds at least one file to it, and tables that are
+appended to frequently can accumulate thousands of small files per
+partition. Each file carries fixed overhead when planning and executing
+queries, so merging them into fewer, larger files improves query speed.
+
+How files are swapped:
+    a) The files in a table/partition are grouped into bins, each of which
+       totals no more than the target file size. Files that are already at
+       least the target size are left in bins of their own.
+    b) Every bin is written to a new, versioned folder within the original
+       location of the table/partition. Bins of multiple files are merged
+       into one file, and bins of one file are copied as-is.
+    c) The table/partition is pointed at the new folder. Until this point,
+       queries only read the original files, and afterwards they only read
+       the new ones - so at no point is any data visible twice.
+    d) The original files are deleted.
+
+Compaction does not coordinate with appends. Files appended to the
+original location of a table/partition after its files are listed in step
+a) are not included in the new folder, so once the table/partition is
+pointed at it in step c), they are left behind and no longer read - their
+data is lost to the table. Tables should not be appended to while being
+compacted.
+"""
+
+default_target_file_size = 128 * 1024 ** 2
+compacted_filename_template = 'compacted_{:05d}.{}'
+# Limits on the row groups of merged Parquet files. Batches are read from
+# the original files in far smaller chunks, so they are accumulated up to
+# these limits before being written
+merged_row_group_rows = 1024 ** 2
+merged_row_group_bytes = 128 * 1024 ** 2
+
+
+def compact(table_name, schema=None, partition_values=None,
+            target_file_size=default_target_file_size, dry_run=False,
+            max_workers=8):
+    """
+    Merges the small files underlying a table (or its partitions) into
+    fewer, larger files. Data appended while a table is being compacted is
+    lost, so appends should be paused beforehand. See notes above for
+    further details.
+
+    Args:
+        table_name (str): The table to compact
+        schema (str, optional): The schema that contains the table
+        partition_values (dict<str:str>, optional):
+            Used to filter which partitions of a partitioned table are
+            compacted. Partition columns that are not included will match any
+            value, so if not provided, every partition is compacted.
+        target_file_size (int):
+            The size in bytes that files should be merged up to
+        dry_run (bool, default False):
+            If True, no files are modified, and only the report of expected
+            file counts is returned
+        max_workers (int, default 8):
+            The maximum number of files to be written at once
+    Returns:
+        pd.DataFrame:
+            A report containing the location of each compacted table/partition,
+            its number of files before and after compaction, and the total
+            size of those files
+    """
+    table_name, schema = meta.prep_schema_and_table(table_name, schema)
+
+    if not check.table_existence(table_name, schema):
+        raise ValueError('Table \'{}.{}\' does not exist.'.format(
+            schema, table_name))
+    if schema == 'curated' and not dry_run and not os.getenv('HC_PROD_ENV'):
+        raise ValueError(
+            'Compaction of curated tables is only available in '
+            'production. Contact a lake administrator if compaction of a '
+            'curated table is needed.')
+
+    table_metadata = meta.get_table_metadata(table_name, schema)
+    storage_type = table_metadata['storage_type']
+    if table_metadata.get('bucketing'):
+        # Each bucket's files must contain only that bucket's rows, and be
+        # named after it, so they cannot be merged with any others
+        raise ValueError('Compaction of bucketed tables is not supported.')
+
+    if meta.is_partitioned_table(table_name, schema):
+        locations = [
+            (partition, *meta.get_partition_s3_location(
+                table_name, schema, partition))
+            for partition in meta.get_partitions(table_name, schema,
+                                                 partition_values)
+        ]
+    elif partition_values:
+        raise ValueError('Table \'{}.{}\' is not partitioned.'.format(
+            schema, table_name))
+    else:
+        locations = [
+            (None, table_metadata['bucket'], table_metadata['path'])]
+
+    s3 = lake_files.get_s3_client()
+    report = []
+    for partition, bucket, path in locations:
+        path = meta.ensure_path_ends_w_slash(path)
+        files = lake_files.list_data_files(bucket, path, s3)
+        bins = bin_files(files, target_file_size)
+        report.append({
+            'location': 's3://{}/{}'.format(bucket, path),
+            'files_before': len(files),
+            'files_after': len(bins),
+            'bytes': sum(file['size'] for file in files)
+        })
+
+        if not dry_run and len(bins) < len(files):
+            compact_location(table_name, schema, partition, bucket, path,
+                             files, bins, storage_type, max_workers, s3,
+                             get_merge_settings(
+                                 storage_type,
+                                 table_metadata.get('tblproperties')))
+
+    return pd.DataFrame(
+        report, columns=['location', 'files_before', 'files_after', 'bytes'])
+
+
+def bin_files(files, target_file_size):
+    """
+    Groups files into bins that total no more than 'target_file_size', using
+    first-fit decreasing bin packing. Files that are at least the target size
+    are placed in bins of their own.
+
+    Args:
+        files (list<dict>):
+            Dictionaries containing the 'key' and 'size' of each file
+        target_file_size (int): The maximum total size of a bin in bytes
+    Returns:
+        list<list<dict>>: The files grouped into bins
+    """
+    bins = []
+    bin_sizes = []
+    for file in sorted(files, key=lambda file: file['size'], reverse=True):
+        for i in range(len(bins)):
+            if bin_sizes[i] + file['size'] <= target_file_size:
+                bins[i].append(file)
+                bin_sizes[i] += file['size']
+                break
+        else:
+            bins.append([file])
+            bin_sizes.append(file['size'])
+    return bins
+
+
+def compact_location(table_name, schema, partition_values, bucket, path,
+                     files, bins, storage_type, max_workers, s3,
+                     merge_settings=None):
+    """
+    Writes the binned files of a table/partition to a new versioned folder,
+    swaps the table/partition to that folder, and removes the original files
+
+    Args:
+        table_name (str): The table being compacted
+        schema (str): The schema that contains the table
+        partition_values (dict<str:str>):
+            The partition being compacted. None if the table is not
+            partitioned
+        bucket (str): The bucket containing the files
+        path (str): The current location of the table/partition
+        files (list<dict>): The files currently in the table/partition
+        bins (list<list<dict>>): The files, grouped into bins
+        storage_type (str): The storage format of the files
+        max_workers (int): The maximum number of files to write at once
+        s3 (botocore.client.S3): The client to perform S3 operations with
+        merge_settings (dict, optional):
+            The settings to write merged files with. See 'get_merge_settings'
+    """
+    new_path = meta.gen_versioned_path(path)
+    inform('Compacting {} files in s3://{}/{} into {} files...'.format(
+        len(files), bucket, path, len(bins)))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for i, file_bin in enumerate(bins):
+                if len(file_bin) == 1:
+                    source_key = file_bin[0]['key']
+                    futures.append(executor.submit(
+                        lake_files.copy_file, bucket, source_key,
+                        new_path + source_key[len(path):], s3))
+                else:
+                    futures.append(executor.submit(
+                        merge_bin, file_bin, storage_type, bucket,
+                        new_path + compacted_filename_template.format(
+                            i, storage_type), s3, merge_settings))
+            for future in futures:
+                future.result()
+
+        if partition_values is None:
+            set_table_location(table_name, schema, bucket, new_path)
+        else:
+            set_partition_location(table_name, schema, partition_values,
+                                   bucket, new_path)
+    except Exception as e:
+        # The table/partition has not been swapped to the new folder,
+        # so anything written to it can be safely discarded
+        written_keys = [file['key'] for file in
+                        lake_files.list_data_files(bucket, new_path, s3)]
+        lake_files.delete_files(bucket, written_keys, s3)
+        raise e
+
+    lake_files.delete_files(bucket, [file['key'] for file in files], s3)
+
+
+def get_merge_settings(storage_type, tblproperties):
+    """
+    Gets the settings to write a table's merged files with, so that they
+    are compressed with the codec recorded in the table's properties, if any.
+    Only Parquet and ORC files are rewritten - Avro blocks are copied with
+    their original codec, and text files are not compressed.
+
+    Args:
+        storage_type (str): The storage format of the table
+        tblproperties (dict<str:str>): The table's properties
+    Returns:
+        dict: Keyword arguments for the storage format's merge function
+    """
+    if storage_type == 'parquet':
+        writer_settings = meta.get_parquet_writer_settings()
+        writer_settings.update(
+            meta.get_compression_settings('parquet', tblproperties))
+        return {'writer_settings': writer_settings}
+    elif storage_type == 'orc':
+        # Hive compresses ORC files itself, so its codec is not part of
+        # the settings honeycomb writes files with
+        codec = (tblproperties or {}).get(
+            meta.compression_tblproperties['orc'])
+        if codec:
+            return {'compression': ('uncompressed' if codec.upper() == 'NONE'
+                                    else codec.lower())}
+    return {}
+
+
+def merge_bin(file_bin, storage_type, bucket, dest_key, s3,
+              merge_settings=None):
+    """
+    Downloads the files in a bin, merges them into a single file, and
+    uploads the merged file to S3
+
+    Args:
+        file_bin (list<dict>): The files to merge
+        storage_type (str): The storage format of the files
+        bucket (str): The bucket containing the files
+        dest_key (str): The key to upload the merged file to
+        s3 (botocore.client.S3): The client to perform S3 operations with
+        merge_settings (dict, optional):
+            The settings to write the merged file with. See
+            'get_merge_settings'
+    """
+    merge_fns = {
+        'avro': merge_avro_files,
+        'csv': merge_text_files,
+        'json': merge_text_files,
+        'orc': merge_orc_files,
+        'parquet': merge_parquet_files
+    }
+
+    with TemporaryDirectory() as tmpdir:
+        local_paths = []
+        for i, file in enumerate(file_bin):
+            local_path = os.path.join(tmpdir, str(i))
+            lake_files.download_file(bucket, file['key'], local_path, s3)
+            local_paths.append(local_path)
+
+        merged_path = os.path.join(tmpdir, 'merged')
+        merge_fns[storage_type](local_paths, merged_path,
+                                **(merge_settings or {}))
+        lake_files.upload_file(merged_path, bucket, dest_key, s3)
+
+
+def merge_parquet_files(local_paths, merged_path, writer_settings=None):
+    """
+    Merges Parquet files by streaming their record batches into a single
+    file, written with the same settings honeycomb uses for Parquet tables,
+    or with 'writer_settings' if provided. Batches are grouped into row
+    groups of up to 'merged_row_group_rows' rows or 'merged_row_group_bytes'
+    bytes, whichever is reached first. Files written before columns were
+    added to the table are given null values for those columns, as Hive
+    reads them.
+    """
+    if writer_settings is None:
+        writer_settings = meta.get_parquet_writer_settings()
+    schema = pa.unify_schemas(
+        [pq.read_schema(local_path) for local_path in local_paths])
+    with pq.ParquetWriter(merged_path, schema, **writer_settings) as writer:
+        pending = []
+        pending_rows = pending_bytes = 0
+        for local_path in local_paths:
+            for batch in pq.ParquetFile(local_path).iter_batches():
+                pending.append(conform_to_schema(
+                    pa.Table.from_batches([batch]), schema))
+                pending_rows += batch.num_rows
+                pending_bytes += batch.nbytes
+                if (pending_rows >= merged_row_group_rows or
+                        pending_bytes >= merged_row_group_bytes):
+                    table = pa.concat_tables(pending)
+                    row_group = table.slice(0, merged_row_group_rows)
+                    writer.write_table(row_group,
+                                       row_group_size=merged_row_group_rows)
+                    # Rows beyond the row group are carried over to the next
+                    remainder = table.slice(merged_row_group_rows)
+                    pending = [remainder] if remainder.num_rows else []
+                    pending_rows = remainder.num_rows
+                    pending_bytes = remainder.nbytes
+        if pending:
+            writer.write_table(pa.concat_tables(pending),
+                               row_group_size=merged_row_group_rows)
+
+
+def conform_to_schema(table, schema):
+    """
+    Casts a table to a schema, with null values for any of the schema's
+    columns that the table does not contain
+    """
+    return pa.table(
+        [table.column(field.name).cast(field.type)
+         if field.name in table.column_names
+         else pa.nulls(table.num_rows, field.type)
+         for field in schema],
+        schema=schema)
+
+
+def merge_orc_files(local_paths, merged_path, compression='zlib'):
+    """
+    Merges ORC files into a single file, using the same compression
+    that Hive uses for ORC files by default, unless another is provided
+    """
+    with orc.ORCWriter(merged_path, compression=compression) as writer:
+        schema = None
+        for local_path in local_paths:
+            table = orc.ORCFile(local_path).read()
+            if schema is None:
+                schema = table.schema
+            writer.write(table.select(schema.names).cast(schema))
+
+
+def merge_avro_files(local_paths, merged_path):
+    """
+    Merges Avro files by copying their encoded blocks into a single file.
+    The blocks are not decoded, so the files must share a schema and codec.
+    """
+    with open(merged_path, 'wb') as merged_file:
+        writer = None
+        for local_path in local_paths:
+            with open(local_path, 'rb') as f:
+                reader = fastavro.block_reader(f)
+                if writer is None:
+                    writer_schema = reader.writer_schema
+                    codec = reader.codec
+                    writer = fastavro.write.Writer(
+                        merged_file, writer_schema, codec=codec)
+                elif (reader.writer_schema != writer_schema or
+                      reader.codec != codec):
+                    raise ValueError(
+                        'Avro files with differing schemas or codecs '
+                        'cannot be merged.')
+                for block in reader:
+                    writer.write_block(block)
+        writer.flush()
+
+
+def merge_text_files(local_paths, merged_path):
+    """
+    Merges newline-delimited text files (CSV and JSON) by concatenation
+    """
+    with open(merged_path, 'wb') as merged_file:
+        for local_path in local_paths:
+            with open(local_path, 'rb') as f:
+                contents = f.read()
+            if contents and not contents.endswith(b'\n'):
+                contents += b'\n'
+            merged_file.write(contents)
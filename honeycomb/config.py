@@ -1,7 +1,17 @@
 import rivet as rv
 
 _options = {
-    'verbose': True
+    'verbose': True,
+    'complex_type_inference': 'pandas',
+    'avro_codec': 'null',
+    'avro_max_workers': 1,
+    'inference_max_workers': 1
+}
+
+# Options that may only be set to specific values
+_option_choices = {
+    'complex_type_inference': ['pandas', 'arrow'],
+    'avro_codec': ['null', 'deflate', 'snappy']
 }
 
 
@@ -9,6 +19,9 @@ def set_option(opt, val):
     valid_options = _options.keys()
     if opt not in valid_options:
         raise ValueError('\'{}\' is not a valid honeycomb option .')
+    elif opt in _option_choices and val not in _option_choices[opt]:
+        raise ValueError('\'{}\' must be one of: {}'.format(
+            opt, ', '.join(_option_choices[opt])))
     else:
         _options[opt] = val
         if opt == 'verbose':
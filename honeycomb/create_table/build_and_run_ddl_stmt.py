@@ -1,9 +1,11 @@
-import rivet as rv
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from honeycomb import hive, meta
-from honeycomb.alter_table import add_partition
+from honeycomb import dtype_mapping, hive, lake_files, meta
+from honeycomb.alter_table import add_partition, gen_partition_path
+from honeycomb.bucketing import write_bucketed_df
 from honeycomb.create_table.common import handle_avro_filetype
 from honeycomb.ddl_building import build_create_table_ddl
+from honeycomb.file_writing import write_df
 from honeycomb.inform import inform
 
 
@@ -11,7 +13,10 @@ def build_and_run_ddl_stmt(df, table_name, schema, col_defs,
                            storage_type, bucket, path, filename,
                            col_comments=None, table_comment=None,
                            partitioned_by=None, partition_values=None,
-                           auto_upload_df=True, avro_schema=None):
+                           auto_upload_df=True, avro_schema=None,
+                           sort_by=None, bucketed_by=None, num_buckets=None,
+                           sorted_by=None, avro_schema_url=False,
+                           compression=None):
     """
     After preparation is performed in other calling functions,
     this function actually generates a CREATE TABLE command and runs it,
@@ -50,34 +55,134 @@ def build_and_run_ddl_stmt(df, table_name, schema, col_defs,
         avro_schema (dict, optional):
             Schema to use when writing a DataFrame to an Avro file. If not
             provided, one will be auto-generated.
+        sort_by (list<str>, optional):
+            Columns that the table's files are sorted by. Recorded in the
+            table's properties, so that appends can sort by them as well
+        bucketed_by (list<str>, optional):
+            Columns to bucket the table by. If provided, the DataFrame is
+            written as one file per bucket
+        num_buckets (int, optional):
+            The number of buckets to divide the table into
+        sorted_by (list<str>, optional):
+            Columns that rows within each bucket are sorted by
+        avro_schema_url (bool, default False):
+            Whether to reference the Avro schema of an Avro table with
+            'avro.schema.url' rather than embedding it as a literal
+        compression (str, optional):
+            The codec to compress the table's files with. Recorded in the
+            table's properties, so that appends use it as well
     """
     # Gets settings to pass to rivet on how to write the files in a
     # Hive-readable format
-    storage_settings = meta.storage_type_specs[storage_type]['settings']
+    storage_settings = dict(
+        meta.storage_type_specs[storage_type]['settings'])
 
     # tblproperties is for additional metadata to be provided to Hive
     # for the table. Generally, it is not needed
     tblproperties = {}
+    if sort_by:
+        tblproperties[meta.sort_by_tblproperty] = ','.join(sort_by)
+    if bucketed_by:
+        # Rows are assigned to buckets the way version 2 of Hive's
+        # bucketing does it, so the table must be declared as such
+        tblproperties['bucketing_version'] = '2'
+    if compression:
+        tblproperties.update(
+            meta.get_compression_tblproperties(storage_type, compression))
+        storage_settings.update(
+            meta.get_compression_settings(storage_type, tblproperties))
 
     if storage_type == 'avro':
         storage_settings, tblproperties = handle_avro_filetype(
-            df, storage_settings, tblproperties, avro_schema, col_comments)
+            df, storage_settings, tblproperties, avro_schema, col_comments,
+            schema_bucket=bucket if avro_schema_url else None)
+    elif (storage_type == 'parquet' and auto_upload_df and
+          dtype_mapping.has_narrow_db_dtypes(col_defs)):
+        storage_settings['schema'] = dtype_mapping.map_db_to_arrow_schema(
+            df, col_defs)
+        df = dtype_mapping.prep_df_for_arrow_schema(
+            df, storage_settings['schema'])
+    elif (storage_type == 'csv' and auto_upload_df and
+          dtype_mapping.has_complex_db_dtypes(col_defs)):
+        # Fields of structs in CSV files are identified by their position,
+        # so they are written in the order they are declared in
+        storage_settings['schema'] = dtype_mapping.map_db_to_arrow_schema(
+            df, col_defs)
 
     full_path = '/'.join([bucket, path])
     create_table_ddl = build_create_table_ddl(table_name, schema, col_defs,
                                               col_comments, table_comment,
                                               storage_type, partitioned_by,
-                                              full_path, tblproperties)
+                                              full_path, tblproperties,
+                                              bucketed_by, num_buckets,
+                                              sorted_by)
     inform(create_table_ddl)
-    hive.run_lake_query(create_table_ddl, engine='hive')
 
+    # The table is new, so the partition is added at its default path,
+    # which is known before the partition is
+    upload_path = path
     if partitioned_by and partition_values:
-        path += add_partition(table_name, schema, partition_values)
-    path += filename
+        upload_path += gen_partition_path(partition_values)
 
-    if auto_upload_df:
-        # Creating the table doesn't populate it with data. Unless
-        # auto_upload_df == False, we now need to write the DataFrame to a
-        # file and upload it to S3
-        _ = rv.write(df, path, bucket,
-                     show_progressbar=False, **storage_settings)
+    # Creating the table doesn't populate it with data. Unless
+    # auto_upload_df == False, we now need to write the DataFrame to a
+    # file and upload it to S3. Neither depends on the other, so the
+    # DataFrame is written and uploaded while the table is being created
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        upload = None
+        if auto_upload_df:
+            upload = executor.submit(
+                upload_df, df, bucket, upload_path, filename, storage_type,
+                storage_settings, bucketed_by, num_buckets, sorted_by,
+                col_defs)
+
+        table_created = False
+        try:
+            hive.run_lake_query(create_table_ddl, engine='hive')
+            table_created = True
+            if partitioned_by and partition_values:
+                add_partition(table_name, schema, partition_values)
+            if upload is not None:
+                upload.result()
+        except Exception as e:
+            # Neither the table nor its files are left half-created, so
+            # that the call can be retried
+            if upload is not None:
+                wait([upload])
+                delete_uploaded_files(bucket, upload_path, filename,
+                                      bucketed_by)
+            if table_created:
+                hive.run_lake_query(
+                    'DROP TABLE IF EXISTS {}.{}'.format(schema, table_name),
+                    engine='hive')
+            raise e
+
+
+def upload_df(df, bucket, path, filename, storage_type, storage_settings,
+              bucketed_by, num_buckets, sorted_by, col_defs=None):
+    """
+    Writes a DataFrame to a table's location, as one file per bucket if the
+    table is bucketed
+    """
+    if bucketed_by:
+        write_bucketed_df(df, bucket, path, storage_type,
+                          storage_settings, bucketed_by, num_buckets,
+                          sorted_by, col_defs=col_defs)
+    else:
+        write_df(df, path + filename, bucket, storage_type,
+                 storage_settings)
+
+
+def delete_uploaded_files(bucket, path, filename, bucketed_by):
+    """
+    Deletes the files written by 'upload_df'. Tables are only created at
+    empty locations, so every file under a bucketed table's path is one
+    of its buckets
+    """
+    s3 = lake_files.get_s3_client()
+    if bucketed_by:
+        keys = [file['key'] for file in
+                lake_files.list_data_files(bucket, path, s3)]
+    else:
+        keys = [path + filename]
+    lake_files.delete_files(bucket, keys, s3)
@@ -1,11 +1,14 @@
+import hashlib
 import json
 import os
 
-import pandavro as pdx
+import rivet as rv
 
-from honeycomb import check, dtype_mapping
+from honeycomb import check, dtype_mapping, lake_files
+from honeycomb.config import get_option
 from honeycomb.ddl_building import (restructure_comments_for_avro,
                                     add_comments_to_avro_schema)
+from honeycomb.file_writing import infer_avro_schema
 from honeycomb.__danger import __nuke_table
 
 
@@ -16,24 +19,37 @@ schema_to_zone_bucket_map = {
     'curated': os.getenv('HC_CURATED_ZONE_BUCKET')
 }
 
+# Avro schemas referenced by URL are stored under this prefix of the bucket
+# containing their table, named by the hash of their contents. The leading
+# underscore keeps Hive from treating the prefix as table data
+avro_schema_path = '_avro_schemas/'
+
 
 def handle_avro_filetype(df, storage_settings, tblproperties,
-                         avro_schema, col_comments):
+                         avro_schema, col_comments, schema_bucket=None):
     """
     Special behavior for DataFrames to be saved in the Avro format.
     Generates the Avro schema once and uses it twice, to avoid
     needing two separate generation processes.
+
+    If 'schema_bucket' is provided, the schema is uploaded to that bucket
+    and referenced with 'avro.schema.url', rather than being embedded in
+    the table's properties as 'avro.schema.literal'. See 'upload_avro_schema'
     """
     if avro_schema is None:
-        avro_schema = pdx.schema_infer(df)
+        avro_schema = infer_avro_schema(df)
     if col_comments is not None:
         avro_col_comments = restructure_comments_for_avro(col_comments)
         avro_schema = add_comments_to_avro_schema(avro_schema,
                                                   avro_col_comments)
 
-    # Adding the Avro schema as a string literal to the tblproperties
-    tblproperties['avro.schema.literal'] = json.dumps(
-        avro_schema, indent=4).replace("'", "\\\\'")
+    if schema_bucket is not None:
+        tblproperties['avro.schema.url'] = upload_avro_schema(avro_schema,
+                                                              schema_bucket)
+    else:
+        # Adding the Avro schema as a string literal to the tblproperties
+        tblproperties['avro.schema.literal'] = json.dumps(
+            avro_schema, indent=4).replace("'", "\\\\'")
 
     # So pandavro doesn't have to infer the schema a second time
     storage_settings['schema'] = avro_schema
@@ -41,6 +57,27 @@ def handle_avro_filetype(df, storage_settings, tblproperties,
     return storage_settings, tblproperties
 
 
+def upload_avro_schema(avro_schema, bucket):
+    """
+    Uploads an Avro schema to S3 as an '.avsc' file, named by the hash of
+    its contents. Identical schemas - including those of other tables in
+    the same bucket - share a single file, which is only uploaded once.
+
+    Args:
+        avro_schema (dict): The schema to upload
+        bucket (str): The bucket containing the schema's table
+    Returns:
+        str: The S3 URL of the uploaded schema
+    """
+    schema_json = json.dumps(avro_schema, sort_keys=True,
+                             separators=(',', ':'))
+    key = '{}{}.avsc'.format(
+        avro_schema_path, hashlib.sha256(schema_json.encode()).hexdigest())
+    if not rv.exists(key, bucket):
+        lake_files.put_object(bucket, key, schema_json.encode())
+    return 's3://{}/{}'.format(bucket, key)
+
+
 def handle_existing_table(table_name, schema, overwrite):
     """
     Checks if a table name already exists in the lake. If it does,
@@ -155,12 +192,42 @@ def get_storage_type_from_filename(filename):
 
 
 def prep_df_and_col_defs(df, dtypes, timezones, schema,
-                         storage_type):
+                         storage_type, infer_sample=None, narrow_types=False,
+                         date_cols=None, decimals=None, schema_cache=None):
     """
     Applies any specified dtypes to df and any special handling that certain
     data types require. Also creates a mapping from the df's pandas dtypes
-    to the corresponding hive dtypes
+    to the corresponding hive dtypes, or reuses the mapping cached for
+    DataFrames of the same structure if 'schema_cache' is provided
     """
     df = dtype_mapping.special_dtype_handling(df, dtypes, timezones, schema)
-    col_defs = dtype_mapping.map_pd_to_db_dtypes(df, storage_type)
+
+    mapping_options = {'narrow_types': narrow_types, 'date_cols': date_cols,
+                       'decimals': decimals}
+    cache_options = dict(
+        mapping_options, storage_type=storage_type,
+        complex_type_inference=get_option('complex_type_inference'))
+    col_defs = None
+    if schema_cache is not None:
+        col_defs = schema_cache.get_col_defs(df, **cache_options)
+    if col_defs is None:
+        col_defs = dtype_mapping.map_pd_to_db_dtypes(
+            df, storage_type, infer_sample, **mapping_options)
+        if schema_cache is not None:
+            schema_cache.put_col_defs(df, col_defs, **cache_options)
     return df, col_defs
+
+
+def get_avro_schema(df, schema_cache=None):
+    """
+    Infers the Avro schema to write a DataFrame with, or reuses the schema
+    cached for DataFrames of the same structure if 'schema_cache' is provided
+    """
+    avro_schema = None
+    if schema_cache is not None:
+        avro_schema = schema_cache.get_avro_schema(df)
+    if avro_schema is None:
+        avro_schema = infer_avro_schema(df)
+        if schema_cache is not None:
+            schema_cache.put_avro_schema(df, avro_schema)
+    return avro_schema
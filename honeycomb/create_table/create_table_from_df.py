@@ -5,12 +5,13 @@ import sys
 import rivet as rv
 
 from honeycomb import meta
+from honeycomb.bucketing import validate_bucketing
 from honeycomb.create_table.build_and_run_ddl_stmt import (
     build_and_run_ddl_stmt
 )
 from honeycomb.create_table.common import (
     check_for_comments, check_for_allowed_overwrite,
-    get_storage_type_from_filename, handle_existing_table,
+    get_avro_schema, get_storage_type_from_filename, handle_existing_table,
     prep_df_and_col_defs, schema_to_zone_bucket_map
 )
 from honeycomb.orc import create_orc_table_from_df
@@ -22,7 +23,12 @@ def create_table_from_df(df, table_name, schema=None,
                          timezones=None, copy_df=True,
                          partitioned_by=None, partition_values=None,
                          overwrite=False, auto_upload_df=True,
-                         avro_schema=None, hive_functions=None):
+                         avro_schema=None, hive_functions=None,
+                         sort_by=None, bucketed_by=None, num_buckets=None,
+                         sorted_by=None, infer_sample=None,
+                         narrow_types=False, date_cols=None, decimals=None,
+                         schema_cache=None, avro_schema_url=False,
+                         compression=None):
     """
     Uploads a dataframe to S3 and establishes it as a new table in Hive.
 
@@ -76,6 +82,61 @@ def create_table_from_df(df, table_name, schema=None,
             Specifications on what hive functions to apply to which columns.
             Only usable when working with ORC tables. See 'orc.py'
             for additional documentation
+        sort_by (list<str>, optional):
+            Columns to sort the DataFrame by before it is written, which
+            allows query engines to skip reading data that cannot match
+            filters on those columns. Recorded in the table's properties, so
+            that future appends are sorted by the same columns automatically
+        bucketed_by (list<str>, optional):
+            Columns to bucket the table by. Rows are assigned to buckets
+            the same way Hive assigns them, and each bucket is written to
+            its own file, allowing Hive to use bucketed joins. Only integer
+            and string columns are supported
+        num_buckets (int, optional):
+            Required if 'bucketed_by' is used. The number of buckets to
+            divide the table into
+        sorted_by (list<str>, optional):
+            Columns that rows within each bucket are sorted by. Only used
+            if 'bucketed_by' is used
+        infer_sample (int or float, optional):
+            If provided, the Hive types of ARRAY and STRUCT columns are
+            inferred from a sample of this many values - or this fraction
+            of values, if a float - taken from the start, end and random
+            points of each column. The rest of each column is then checked
+            against the sampled type, and if any value does not conform, the
+            type is inferred from the full column instead. Useful for
+            DataFrames with many rows of deeply nested values
+        narrow_types (bool, default False):
+            Whether to give numeric columns the narrowest Hive type that
+            holds their dtype - TINYINT, SMALLINT, or INT for 8, 16, and
+            32-bit integers, and FLOAT for 32-bit floats - rather than
+            widening them to BIGINT or DOUBLE. Only usable with Parquet and
+            ORC tables
+        date_cols (list<str>, optional):
+            Datetime columns with no time component, to be stored as DATE
+            rather than TIMESTAMP. Only usable with Parquet and ORC tables
+        decimals (dict<str:tuple<int, int>>, optional):
+            Dictionary from float or decimal.Decimal columns to the precision
+            and scale to store them as DECIMAL with. Floats are rounded to
+            the scale. Only usable with Parquet and ORC tables
+        schema_cache (honeycomb.SchemaCache, optional):
+            A cache of the column definitions and Avro schemas inferred for
+            previous DataFrames. If the DataFrame has the same structure as
+            one already inferred, and a sample of its values conforms to the
+            cached result, inference is skipped. See 'schema_cache.py'
+        avro_schema_url (bool, default False):
+            Whether to upload the Avro schema of an Avro table as an '.avsc'
+            file in the table's bucket, and reference it with
+            'avro.schema.url', rather than embedding it in the table's
+            properties. Keeps the metastore small for wide or deeply nested
+            tables. Identical schemas are only uploaded once
+        compression (str, optional):
+            The codec to compress the table's files with, rather than the
+            storage format's default. Only usable with Parquet ('none',
+            'snappy', 'gzip', 'zstd'), ORC ('none', 'zlib', 'snappy', 'lz4',
+            'zstd') and Avro ('none', 'deflate', 'snappy', 'zstd', 'bzip2',
+            'xz') tables. Recorded in the table's properties, so that
+            future appends are compressed with the same codec automatically
     """
     # Less memory efficient, but prevents modification of original df
     if copy_df:
@@ -97,6 +158,9 @@ def create_table_from_df(df, table_name, schema=None,
                 'If using "partitioned_by" and "auto_upload_df" is True, '
                 'values must be passed to "partition_values" as well.')
 
+    if bucketed_by or num_buckets:
+        validate_bucketing(df, bucketed_by, num_buckets, sorted_by)
+
     if schema == 'curated':
         check_for_comments(table_comment, df.columns, col_comments)
         check_for_allowed_overwrite(overwrite)
@@ -117,21 +181,35 @@ def create_table_from_df(df, table_name, schema=None,
             'attempting table creation.').format(bucket, path))
 
     storage_type = get_storage_type_from_filename(filename)
+    if avro_schema_url and storage_type != 'avro':
+        raise ValueError(
+            '"avro_schema_url" can only be used with Avro tables.')
+    if compression:
+        # Validated before anything is written
+        meta.get_compression_tblproperties(storage_type, compression)
     df, col_defs = prep_df_and_col_defs(
-        df, dtypes, timezones, schema, storage_type)
+        df, dtypes, timezones, schema, storage_type, infer_sample,
+        narrow_types, date_cols, decimals, schema_cache)
+    if storage_type == 'avro' and avro_schema is None and auto_upload_df:
+        avro_schema = get_avro_schema(df, schema_cache)
+    if sort_by:
+        df = meta.sort_df(df, sort_by)
 
     if storage_type == 'orc' and auto_upload_df:
         create_orc_table_from_df(df, table_name, schema, col_defs,
                                  bucket, path, filename,
                                  col_comments, table_comment,
                                  partitioned_by, partition_values,
-                                 hive_functions)
+                                 hive_functions, sort_by, bucketed_by,
+                                 num_buckets, sorted_by, compression)
     else:
         build_and_run_ddl_stmt(df, table_name, schema, col_defs,
                                storage_type, bucket, path, filename,
                                col_comments, table_comment,
                                partitioned_by, partition_values,
-                               auto_upload_df, avro_schema)
+                               auto_upload_df, avro_schema, sort_by,
+                               bucketed_by, num_buckets, sorted_by,
+                               avro_schema_url, compression)
 
 
 def confirm_ordered_dicts():
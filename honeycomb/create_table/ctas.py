@@ -105,7 +105,8 @@ def ctas(select_stmt, table_name, schema=None,
         # in the new table for building DDL and adding comments.
         # Useful in queries that involve JOINing, so you don't have to build
         # that column list yourself.
-        col_defs = describe_table(view_name, schema=temp_schema)
+        col_defs = describe_table(view_name, schema=temp_schema).rename(
+            columns={'data_type': 'dtype'})
 
         if schema == 'curated':
             check_for_comments(
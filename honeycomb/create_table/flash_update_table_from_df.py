@@ -1,23 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
+import re
 
-import rivet as rv
-
-from honeycomb import check, hive, meta
+from honeycomb import check, dtype_mapping, hive, lake_files, meta
+from honeycomb.alter_table import (
+    add_partition, set_partition_location, set_table_location
+)
+from honeycomb.append_table import get_storage_settings, get_table_avro_schema
 from honeycomb.create_table.common import (
     check_for_comments, get_storage_type_from_filename,
     handle_avro_filetype, prep_df_and_col_defs
 )
 from honeycomb.ddl_building import build_create_table_ddl
+from honeycomb.file_writing import write_df
 from honeycomb.inform import inform
 
 
+"""
+Notes on flash updates
+
+A flash update replaces all of the data in a table (or one of its
+partitions) with a DataFrame, while queries of the table continue to run.
+
+How data is swapped:
+    a) The DataFrame is written to a new, versioned folder within the
+       original location of the table/partition, split across as many files
+       as needed, which are uploaded in parallel. Queries still only read
+       the original files.
+    b) If the DataFrame's columns can be written with the table's types
+       (see 'col_defs_match'), the table/partition is pointed at the new
+       folder with a single 'SET LOCATION' statement, so queries read
+       either every original file or every new file. If the columns
+       have changed, the table is instead dropped and recreated at the new
+       folder - the data is already in place, so the table is only missing
+       between those two statements.
+    c) The original files are deleted in the background, once the swap is
+       complete.
+
+Only the tables' own properties that honeycomb records - sort columns and
+compression - are carried over when a table is recreated.
+"""
+
+# Deletes the files replaced by flash updates in the background. Its thread
+# is joined at exit, so cleanups are completed before the process exits
+cleanup_executor = ThreadPoolExecutor(max_workers=1)
+
+
 def flash_update_table_from_df(df, table_name, schema=None, dtypes=None,
                                table_comment=None, col_comments=None,
-                               timezones=None, copy_df=True):
+                               timezones=None, copy_df=True,
+                               partition_values=None, filename=None,
+                               max_rows_per_file=None, max_workers=8):
     """
-    Overwrites single-file table with minimal table downtime.
-    Similar to 'create_table_from_df' with overwrite=True, but only usable
-    when the table only consists of one underlying file
+    Overwrites the data in a table, or in one of its partitions, with
+    minimal table downtime. Similar to 'create_table_from_df' with
+    overwrite=True, but the table's data is replaced in a single swap.
+    See notes above for further details.
 
     Args:
         df (pd.DataFrame): The DataFrame to create the table from.
@@ -41,6 +79,23 @@ def flash_update_table_from_df(df, table_name, schema=None, dtypes=None,
             the original df passed in will be modified as well - twice as
             memory efficient, but may be undesirable if the df is needed
             again later
+        partition_values (dict<str:str>, optional):
+            Required if the table is partitioned. The partition whose data
+            is to be replaced. If it does not exist, it is created. The
+            columns of a partitioned table cannot be changed
+        filename (str, optional):
+            Name to store the data under. If not provided, the name of one
+            of the table's current files is reused, or one is generated if
+            writing to the experimental zone
+        max_rows_per_file (int, optional):
+            If provided, the DataFrame is split into files of at most this
+            many rows, with an index added to the name of each file
+        max_workers (int, default 8):
+            The maximum number of files to be uploaded at once
+    Returns:
+        concurrent.futures.Future:
+            The deletion of the replaced files, which happens in the
+            background. Can be waited on with its 'result' method
     """
     # Less memory efficient, but prevents modification of original df
     if copy_df:
@@ -63,57 +118,229 @@ def flash_update_table_from_df(df, table_name, schema=None, dtypes=None,
         )
 
     table_metadata = meta.get_table_metadata(table_name, schema)
-    bucket = table_metadata['bucket']
-    path = meta.ensure_path_ends_w_slash(table_metadata['path'])
-
-    objects_present = rv.list_objects(path, bucket)
-
-    if len(objects_present) > 1:
-        # Flash updates are supposed to feel as close to atomic as possible.
-        # Multi-file operations interfere with this.
+    storage_type = table_metadata['storage_type']
+    tblproperties = table_metadata.get('tblproperties') or {}
+    if storage_type == 'orc':
+        # ORC files are written by Hive, which cannot write to a location
+        # that the table is not yet pointed at
         raise ValueError(
-            'Flash update functionality is only available on '
-            'tables that only consist of one underlying file.')
-    if meta.is_partitioned_table(table_name, schema):
-        # Difficult to deterministically restore partitions based on new data
+            'Flash update functionality is not available on ORC tables.')
+    if table_metadata.get('bucketing'):
         raise ValueError(
             'Flash update functionality is not available on '
-            'partitioned tables.')
+            'bucketed tables.')
 
-    if objects_present:
-        filename = objects_present[0]
-    else:
-        filename = meta.gen_filename_if_allowed(schema)
-    path += filename
+    is_partitioned = meta.is_partitioned_table(table_name, schema)
+    if is_partitioned and not partition_values:
+        raise ValueError(
+            'The partition to update must be provided in '
+            '"partition_values" when updating a partitioned table.')
+    elif partition_values and not is_partitioned:
+        raise ValueError('Table \'{}.{}\' is not partitioned.'.format(
+            schema, table_name))
+
+    bucket = table_metadata['bucket']
+    path = meta.ensure_path_ends_w_slash(table_metadata['path'])
+    if partition_values:
+        if check.partition_existence(table_name, schema, partition_values):
+            bucket, path = meta.get_partition_s3_location(
+                table_name, schema, partition_values)
+            path = meta.ensure_path_ends_w_slash(path)
+        else:
+            path += add_partition(table_name, schema, partition_values)
+
+    s3 = lake_files.get_s3_client()
+    old_files = lake_files.list_data_files(bucket, path, s3)
+    if filename is None:
+        if old_files:
+            filename = old_files[0]['key'][len(path):]
+        else:
+            filename = meta.gen_filename_if_allowed(schema, storage_type)
+    if get_storage_type_from_filename(filename) != storage_type:
+        raise ValueError(
+            'The type specified in the filename does not match the '
+            'filetype of the table.')
 
-    storage_type = get_storage_type_from_filename(filename)
+    # Partition columns are not stored in the partition's files
+    df = df.drop(columns=[col for col in df.columns
+                          if partition_values and
+                          col.lower() in partition_values])
     df, col_defs = prep_df_and_col_defs(
         df, dtypes, timezones, schema, storage_type)
+    swap_location = col_defs_match(df, col_defs, table_metadata['col_defs'])
+    if swap_location:
+        # Columns are written in the table's order, as they are when
+        # appending to it
+        lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+        df = df[[lower_to_orig_col_map[normalize_col_name(col_name)]
+                 for col_name in table_metadata['col_defs']['col_name']]]
+    if is_partitioned and not swap_location:
+        raise ValueError(
+            'The columns of the DataFrame do not match those of the table. '
+            'The columns of a partitioned table cannot be changed by a '
+            'flash update.')
 
-    # Gets settings to pass to rivet on how to write the files in a
-    # Hive-readable format
-    storage_settings = meta.storage_type_specs[storage_type]['settings']
+    sort_by = meta.get_sort_by(tblproperties)
+    if sort_by:
+        df = meta.sort_df(df, sort_by)
 
-    # tblproperties is for additional metadata to be provided to Hive
-    # for the table. Generally, it is not needed
-    tblproperties = {}
+    # Files are written with the table's own types if it is being kept,
+    # and with the DataFrame's if it is being recreated
+    target = {
+        'storage_type': storage_type,
+        'tblproperties': tblproperties,
+        'col_defs': table_metadata['col_defs'] if swap_location else col_defs
+    }
+    target['narrow_types'] = bool(
+        storage_type == 'parquet' and
+        dtype_mapping.has_narrow_db_dtypes(target['col_defs']))
+    if target['narrow_types']:
+        df = dtype_mapping.prep_df_for_arrow_schema(
+            df, dtype_mapping.map_db_to_arrow_schema(df, target['col_defs']))
 
+    new_tblproperties = {
+        prop_name: prop_val for prop_name, prop_val in tblproperties.items()
+        if prop_name in [meta.sort_by_tblproperty,
+                         meta.compression_tblproperties.get(storage_type)]}
+    avro_schema = None
     if storage_type == 'avro':
-        storage_settings, tblproperties = handle_avro_filetype(
-            df, storage_settings, tblproperties, col_comments)
-
-    full_path = '/'.join([bucket, path])
-    create_table_ddl = build_create_table_ddl(table_name, schema, col_defs,
-                                              col_comments, table_comment,
-                                              storage_type,
-                                              partitioned_by=None,
-                                              full_path=full_path,
-                                              tblproperties=tblproperties)
+        if swap_location:
+            avro_schema = get_table_avro_schema(target, df)
+        else:
+            storage_settings, new_tblproperties = handle_avro_filetype(
+                df, {}, new_tblproperties, None, col_comments)
+            avro_schema = storage_settings['schema']
+
+    new_path = meta.gen_versioned_path(path)
+    try:
+        write_df_to_files(df, new_path, bucket, filename, target,
+                          avro_schema, max_rows_per_file, max_workers)
+
+        if not swap_location:
+            recreate_table(table_name, schema, col_defs, col_comments,
+                           table_comment, storage_type, bucket, new_path,
+                           new_tblproperties)
+        elif partition_values:
+            set_partition_location(table_name, schema, partition_values,
+                                   bucket, new_path)
+        else:
+            set_table_location(table_name, schema, bucket, new_path)
+    except Exception as e:
+        # The table/partition has not been swapped to the new folder,
+        # so anything written to it can be safely discarded
+        written_keys = [file['key'] for file in
+                        lake_files.list_data_files(bucket, new_path, s3)]
+        lake_files.delete_files(bucket, written_keys, s3)
+        raise e
+
+    if swap_location and table_comment:
+        set_comment_query = (
+            'ALTER TABLE {}.{} SET TBLPROPERTIES (\'comment\'=\'{}\')'.format(
+                schema, table_name, table_comment))
+        inform(set_comment_query)
+        hive.run_lake_query(set_comment_query, engine='hive')
+
+    return cleanup_executor.submit(
+        lake_files.delete_files, bucket,
+        [file['key'] for file in old_files], s3)
+
+
+def col_defs_match(df, col_defs, table_col_defs):
+    """
+    Checks whether a DataFrame can be written with a table's column
+    definitions, so that the table can be kept. The DataFrame must have the
+    same columns as the table, in any order, and each must either have the
+    type generated for it or be convertible to the table's type, as when
+    appending to a table with narrow types. Differences in case, whitespace,
+    and quoting are ignored, as Hive describes types differently than
+    honeycomb generates them.
+
+    Args:
+        df (pd.DataFrame): The prepared DataFrame
+        col_defs (pd.DataFrame): The column definitions generated for it
+        table_col_defs (pd.DataFrame): The table's column definitions
+    Returns:
+        bool: Whether the table's column definitions can be kept
+    """
+    if table_col_defs is None:
+        return False
+
+    def to_dict(col_defs):
+        return {normalize_col_name(col_name): str(dtype)
+                for col_name, dtype
+                in zip(col_defs['col_name'], col_defs['dtype'])}
+
+    def normalize_dtype(dtype):
+        return re.sub(r'\s|`', '', dtype).lower()
+
+    db_dtypes = to_dict(col_defs)
+    table_db_dtypes = to_dict(table_col_defs)
+    if set(db_dtypes) != set(table_db_dtypes):
+        return False
+
+    lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+    return all(
+        normalize_dtype(db_dtypes[col]) == normalize_dtype(table_dtype) or
+        dtype_mapping.col_fits_db_dtype(df[lower_to_orig_col_map[col]],
+                                        table_dtype)
+        for col, table_dtype in table_db_dtypes.items())
+
+
+def normalize_col_name(col_name):
+    """Normalizes a column name the way Hive describes it"""
+    return str(col_name).strip('`').lower()
+
+
+def write_df_to_files(df, path, bucket, filename, target, avro_schema,
+                      max_rows_per_file, max_workers):
+    """
+    Writes a prepared DataFrame to one or more files in a folder, uploading
+    them in parallel
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        path (str): The folder to write the files to
+        bucket (str): The bucket to write the files to
+        filename (str): The name of the file, or the name to base the
+            names of the files on if the DataFrame is split
+        target (dict): The storage type, properties and column definitions
+            of the table being written to, for 'get_storage_settings'
+        avro_schema (dict): Schema to use if writing Avro files
+        max_rows_per_file (int): The maximum number of rows in each file
+        max_workers (int): The maximum number of files to upload at once
+    """
+    if not max_rows_per_file or len(df) <= max_rows_per_file:
+        chunks = [(filename, df)]
+    else:
+        filename_stem, extension = os.path.splitext(filename)
+        chunks = [
+            ('{}_{:05d}{}'.format(filename_stem, i, extension),
+             df.iloc[start:start + max_rows_per_file])
+            for i, start in enumerate(range(0, len(df), max_rows_per_file))]
+
+    storage_settings = get_storage_settings(target, avro_schema, df)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(write_df, chunk, path + chunk_filename,
+                                   bucket, target['storage_type'],
+                                   storage_settings)
+                   for chunk_filename, chunk in chunks]
+        for future in futures:
+            future.result()
+
+
+def recreate_table(table_name, schema, col_defs, col_comments,
+                   table_comment, storage_type, bucket, path,
+                   tblproperties):
+    """
+    Drops a table and immediately recreates it with new columns, at a
+    location its new data has already been written to
+    """
+    create_table_ddl = build_create_table_ddl(
+        table_name, schema, col_defs, col_comments, table_comment,
+        storage_type, partitioned_by=None,
+        full_path='/'.join([bucket, path]), tblproperties=tblproperties)
     inform(create_table_ddl)
     drop_table_stmt = 'DROP TABLE IF EXISTS {}.{}'.format(schema, table_name)
 
-    # Creating the table doesn't populate it with data. We now need to write
-    # the DataFrame to a file and upload it to S3
-    _ = rv.write(df, path, bucket, show_progressbar=False, **storage_settings)
     hive.run_lake_query(drop_table_stmt, engine='hive')
     hive.run_lake_query(create_table_ddl, engine='hive')
@@ -2,11 +2,18 @@ import re
 
 from honeycomb import meta
 
+# The keyword a type begins with, such as 'STRUCT' in 'STRUCT <a: BIGINT>'.
+# Types are parsed in place, by matching at a position in the type string,
+# so that parsing takes time linear in the length of the type
+db_dtype_keyword_regex = re.compile(r'\s*(\w+)\s*')
+empty_struct_regex = re.compile(r'\s*>')
+
 
 def build_create_table_ddl(table_name, schema, col_defs,
                            col_comments, table_comment, storage_type,
                            partitioned_by, full_path,
-                           tblproperties=None):
+                           tblproperties=None, bucketed_by=None,
+                           num_buckets=None, sorted_by=None):
     """
     Assembles the CREATE TABLE statement for the DataFrame being uploaded.
 
@@ -34,6 +41,12 @@ def build_create_table_ddl(table_name, schema, col_defs,
         tblproperties (str, optional):
             Any arguments or configurations to be provided in the TBLPROPERTIES
             section of the create table statement.
+        bucketed_by (list<str>, optional):
+            The columns to bucket the table by
+        num_buckets (int, optional):
+            The number of buckets to divide the table into
+        sorted_by (list<str>, optional):
+            The columns that rows within each bucket are sorted by
 
     Returns
         str: The assembled create table statement.
@@ -43,14 +56,12 @@ def build_create_table_ddl(table_name, schema, col_defs,
     create_table_ddl = """
 CREATE EXTERNAL TABLE {schema}.{table_name} (
     {col_defs}
-){table_comment}{partitioned_by}
+){table_comment}{partitioned_by}{bucketed_by}
 {storage_format_ddl}
 LOCATION 's3://{full_path}'{tblproperties}
     """.format(
         schema=schema,
         table_name=table_name,
-        # BUG: pd.Series truncates long strings output by to_string,
-        # have to cast to DataFrame first.
         col_defs=col_defs,
         table_comment=('\nCOMMENT \'{table_comment}\''.format(
             table_comment=table_comment)) if table_comment else '',
@@ -58,9 +69,12 @@ LOCATION 's3://{full_path}'{tblproperties}
             ['{} {}'.format(partition_name, partition_type)
              for partition_name, partition_type in partitioned_by.items()]))
             if partitioned_by else ''),
+        bucketed_by=('\n' + build_bucketing_ddl(bucketed_by, num_buckets,
+                                                sorted_by)
+                     if bucketed_by else ''),
         storage_format_ddl=meta.storage_type_specs[storage_type]['ddl'],
         full_path=full_path.rsplit('/', 1)[0] + '/',
-        tblproperties=('\nTBLPROPERTIES (\n  {}\n)'.format('\n  '.join([
+        tblproperties=('\nTBLPROPERTIES (\n  {}\n)'.format(',\n  '.join([
             '\'{}\'=\'{}\''.format(prop_name, prop_val)
             for prop_name, prop_val in tblproperties.items()]))
             if tblproperties else '')
@@ -69,9 +83,28 @@ LOCATION 's3://{full_path}'{tblproperties}
     return create_table_ddl
 
 
+def build_bucketing_ddl(bucketed_by, num_buckets, sorted_by=None):
+    """
+    Assembles the clause declaring a table's bucketing in a CREATE TABLE
+    statement
+
+    Args:
+        bucketed_by (list<str>): The columns to bucket the table by
+        num_buckets (int): The number of buckets
+        sorted_by (list<str>, optional):
+            The columns that rows within each bucket are sorted by
+    """
+    return 'CLUSTERED BY ({}){} INTO {} BUCKETS'.format(
+        ', '.join(bucketed_by),
+        ' SORTED BY ({})'.format(', '.join(sorted_by)) if sorted_by else '',
+        num_buckets)
+
+
 def format_col_defs(col_defs, col_comments):
     """
-    Formats col_defs as a string and inserts column comments into it
+    Formats col_defs as a string, with column comments inserted. Each column's
+    type is parsed into a tree of its nested fields, comments are attached to
+    the matching nodes, and the tree is rendered back to DDL in a single pass.
 
     Args:
         col_defs (pd.DataFrame)
@@ -83,315 +116,180 @@ def format_col_defs(col_defs, col_comments):
     Returns:
         str: col_defs as a string with column comments inserted
     """
+    cols = build_col_def_tree(col_defs)
     if col_comments is not None:
-        nested_col_comments = {key: value for key, value
-                               in col_comments.items()
-                               if '.' in key}
-        col_comments = {key: value for key, value
-                        in col_comments.items()
-                        if '.' not in key}
-
-        col_defs = add_comments_to_col_defs(col_defs, col_comments)
-    else:
-        nested_col_comments = None
-
-    col_defs = col_defs.to_string(header=False, index=False)
-
-    # Removing excess whitespace left by df.to_string()
-    col_defs = re.sub(
-        r' +',
-        ' ',
-        col_defs
-    )
+        add_comments_to_col_def_tree(cols, col_comments)
 
-    col_defs = col_defs.replace('\n', ',\n    ')
+    return ',\n    '.join(
+        '{} {}'.format(col['name'], render_field_ddl(col)) for col in cols)
 
-    if nested_col_comments:
-        col_defs = add_nested_col_comments(
-            col_defs, nested_col_comments)
 
-    return col_defs
-
-
-def add_comments_to_col_defs(col_defs, col_comments):
+def build_col_def_tree(col_defs):
     """
-    Iterates through a mapping from col names to comments, and adds the
-    comments to a new column on matching col names
+    Parses the type of each column in col_defs into a tree of its nested
+    fields. Every column or field is represented as a dict with the keys
+    'name', 'type' and 'comment', and every type as a dict with the key
+    'dtype', plus 'fields' for STRUCT types and 'element' for ARRAY types.
 
     Args:
         col_defs (pd.DataFrame)
             A DataFrame containing the columns 'col_name' and 'dtype',
             describing the dtype of each column in the DataFrame being uploaded
-        col_comments (dict<str:str>):
-            A mapping from column/field names to column comments to be applied
-            in the create statement
-
     Returns:
-        pd.DataFrame: col_defs with a 'comment' column appended and populated
+        list<dict>: The definition of each column
     """
-    for column, comment in col_comments.items():
-        col_defs.loc[col_defs['col_name'] == column, 'comment'] = comment
-
-    col_defs['comment'] = (
-        ' COMMENT \'' + col_defs['comment'].astype(str) + '\'')
-    return col_defs
+    return [{'name': col_name, 'type': parse_db_dtype(str(dtype)),
+             'comment': None}
+            for col_name, dtype in zip(col_defs['col_name'],
+                                       col_defs['dtype'])]
 
 
-def add_nested_col_comments(col_defs, nested_col_comments):
+def parse_db_dtype(db_dtype):
     """
-    Adds nested column comments to the fully formatted column
-    definition section of the create table statement. Nested column/field
-    comments must be handled quite differently, and the least intrusive method
-    of doing so is to parse and iterate through the otherwise completed DDL
+    Parses a Hive type into a tree of its nested fields. See
+    'build_col_def_tree' for the structure of the tree.
 
     Args:
-        col_defs (str)
-            The fully formatted, translated-from-dataframe column definition
-            section of a DDL statement.
-        nested_col_comments (dict<str:str>):
-            A mapping from nested column/field names to column comments to
-            be applied in the create statement
+        db_dtype (str): The type to parse, such as 'STRUCT <a: BIGINT>'
     Returns:
-        str: The create table statement with nested column comments added
-    """
-    for col, comment in nested_col_comments.items():
-        # How many layers deep we need to go to add a comment
-        total_nesting_levels = col.count('.')
-        current_nesting_level = 0
-        block_start = 0
-        block_end = -1
-        col_defs = scan_ddl_level(col, comment, col_defs,
-                                  block_start, block_end,
-                                  current_nesting_level,
-                                  total_nesting_levels)
-    return col_defs
-
-
-def scan_ddl_level(col, comment, col_defs,
-                   level_block_start, level_block_end,
-                   current_nesting_level, total_nesting_levels):
-    """
-    Scans through a 'level' of DDL in the column definitions of a create
-    table statement. A 'level', in this case, represents an indentation
-    level in a SQL string (if it were properly formatted, which is not
-    required for this function). So, a level includes all columns
-    and their types UNLESS a column/field contains structs or arrays
-    of structs. In that case, the nested fields constitute their own level,
-    and are not included in the original level.
-
-    This function operates on 'blocks' at a time. A 'block', in this case,
-    represents a section of col_defs that does not contain any definitions
-    of nested fields. If a level is being scanned and nested field definitions
-    are found, the function scans until the nested definition begins (AKA
-    where the first 'block' ends), and then resume after the nested definition
-    ends (where the next 'block' begins).
-
-    If a deeper level of nesting is encountered while scanning and the
-    column/field we're searching for is supposed to be in a deeper layer, a
-    scan of that encountered deeper level will automatically begin (if all
-    prerequisite parent column/field matches have been satisfied).
-
-    Args:
-        col (str):
-            The full name of the column/field definition being searched for,
-            including parent column names in the prefix.
-        comment (str):
-            The comment to be added to the column/field being searched for
-        col_defs (str):
-            The fully formatted, translated-from-dataframe column definition
-            section of a DDL statement.
-        level_block_start (int):
-            Index of col_defs that the current block starts at
-        level_block_end (int):
-            Index of col_defs that the current block ends at
-        current_nesting_level (int):
-            The level of nesting currently being scanned through. If
-            current_nesting_level == total_nesting_levels, we have reached
-            the desired level of nesting to find the column/field
-            to add a comment to
-        total_nesting_levels (int):
-            How many levels of nesting are required to scan to find the
-            column/field definition being serached for. Determined by
-            how many '.' characters are in 'col'
-
-    Returns:
-        str: col_defs with the nested column comment for col inserted
-
+        dict: The parsed type
     Raises:
-        ValueError:
-            If a definition for a col or one of its sub-fields was not found
+        ValueError: If the type is malformed
     """
-    next_level_exists = True
-    while next_level_exists:
-        # Only want to search for the subfield that would exist at this level
-        col_at_level = col.split('.')[current_nesting_level]
-        col_at_level = re.escape(col_at_level)
-
-        # Where the first block of the next level of nesting begins
-        # AKA, the end of the current block of the current level
-        next_level_block_start = col_defs.find(
-            '<', level_block_start, level_block_end)
-
-        # If another level of nesting exists somewhere in the remainder of
-        # the col_defs string
-        if next_level_block_start >= 0:
-            # Where the next level of nesting ends
-            # AKA, the start point of the next block of the current level
-            next_level_block_end = find_matching_bracket(
-                col_defs, next_level_block_start)
-
-        # No more nesting to be found - the current block will take us
-        # to the end of the string. Without a match in the current block,
-        # there is no matching defined column to what is specified in
-        # col_comments, and an error will be raised
-        else:
-            next_level_exists = False
-            next_level_block_start = level_block_end + 1
-            next_level_block_end = -1
-
-        # Check if there is a match for the current column level in the
-        # current block of this level
-        match = re.search(
-            r'(?:^|\s*|,)({}[: ])'.format(col_at_level),
-            col_defs[level_block_start:next_level_block_start])
-
-        # Match found in current block
-        if match:
-            col_loc = match.start(1) + level_block_start
-            return handle_nested_col_match(col, comment, col_at_level, col_loc,
-                                           col_defs,
-                                           next_level_block_start,
-                                           next_level_block_end,
-                                           current_nesting_level,
-                                           total_nesting_levels)
-
-        # No match, but there may be another block on the level to search
-        else:
-            level_block_start = next_level_block_end + 1
+    dtype, end = parse_db_dtype_at(db_dtype, 0)
+    if db_dtype[end:].strip():
+        raise ValueError(
+            'Unexpected characters at position {} of type {}'.format(
+                end, db_dtype))
+    return dtype
 
-    # No match, no additional blocks on current level to search
-    raise ValueError(
-        'Sub-field {} not found in definition for {}'.format(
-            col_at_level,
-            col
-        ))
 
-
-def handle_nested_col_match(col, comment, col_at_level, col_loc, col_defs,
-                            next_level_block_start, next_level_block_end,
-                            current_nesting_level, total_nesting_levels):
+def parse_db_dtype_at(db_dtype, pos):
     """
-    Determines next actions when a match is found for col_at_level. If
-    we have reached the desired level of nesting, insert the comment. If we
-    haven't reached the desired level of nesting yet, then begin searching
-    the next level - as long as it's been properly defined.
+    Parses the Hive type beginning at position 'pos' of a type string
 
-    Args:
-        col (str):
-            The full name of the column/field definition being searched for,
-            including parent column names in the prefix.
-        comment (str):
-            The comment to be added to the column/field being searched for
-        col_loc (int):
-            Index of col_defs that the defintion of col begins at
-        col_defs (str):
-            The fully formatted, translated-from-dataframe column definition
-            section of a DDL statement.
-        next_level_block_start (int):
-            Index of col_defs that the first block of the next level starts at
-        next_level_block_end (int):
-            Index of col_defs that the first block block of the next level
-            ends at
-        current_nesting_level (int):
-            The level of nesting currently being scanned through. If
-            current_nesting_level == total_nesting_levels, we have reached
-            the desired level of nesting to find the column/field
-            to add a comment to
-        total_nesting_levels (int):
-            How many levels of nesting are required to scan to find the
-            column definition being serached for. Determined by how many '.'
-            characters are in 'col'
+    Returns:
+        tuple<dict, int>:
+            The parsed type, and the position the type ends at
     """
-    # We've reached the level of nesting that this comment must be inserted at
-    if current_nesting_level == total_nesting_levels:
-        # Matching an array OR a struct
-        array_or_struct = re.search(
-            r'(?:{}[: ]\s*(?:ARRAY|STRUCT)\s*)(<)'.format(col_at_level),
-            col_defs[col_loc:])
-        # Array/struct columns need their comments applied
-        # outside the brackets, rather than within
-        if array_or_struct:
-            col_start_bracket_loc = array_or_struct.start(1) + col_loc
-            col_end_bracket_loc = find_matching_bracket(
-                col_defs,
-                col_start_bracket_loc)
-            col_def_end = col_end_bracket_loc + 1
+    keyword = db_dtype_keyword_regex.match(db_dtype, pos)
+    keyword_name = keyword.group(1).upper() if keyword else None
+    bracket_pos = keyword.end() if keyword else pos
+
+    if (keyword_name in ['STRUCT', 'ARRAY'] and
+            db_dtype[bracket_pos:bracket_pos + 1] == '<'):
+        if keyword_name == 'ARRAY':
+            element, pos = parse_db_dtype_at(db_dtype, bracket_pos + 1)
+            dtype = {'dtype': 'ARRAY', 'element': element}
         else:
-            col_end_match = re.search(
-                r'(?:{}:\s*\w*\s*)([,>\n])'.format(col_at_level),
-                col_defs[col_loc:])
-            col_def_end = col_end_match.start(1) + col_loc
-
-        col_defs = (col_defs[:col_def_end] +
-                    ' COMMENT \'{}\''.format(comment) +
-                    col_defs[col_def_end:])
-        return col_defs
-    # We have not yet reached the appropriate level of nesting
+            fields = []
+            pos = bracket_pos
+            # Empty structs have no fields to parse
+            empty_struct = empty_struct_regex.match(db_dtype, pos + 1)
+            if empty_struct:
+                pos = empty_struct.end() - 1
+            while db_dtype[pos:pos + 1] in ['<', ',']:
+                colon_pos = db_dtype.find(':', pos + 1)
+                if colon_pos == -1:
+                    raise ValueError(
+                        'Missing field type at position {} of type {}'.format(
+                            pos, db_dtype))
+                field_name = db_dtype[pos + 1:colon_pos].strip()
+                field_type, pos = parse_db_dtype_at(db_dtype, colon_pos + 1)
+                fields.append({'name': field_name, 'type': field_type,
+                               'comment': None})
+            dtype = {'dtype': 'STRUCT', 'fields': fields}
+
+        if db_dtype[pos:pos + 1] != '>':
+            raise ValueError(
+                'No matching bracket found for {} at position {} of '
+                'type {}'.format(keyword_name, bracket_pos, db_dtype))
+        pos += 1
     else:
-        current_nesting_level += 1
-
-        # Matching an array OF a struct
-        array_of_struct = re.search(
-            r'(?:{}[: ]\s*ARRAY\s*<\s*STRUCT\s*)(<)'.format(col_at_level),
-            col_defs[col_loc:])
-
-        # Structs within arrays do not have names, and should not be
-        # commented. So, we skip to the next level of nesting
-        if array_of_struct:
-            next_level_block_start = array_of_struct.start(1) + col_loc
-            next_level_block_end = find_matching_bracket(
-                col_defs, next_level_block_start)
-
-        # Searching between the brackets that follow the just found col
-        return scan_ddl_level(
-            col, comment, col_defs,
-            # Trimming the '<' and '>' characters out
-            level_block_start=next_level_block_start + 1,
-            level_block_end=next_level_block_end - 1,
-            current_nesting_level=current_nesting_level,
-            total_nesting_levels=total_nesting_levels
-        )
-
-
-def find_matching_bracket(col_defs, start_ind):
+        # Any other type, including parameterized ones such as DECIMAL(10,2),
+        # is kept as-is. It ends at the first comma or bracket that is not
+        # nested within it
+        depth = 0
+        end = pos
+        while end < len(db_dtype):
+            char = db_dtype[end]
+            if char in '<(':
+                depth += 1
+            elif char in ')' or (char == '>' and depth):
+                depth -= 1
+            elif char in ',>' and not depth:
+                break
+            end += 1
+        dtype = {'dtype': db_dtype[pos:end].strip()}
+        pos = end
+
+    # Skipping whitespace before the next comma or bracket
+    while db_dtype[pos:pos + 1].isspace():
+        pos += 1
+    return dtype, pos
+
+
+def add_comments_to_col_def_tree(cols, col_comments):
     """
-    Given a starting index, this finds the index of the matching
-    bracket of the highest-level bracket in the string (AKA the first
-    one encountered)
+    Attaches comments to the columns and nested fields of a tree of column
+    definitions, as built by 'build_col_def_tree'. Nested fields are
+    addressed by the names of their parent columns/fields, separated by '.'.
+    Structs within arrays do not have names, so a field of a struct within
+    an array is addressed as if it were a field of the array itself.
+
+    Comments for top-level columns that are not in the tree are ignored.
 
     Args:
-        col_defs (str):
-            The fully formatted, translated-from-dataframe column definition
-            section of a DDL statement.
-        start_ind (int): The index to start searching from in col_defs
-    Returns:
-        int: index of col_defs that the next matching bracket is at
+        cols (list<dict>): The definition of each column
+        col_comments (dict<str:str>):
+            A mapping from column/field names to column comments to be applied
+            in the create statement
     Raises:
-        ValueError: If no matching bracket is found
+        ValueError:
+            If a definition for a col or one of its sub-fields was not found
+    """
+    cols_by_name = {col['name']: col for col in cols}
+    for col, comment in col_comments.items():
+        col_name, *subfield_names = col.split('.')
+        if col_name not in cols_by_name:
+            if subfield_names:
+                raise ValueError(
+                    'Sub-field {} not found in definition for {}'.format(
+                        col_name, col))
+            continue
+
+        field = cols_by_name[col_name]
+        for subfield_name in subfield_names:
+            dtype = field['type']
+            while dtype['dtype'] == 'ARRAY':
+                dtype = dtype['element']
+            field = next((subfield for subfield in dtype.get('fields', [])
+                          if subfield['name'] == subfield_name), None)
+            if field is None:
+                raise ValueError(
+                    'Sub-field {} not found in definition for {}'.format(
+                        subfield_name, col))
+        field['comment'] = comment
+
+
+def render_field_ddl(field):
+    """
+    Renders the type of a column/field, followed by its comment if it has one
     """
-    bracket_count = 0
-    for i, c in enumerate(col_defs[start_ind:]):
-        if c == '<':
-            bracket_count += 1
-        elif c == '>':
-            bracket_count -= 1
-        if bracket_count == 0:
-            return i + start_ind
-
-    raise ValueError(
-        'No matching bracket found for {} at character {}.'.format(
-            col_defs[start_ind], start_ind)
-        )
+    return render_db_dtype(field['type']) + (
+        ' COMMENT \'{}\''.format(field['comment'])
+        if field['comment'] is not None else '')
+
+
+def render_db_dtype(dtype):
+    """Renders a type parsed by 'parse_db_dtype' as DDL"""
+    if dtype['dtype'] == 'STRUCT':
+        return 'STRUCT <{}>'.format(', '.join(
+            '{}: {}'.format(field['name'], render_field_ddl(field))
+            for field in dtype['fields']))
+    elif dtype['dtype'] == 'ARRAY':
+        return 'ARRAY <{}>'.format(render_db_dtype(dtype['element']))
+    return dtype['dtype']
 
 
 def add_comments_to_avro_schema(avro_schema, col_comments):
@@ -1,10 +1,21 @@
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 import logging
+import math
+import re
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pandas.api.types import infer_dtype
 from pandas.core.dtypes.api import (is_datetime64_any_dtype,
                                     is_datetime64_dtype,
-                                    is_datetime64tz_dtype)
+                                    is_datetime64tz_dtype,
+                                    is_float_dtype,
+                                    is_integer_dtype)
+
+from honeycomb.config import get_option, set_option
 
 """
 The pandas dtype 'timedelta64[ns]' can be mapped to the hive dtype 'INTERVAL',
@@ -12,7 +23,8 @@ but 'INTERVAL' is only available as a return value from querying - it cannot
 be the dtype of a full column in a table. As a result, it is not included here
 
 The pandas dtype 'category' is for categorical variables, but hive does not
-have native support for categorical types. As a result, it is not included here
+have native support for categorical types. Instead, categorical columns are
+mapped to the type of their categories - see 'categorical_col_to_db_dtype'
 """
 dtype_map = {
     'object': 'COMPLEX',
@@ -33,6 +45,78 @@ dtype_map = {
     'boolean': 'BOOLEAN'
 }
 
+"""
+With 'narrow_types', numeric columns are mapped to the narrowest Hive type
+that holds every value of their dtype, rather than being widened to BIGINT or
+DOUBLE. Hive has no unsigned types, so unsigned integers are mapped to the
+next widest signed type. These columns are written with matching physical
+types - see 'map_db_to_arrow_schema'.
+"""
+narrow_dtype_map = {
+    'int8': 'TINYINT',
+    'int16': 'SMALLINT',
+    'int32': 'INT',
+    'uint8': 'SMALLINT',
+    'uint16': 'INT',
+    'uint32': 'BIGINT',
+    'float32': 'FLOAT',
+    'Int8': 'TINYINT',
+    'Int16': 'SMALLINT',
+    'Int32': 'INT',
+    'UInt8': 'SMALLINT',
+    'UInt16': 'INT',
+    'UInt32': 'BIGINT',
+    'Float32': 'FLOAT'
+}
+# Hive types narrower than the ones honeycomb maps pandas dtypes to by
+# default, which need to be written with an explicit schema
+narrow_db_dtype_regex = r'\b(?:TINYINT|SMALLINT|INT|FLOAT|DATE|DECIMAL)\b'
+# Storage formats that narrow types can be written in. ORC is included
+# because its data is staged in Parquet before Hive converts it
+narrow_type_storage_types = ['parquet', 'orc']
+db_to_arrow_dtype_map = {
+    'TINYINT': pa.int8(),
+    'SMALLINT': pa.int16(),
+    'INT': pa.int32(),
+    'BIGINT': pa.int64(),
+    'FLOAT': pa.float32(),
+    'DOUBLE': pa.float64(),
+    'BOOLEAN': pa.bool_(),
+    'STRING': pa.string(),
+    'BINARY': pa.binary(),
+    'TIMESTAMP': pa.timestamp('ns'),
+    'DATE': pa.date32()
+}
+
+# Mapping from the types pandas infers for columns of scalar values to the
+# type they are reduced to. Columns with no non-null values are
+# treated as strings
+scalar_inferred_types = {
+    'string': 'string',
+    'empty': 'string',
+    'integer': 'numeric',
+    'floating': 'numeric',
+    'mixed-integer-float': 'numeric',
+    'boolean': 'bool'
+}
+# Python types that make up columns of each reduced container type
+container_types = {
+    'list': (list,),
+    'dict': (dict, OrderedDict)
+}
+
+# Sampled inference draws a quarter of its sample from each end of a
+# column, and the remainder at random from between them. The random
+# draw is seeded so that the same DataFrame always produces the same DDL
+sample_edge_fraction = .25
+sample_seed = 0
+# Number of values converted to Arrow at a time when verifying a sample
+verify_chunk_size = 2 ** 16
+# Minimum number of complex values in a DataFrame for the types of its
+# columns to be inferred in parallel. Below this, the cost of starting
+# processes and sending columns to them outweighs the inference itself
+parallel_inference_min_values = 200000
+
 
 def convert_to_spec_timezones(df, datetime_cols, spec_timezones):
     """
@@ -142,7 +226,9 @@ def apply_spec_dtypes(df, spec_dtypes):
     return df
 
 
-def map_pd_to_db_dtypes(df, storage_type=None):
+def map_pd_to_db_dtypes(df, storage_type=None, infer_sample=None,
+                        max_workers=None, narrow_types=False, date_cols=None,
+                        decimals=None):
     """
     Creates a mapping from the dtypes in a DataFrame to their corresponding
     dtypes in Hive
@@ -150,10 +236,30 @@ def map_pd_to_db_dtypes(df, storage_type=None):
     Args:
         df (pd.DataFrame): The DataFrame to pull dtypes from
         storage_type (string): The format the DataFrame is to be saved as
+        infer_sample (int or float, optional):
+            If provided, the types of ARRAY and STRUCT columns are inferred
+            from a sample of this many values (or this fraction of values,
+            if a float), and then verified against the rest of the column.
+            See 'infer_complex_col_from_sample'
+        max_workers (int, optional):
+            The maximum number of processes to infer the types of complex
+            columns with. Defaults to the 'inference_max_workers' option.
+            See 'handle_complex_dtypes'
+        narrow_types (bool, default False):
+            Whether to map numeric columns to the narrowest Hive type that
+            holds their dtype, such as 'int16' to SMALLINT, rather than
+            widening them to BIGINT or DOUBLE
+        date_cols (list<str>, optional):
+            Datetime columns with no time component, to be mapped to DATE
+        decimals (dict<str:tuple<int, int>>, optional):
+            Dictionary from float or decimal.Decimal columns to the precision
+            and scale of the DECIMAL type they are to be mapped to
     Returns:
         db_dtypes (pd.Series): A Series mapping column names to database dtypes
     Raises:
-        TypeError: If the DataFrame contains a column of type 'category'
+        TypeError:
+            If the DataFrame contains a column of type 'category', and is
+            being saved as Avro
         TypeError: If the DataFrame contains a column of type 'timedelta64[ns]'
         TypeError:
             If the DataFrame contains a column that translates to a complex
@@ -162,9 +268,11 @@ def map_pd_to_db_dtypes(df, storage_type=None):
             If the DataFrame contains a column that translates to an ARRAY
             Hive type, and is being saved as Parquet
     """
-    if any(df.dtypes == 'category'):
-        raise TypeError('Pandas\' \'categorical\' type is not supported. '
-                        'Contact honeycomb devs for further info.')
+    if infer_sample is not None:
+        validate_infer_sample(infer_sample)
+    if storage_type == 'avro' and any(df.dtypes == 'category'):
+        raise TypeError('Pandas\' \'categorical\' type is not supported '
+                        'when using the avro filetype.')
     if any(df.dtypes == 'timedelta64[ns]'):
         raise TypeError('Pandas\' \'timedelta64[ns]\' type is not supported. '
                         'Contact honeycomb devs for further info.')
@@ -180,12 +288,27 @@ def map_pd_to_db_dtypes(df, storage_type=None):
             'or nullable-boolean dtypes, which are currently not supported '
             'when using the avro filetype.'
         )
+    if ((narrow_types or date_cols or decimals) and
+            storage_type not in narrow_type_storage_types):
+        raise ValueError(
+            'Narrow types, dates, and decimals are only supported in the '
+            '{} storage formats.'.format(
+                ' and '.join(narrow_type_storage_types)))
     db_dtypes = df.dtypes.copy()
 
-    for orig_type, new_type in dtype_map.items():
+    type_map = (dict(dtype_map, **narrow_dtype_map) if narrow_types
+                else dtype_map)
+    for orig_type, new_type in type_map.items():
         # dtypes can be compared to their string representations for equality
         db_dtypes[db_dtypes == orig_type] = new_type
 
+    for col in df.columns[df.dtypes == 'category']:
+        db_dtypes[col] = categorical_col_to_db_dtype(df[col], type_map)
+    for col in date_cols or []:
+        db_dtypes[col] = date_col_to_db_dtype(df[col])
+    for col, (precision, scale) in (decimals or {}).items():
+        db_dtypes[col] = decimal_col_to_db_dtype(df[col], precision, scale)
+
     # If any of the columns are of type 'object', they will be deemed complex
     # and will require additional processing.
     # Supported 'object' types are strings, lists, and dicts
@@ -193,13 +316,7 @@ def map_pd_to_db_dtypes(df, storage_type=None):
     if any(db_dtypes.eq('COMPLEX')):
         complex_cols = db_dtypes.index[db_dtypes.eq('COMPLEX')]
         db_dtypes = handle_complex_dtypes(
-            df[complex_cols], db_dtypes)
-
-        if any(db_dtypes.str.contains('ARRAY|STRUCT')):
-            # CSV support for arrays and structs is not currently implemented.
-            if storage_type in ['csv']:
-                raise TypeError('Complex types are not yet supported in '
-                                'the {} storage format.'.format(storage_type))
+            df[complex_cols], db_dtypes, infer_sample, max_workers)
 
     db_dtypes = db_dtypes.to_frame(name='dtype').reset_index().rename(
         columns={'index': 'col_name'})
@@ -207,41 +324,191 @@ def map_pd_to_db_dtypes(df, storage_type=None):
     return db_dtypes
 
 
-def handle_complex_dtypes(df_complex, db_dtypes):
+def categorical_col_to_db_dtype(col, type_map=dtype_map):
+    """
+    Generates the DDL for a categorical column, which is the type of its
+    categories. Only the categories are inspected, never the full column,
+    and categorical columns are written as dictionary-encoded columns
+    directly from their codes.
+
+    Args:
+        col (pd.Series): A column with the 'category' dtype
+        type_map (dict<str:str>):
+            The mapping from pandas dtypes to Hive types in use
+    Returns:
+        str: Hive DDL for the column
+    Raises:
+        TypeError: If the categories are of an unsupported type
+    """
+    categories = col.cat.categories
+    # Categoricals with no categories cannot have their type inferred,
+    # and are treated as strings
+    if categories.empty:
+        return 'STRING'
+
+    db_dtype = type_map.get(categories.dtype.name)
+    if db_dtype is None:
+        raise TypeError(
+            'Categorical column "{}" has categories of the unsupported type '
+            '\'{}\'.'.format(col.name, categories.dtype))
+    elif db_dtype == 'COMPLEX':
+        db_dtype = complex_col_to_db_dtype(
+            pd.Series(categories, name=col.name))
+    return db_dtype
+
+
+def date_col_to_db_dtype(col):
+    """
+    Generates the DDL for a datetime column to be stored as DATE
+
+    Raises:
+        TypeError: If the column is not a timezone-naive datetime column
+        ValueError: If any of the column's values have a time component
+    """
+    if not is_datetime64_dtype(col.dtype):
+        raise TypeError(
+            'Column "{}" cannot be stored as a DATE. Only timezone-naive '
+            'datetime columns can be stored as dates.'.format(col.name))
+    non_null_values = col[col.notna()]
+    if not non_null_values.eq(non_null_values.dt.normalize()).all():
+        raise ValueError(
+            'Column "{}" cannot be stored as a DATE, because some of its '
+            'values have a time component.'.format(col.name))
+    return 'DATE'
+
+
+def decimal_col_to_db_dtype(col, precision, scale):
+    """
+    Generates the DDL for a float or decimal.Decimal column to be stored
+    as DECIMAL
+
+    Raises:
+        ValueError: If the precision or scale is not valid in Hive
+        TypeError: If the column is not a float or decimal column
+    """
+    if not 1 <= precision <= 38 or not 0 <= scale <= precision:
+        raise ValueError(
+            'DECIMAL precision must be between 1 and 38, and scale must be '
+            'between 0 and the precision. Got ({}, {}) for column '
+            '"{}".'.format(precision, scale, col.name))
+    if not (is_float_dtype(col.dtype) or
+            infer_dtype(col, skipna=True) in ['decimal', 'empty']):
+        raise TypeError(
+            'Column "{}" cannot be stored as a DECIMAL. Only float and '
+            'decimal.Decimal columns can be stored as decimals.'.format(
+                col.name))
+    return 'DECIMAL({}, {})'.format(precision, scale)
+
+
+def handle_complex_dtypes(df_complex, db_dtypes, infer_sample=None,
+                          max_workers=None):
     """
     Generates the DDL for columns with complex dtypes if they are found in
-    a DataFrame that a table is being created from
+    a DataFrame that a table is being created from.
+
+    Inference is pure Python, so it cannot be sped up with threads. For
+    DataFrames with multiple complex columns and enough values to outweigh
+    the cost of sending columns to other processes, each column is
+    inferred in its own process instead. This is opt-in, through
+    'max_workers' or the 'inference_max_workers' option, as processes
+    are started with the platform's default method. Where that is 'spawn',
+    as on macOS and Windows, the calling script must guard its entry point
+    with 'if __name__ == "__main__":'.
 
     Args:
         df_complex (pd.DataFrame):
            DataFrame containing all the complex columns of the DataFrame that
            the new table is being generated from.
         db_dtypes (pd.Series): A Series mapping column names to database dtypes
+        infer_sample (int or float, optional):
+            The size of the sample to infer ARRAY and STRUCT columns from.
+            If not provided, every value is inspected
+        max_workers (int, optional):
+            The maximum number of processes to infer column types with.
+            Defaults to the 'inference_max_workers' option. If 1, columns
+            are inferred one after another in the current process
     Returns:
         db_dtypes (pd.Series): A Series mapping column names to database dtypes
     """
-    for col in df_complex.columns:
-        reduced_type = reduce_complex_type(df_complex[col])
-        if reduced_type == 'string':
-            db_dtypes.loc[col] = 'STRING'
-        elif reduced_type == 'numeric':
-            db_dtypes.loc[col] = dtype_map['float64']
-        elif reduced_type == 'bool':
-            db_dtypes.loc[col] = dtype_map['bool']
-        elif reduced_type == 'list':
-            db_dtypes.loc[col] = handle_array_col(df_complex[col])
-        elif reduced_type == 'dict':
-            db_dtypes.loc[col] = handle_struct_col(df_complex[col])
+    max_workers = min(max_workers or get_option('inference_max_workers'),
+                      len(df_complex.columns))
+    if (max_workers > 1 and
+            df_complex.size >= parallel_inference_min_values):
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(infer_complex_col_in_process,
+                                df_complex[col], infer_sample,
+                                get_option('complex_type_inference'))
+                for col in df_complex.columns
+            ]
+            # Results are collected in column order, regardless of
+            # the order the columns finish in
+            for col, future in zip(df_complex.columns, futures):
+                db_dtypes.loc[col] = future.result()
+    else:
+        for col in df_complex.columns:
+            db_dtypes.loc[col] = infer_complex_col(df_complex[col],
+                                                   infer_sample)
 
     return db_dtypes
 
 
+def infer_complex_col(col, infer_sample=None):
+    """
+    Generates the DDL for a column with a complex dtype, from a sample of
+    its values if 'infer_sample' is provided, or from all of them otherwise
+    """
+    if infer_sample is None:
+        return complex_col_to_db_dtype(col)
+    return infer_complex_col_from_sample(col, infer_sample)
+
+
+def infer_complex_col_in_process(col, infer_sample, complex_type_inference):
+    """
+    Generates the DDL for a column with a complex dtype in a worker process.
+    Options set in the parent process are not guaranteed to be present in
+    worker processes, so the inference backend is set explicitly.
+    """
+    set_option('complex_type_inference', complex_type_inference)
+    return infer_complex_col(col, infer_sample)
+
+
+def complex_col_to_db_dtype(col):
+    """
+    Generates the DDL for a column with a complex dtype, based on the
+    type its values reduce to
+
+    Args:
+        col (pd.Series): A column with a complex dtype
+    Returns:
+        str: Hive DDL for the column
+    """
+    reduced_type = reduce_complex_type(col)
+    if reduced_type == 'string':
+        return 'STRING'
+    elif reduced_type == 'numeric':
+        return dtype_map['float64']
+    elif reduced_type == 'bool':
+        return dtype_map['bool']
+    elif get_option('complex_type_inference') == 'arrow':
+        return infer_complex_col_w_arrow(col)
+    elif reduced_type == 'list':
+        return handle_array_col(col)
+    elif reduced_type == 'dict':
+        return handle_struct_col(col)
+
+
 def reduce_complex_type(col):
     """
     Reduces the dtype of a complex column to a type usable in base Python.
     Considers every the type of every value in the column, and coalesces it
     to a specific, single type that captures all of them, then returns that
-    type as a string.
+    type as a string. Missing values (None, NaN, or pd.NA) are ignored.
+
+    Scalar types are classified by pandas in a single pass over the column,
+    which stops early once the column is known to be mixed. Lists and dicts
+    are all classified as 'mixed' by pandas, so those columns are confirmed
+    to be homogenous with one further pass, which also stops early.
 
     Args:
         col (pd.Series): A column with a complex dtype
@@ -250,24 +517,196 @@ def reduce_complex_type(col):
     Raises:
         TypeError: If the column is of a mixed or unsupported type
     """
-    python_types = col.apply(type)
-    if all(python_types.isin([str, type(None)])):
-        return 'string'
-    elif all(python_types.isin([list, type(None)])):
-        return 'list'
-    elif all(python_types.isin([dict, OrderedDict, type(None)])):
-        return 'dict'
-    elif all(python_types.isin([int, float, type(None)])):
-        return 'numeric'
-    elif all(python_types.isin([bool, type(None)])):
-        return 'bool'
-    else:
+    inferred_type = infer_dtype(col, skipna=True)
+    if inferred_type in scalar_inferred_types:
+        return scalar_inferred_types[inferred_type]
+
+    elif inferred_type == 'mixed':
+        non_null_values = col[col.notna()]
+        for reduced_type, python_types in container_types.items():
+            if type(non_null_values.iloc[0]) in python_types:
+                if all(type(value) in python_types
+                       for value in non_null_values):
+                    return reduced_type
+                break
+
+    raise TypeError(
+        'Values passed to complex column "{}" are either of '
+        'unsupported types of mixed types. Currently supported '
+        'complex types are "STRING", "ARRAY" (list) and '
+        '"STRUCT" (dictionary). Columns must contain '
+        'homogenous types.'.format(col.name))
+
+
+def infer_complex_col_w_arrow(col):
+    """
+    Generates the DDL for an ARRAY or STRUCT column by converting it to an
+    Arrow array, which infers a single type unifying every value in the
+    column - including the fields of every struct, at any level of nesting.
+    The conversion happens once, in compiled code, rather than recursively
+    building new pandas objects for every level of nesting.
+
+    Args:
+        col (pd.Series): A column of the ARRAY or STRUCT dtype
+    Returns:
+        str: Hive DDL for the column
+    Raises:
+        TypeError: If the values in the column cannot be unified to one type
+    """
+    try:
+        arrow_type = pa.array(col[col.notna()], from_pandas=True).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
         raise TypeError(
-            'Values passed to complex column "{}" are either of '
-            'unsupported types of mixed types. Currently supported '
-            'complex types are "STRING", "ARRAY" (list) and '
-            '"STRUCT" (dictionary). Columns must contain '
-            'homogenous types.'.format(col.name))
+            'Values passed to complex column "{}" contain nested fields '
+            'of mixed types. Nested fields must contain homogenous '
+            'types.'.format(col.name)) from e
+    return arrow_type_to_db_dtype(arrow_type)
+
+
+def validate_infer_sample(infer_sample):
+    """
+    Checks that a sample size is either a positive number of values, or a
+    fraction of values between 0 and 1
+
+    Raises:
+        ValueError: If the sample size is neither
+    """
+    if isinstance(infer_sample, float):
+        if not 0 < infer_sample <= 1:
+            raise ValueError(
+                'A fractional "infer_sample" must be between 0 and 1.')
+    elif not isinstance(infer_sample, int) or infer_sample < 1:
+        raise ValueError(
+            '"infer_sample" must be a positive integer or a fraction.')
+
+
+def get_sample_size(num_values, infer_sample):
+    """Converts a number or fraction of values to a number of values"""
+    if isinstance(infer_sample, float):
+        return max(1, math.ceil(infer_sample * num_values))
+    return infer_sample
+
+
+def sample_col(col, sample_size):
+    """
+    Takes a stratified sample of a column - its first and last values, which
+    are where the shape of data most often changes in appended or sorted
+    data, along with random values from the rest of it
+
+    Args:
+        col (pd.Series): The column to sample
+        sample_size (int): The number of values to sample
+    Returns:
+        pd.Series: The sampled values, in their original order
+    """
+    num_edge_values = int(sample_size * sample_edge_fraction)
+    middle_positions = np.arange(num_edge_values, len(col) - num_edge_values)
+    rng = np.random.default_rng(sample_seed)
+    positions = np.concatenate([
+        np.arange(num_edge_values),
+        rng.choice(middle_positions, sample_size - 2 * num_edge_values,
+                   replace=False),
+        np.arange(len(col) - num_edge_values, len(col))
+    ])
+    return col.iloc[np.sort(positions)]
+
+
+def infer_complex_col_from_sample(col, infer_sample):
+    """
+    Generates the DDL for a column with a complex dtype from a sample of its
+    values, rather than all of them.
+
+    Inferring the type of ARRAY and STRUCT columns builds new pandas objects
+    for every level of nesting, so on large columns, the DDL is inferred from
+    a sample, and the rest of the column is then verified to conform to it.
+    Verification converts the column to Arrow in chunks, which happens in
+    compiled code, and compares only the types Arrow infers for each chunk.
+    If any value does not conform, the DDL is inferred from the full column.
+
+    Columns of scalar values are always classified in full, as pandas
+    already does so in compiled code.
+
+    Args:
+        col (pd.Series): A column with a complex dtype
+        infer_sample (int or float):
+            The number of values to sample, or the fraction of values
+            to sample if a float
+    Returns:
+        str: Hive DDL for the column
+    """
+    non_null_values = col[col.notna()]
+    sample_size = get_sample_size(len(non_null_values), infer_sample)
+    if (sample_size >= len(non_null_values) or
+            infer_dtype(non_null_values, skipna=True) != 'mixed'):
+        return complex_col_to_db_dtype(col)
+
+    sample = sample_col(non_null_values, sample_size)
+    sample_ddl = complex_col_to_db_dtype(sample)
+    try:
+        sample_arrow_type = pa.array(sample, from_pandas=True).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        sample_arrow_type = None
+
+    if (sample_arrow_type is not None and
+            col_conforms_to_arrow_type(non_null_values, sample_arrow_type)):
+        return sample_ddl
+
+    logging.info(
+        'Values in column "{}" do not conform to the type inferred from '
+        'its sample. Inferring its type from the full column.'.format(
+            col.name))
+    return complex_col_to_db_dtype(col)
+
+
+def col_conforms_to_arrow_type(col, arrow_type):
+    """
+    Checks whether every value in a column can be represented by an Arrow
+    type, without any nested fields being added or changing type
+
+    Args:
+        col (pd.Series): The column to check, without missing values
+        arrow_type (pa.DataType): The type the column must conform to
+    Returns:
+        bool: Whether the column conforms to the type
+    """
+    for start in range(0, len(col), verify_chunk_size):
+        try:
+            chunk_type = pa.array(col.iloc[start:start + verify_chunk_size],
+                                  from_pandas=True).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return False
+        if not arrow_type_fits(chunk_type, arrow_type):
+            return False
+    return True
+
+
+def arrow_type_fits(arrow_type, expected_type):
+    """
+    Checks whether values of one Arrow type can be represented by another.
+    Nulls fit any type, integers fit floats, decimals fit wider decimals,
+    and structs fit if their fields are a subset of the expected fields,
+    with each field fitting.
+    """
+    if pa.types.is_null(arrow_type):
+        return True
+    elif pa.types.is_list(arrow_type) and pa.types.is_list(expected_type):
+        return arrow_type_fits(arrow_type.value_type,
+                               expected_type.value_type)
+    elif pa.types.is_struct(arrow_type) and pa.types.is_struct(expected_type):
+        expected_fields = {field.name: field.type for field in expected_type}
+        return all(
+            field.name in expected_fields and
+            arrow_type_fits(field.type, expected_fields[field.name])
+            for field in arrow_type)
+    elif pa.types.is_integer(arrow_type) and pa.types.is_floating(
+            expected_type):
+        return True
+    elif pa.types.is_decimal(arrow_type) and pa.types.is_decimal(
+            expected_type):
+        return (arrow_type.scale <= expected_type.scale and
+                arrow_type.precision - arrow_type.scale <=
+                expected_type.precision - expected_type.scale)
+    return arrow_type == expected_type
 
 
 def handle_array_col(col):
@@ -281,23 +720,22 @@ def handle_array_col(col):
     Returns:
         dtype_str (string): Hive DDL for the column
     """
-    array_series = pd.Series(col[~col.isna()].sum())
+    # The items of every array are chained into one Series, visiting each
+    # item once. Arrays of arrays are handled the same way, one level of
+    # nesting at a time, so the total work is linear in the number of items
+    array_items = list(chain.from_iterable(col[col.notna()]))
+    if not array_items:
+        # With no items to infer a type from, pandas would default to floats
+        return 'ARRAY <{}>'.format(dtype_map['float64'])
+
+    array_series = pd.Series(array_items)
     # Getting type of the items the array holds
     array_dtype = dtype_map[array_series.dtype.name]
 
-    # If array's items are themselves a complex type
+    # If array's items are themselves a complex type, such as arrays or
+    # structs, the nested field(s) are handled first
     if array_dtype == 'COMPLEX':
-        reduced_type = reduce_complex_type(array_series)
-        if reduced_type == 'string':
-            array_dtype = 'STRING'
-
-        # If the array itself holds arrays, handle the nested field(s) first
-        elif reduced_type == 'list':
-            array_dtype = handle_array_col(array_series)
-
-        # If the array holds structs, handle the nested field(s) first
-        elif reduced_type == 'dict':
-            array_dtype = handle_struct_col(array_series)
+        array_dtype = complex_col_to_db_dtype(array_series)
 
     dtype_str = 'ARRAY <{}>'.format(array_dtype)
     return dtype_str
@@ -318,10 +756,256 @@ def handle_struct_col(col):
     struct_df = pd.DataFrame.from_records(
         col[~col.isna()].reset_index(drop=True))
     # Treat dicts as rows of a new data set, and map types for all subfields
-    struct_dtypes = map_pd_to_db_dtypes(struct_df)
+    # Nested fields are inferred serially, as the column containing them
+    # may already be being inferred in a worker process
+    struct_dtypes = map_pd_to_db_dtypes(struct_df, max_workers=1)
 
     dtype_str = 'STRUCT <{}>'.format(
         ', '.join(['{}: {}'.format(row['col_name'], row['dtype'])
                    for idx, row in struct_dtypes.iterrows()]))
 
     return dtype_str
+
+
+def map_arrow_to_db_dtypes(arrow_schema):
+    """
+    Creates a mapping from the types in an Arrow schema to their
+    corresponding dtypes in Hive
+
+    Args:
+        arrow_schema (pa.Schema): The schema to pull types from
+    Returns:
+        db_dtypes (pd.DataFrame):
+            A DataFrame with the columns 'col_name' and 'dtype', mapping
+            column names to database dtypes
+    """
+    return pd.DataFrame({
+        'col_name': arrow_schema.names,
+        'dtype': [arrow_type_to_db_dtype(field.type)
+                  for field in arrow_schema]
+    })
+
+
+def arrow_type_to_db_dtype(arrow_type):
+    """
+    Generates the Hive DDL for an Arrow type. Integers and floats are
+    widened to the types that their pandas equivalents are mapped to, and
+    nested types are handled recursively.
+
+    Args:
+        arrow_type (pa.DataType): The type to convert
+    Returns:
+        str: Hive DDL for the type
+    Raises:
+        TypeError: If the type has no Hive equivalent
+    """
+    if pa.types.is_dictionary(arrow_type):
+        return arrow_type_to_db_dtype(arrow_type.value_type)
+    elif pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return 'ARRAY <{}>'.format(
+            arrow_type_to_db_dtype(arrow_type.value_type))
+    elif pa.types.is_map(arrow_type):
+        return 'MAP <{}, {}>'.format(
+            arrow_type_to_db_dtype(arrow_type.key_type),
+            arrow_type_to_db_dtype(arrow_type.item_type))
+    elif pa.types.is_struct(arrow_type):
+        return 'STRUCT <{}>'.format(', '.join([
+            '{}: {}'.format(field.name, arrow_type_to_db_dtype(field.type))
+            for field in arrow_type]))
+    elif pa.types.is_decimal(arrow_type):
+        return 'DECIMAL({}, {})'.format(arrow_type.precision,
+                                        arrow_type.scale)
+    elif pa.types.is_integer(arrow_type):
+        return dtype_map['int64']
+    elif pa.types.is_floating(arrow_type):
+        return dtype_map['float64']
+    elif pa.types.is_boolean(arrow_type):
+        return dtype_map['bool']
+    elif pa.types.is_timestamp(arrow_type):
+        return dtype_map['datetime64[ns]']
+    elif pa.types.is_date(arrow_type):
+        return 'DATE'
+    # Columns with no non-null values cannot have their type inferred,
+    # and are treated as strings
+    elif (pa.types.is_string(arrow_type) or
+          pa.types.is_large_string(arrow_type) or
+          pa.types.is_null(arrow_type)):
+        return 'STRING'
+    elif (pa.types.is_binary(arrow_type) or
+          pa.types.is_large_binary(arrow_type)):
+        return 'BINARY'
+    else:
+        raise TypeError('Arrow type \'{}\' is not supported.'.format(
+            arrow_type))
+
+
+def col_fits_db_dtype(col, db_dtype):
+    """
+    Checks whether a column's values can be written to a scalar Hive type
+    other than the one its dtype maps to, as they are when appending to a
+    table with narrow types - integers to any integer type, numbers to
+    floating-point types, floats and decimals to DECIMAL, and datetimes
+    to DATE. Values out of a narrower type's range are only detected
+    when written.
+
+    Args:
+        col (pd.Series): The column to check
+        db_dtype (str): The Hive type of the table's column
+    Returns:
+        bool: Whether the column can be written as the Hive type
+    """
+    if col.dtype.name == 'category':
+        col = pd.Series(col.cat.categories)
+    base_dtype = re.match(r'^\s*(\w*)', db_dtype).group(1).upper()
+    if base_dtype in ['TINYINT', 'SMALLINT', 'INT', 'BIGINT']:
+        return is_integer_dtype(col.dtype)
+    elif base_dtype in ['FLOAT', 'DOUBLE']:
+        return is_integer_dtype(col.dtype) or is_float_dtype(col.dtype)
+    elif base_dtype == 'DECIMAL':
+        return (is_float_dtype(col.dtype) or
+                infer_dtype(col, skipna=True) == 'decimal')
+    elif base_dtype == 'DATE':
+        return is_datetime64_any_dtype(col.dtype)
+    return False
+
+
+def has_narrow_db_dtypes(col_defs):
+    """
+    Checks whether any of a set of column definitions contain Hive types
+    that must be written with an explicit schema - see 'narrow_dtype_map'
+    """
+    return col_defs['dtype'].str.contains(
+        narrow_db_dtype_regex, flags=re.IGNORECASE).any()
+
+
+def has_complex_db_dtypes(col_defs):
+    """
+    Checks whether any of a set of column definitions contain ARRAY or
+    STRUCT types
+    """
+    return col_defs['dtype'].astype(str).str.contains(
+        r'^\s*(?:ARRAY|STRUCT)\b', flags=re.IGNORECASE).any()
+
+
+def map_db_to_arrow_schema(df, col_defs):
+    """
+    Creates the Arrow schema to write a DataFrame to a table with, from the
+    Hive types of the table's columns. Writing with this schema produces a
+    file whose physical types match the table's, so that Hive can read it
+    without widening any values.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to be written
+        col_defs (pd.DataFrame):
+            A DataFrame with the columns 'col_name' and 'dtype', containing
+            the Hive type of each of the table's columns
+    Returns:
+        pa.Schema: The Arrow schema, with a field for each column of 'df'
+    """
+    # Hive reports column names in lowercase
+    db_dtypes = dict(zip(col_defs['col_name'].str.lower(), col_defs['dtype']))
+    fields = []
+    for col in df.columns:
+        if col.lower() in db_dtypes:
+            arrow_type = db_dtype_to_arrow_type(db_dtypes[col.lower()])
+            # Categorical columns are kept dictionary-encoded, so that
+            # their values are never materialized
+            if df[col].dtype.name == 'category':
+                arrow_type = pa.dictionary(
+                    pa.from_numpy_dtype(df[col].cat.codes.dtype), arrow_type)
+        else:
+            # Columns not present in the table are ignored by Hive, so
+            # they are written with whatever type Arrow infers for them
+            arrow_type = pa.Schema.from_pandas(
+                df[[col]], preserve_index=False).field(col).type
+        fields.append((col, arrow_type))
+    return pa.schema(fields)
+
+
+def db_dtype_to_arrow_type(db_dtype):
+    """
+    Generates the Arrow type for a Hive type. Accepts both the DDL honeycomb
+    generates and the lowercase types Hive describes tables with, such as
+    'STRUCT <a: INT>' and 'struct<a:int>', and handles nested types
+    recursively.
+
+    Args:
+        db_dtype (str): The Hive type to convert
+    Returns:
+        pa.DataType: The Arrow type
+    Raises:
+        TypeError: If the type has no supported Arrow equivalent
+    """
+    db_dtype = db_dtype.strip()
+    upper_dtype = db_dtype.upper()
+    if upper_dtype.startswith(('ARRAY', 'STRUCT')):
+        inner_dtype = db_dtype[db_dtype.index('<') + 1:db_dtype.rindex('>')]
+        if upper_dtype.startswith('ARRAY'):
+            return pa.list_(db_dtype_to_arrow_type(inner_dtype))
+        fields = []
+        for field in split_nested_db_dtype(inner_dtype):
+            field_name, field_dtype = field.split(':', 1)
+            fields.append((field_name.strip().strip('`'),
+                           db_dtype_to_arrow_type(field_dtype)))
+        return pa.struct(fields)
+
+    decimal_match = re.match(r'^DECIMAL\s*\((\d+),\s*(\d+)\)$', upper_dtype)
+    if decimal_match:
+        return pa.decimal128(int(decimal_match.group(1)),
+                             int(decimal_match.group(2)))
+    if upper_dtype in db_to_arrow_dtype_map:
+        return db_to_arrow_dtype_map[upper_dtype]
+    raise TypeError('Hive type \'{}\' is not supported.'.format(db_dtype))
+
+
+def split_nested_db_dtype(inner_dtype):
+    """
+    Splits the fields of a STRUCT type on the commas between them, ignoring
+    commas within the fields' own types, such as those of nested structs
+    or decimals
+    """
+    fields = []
+    depth = 0
+    field_start = 0
+    for i, char in enumerate(inner_dtype):
+        if char in '<(':
+            depth += 1
+        elif char in '>)':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            fields.append(inner_dtype[field_start:i])
+            field_start = i + 1
+    fields.append(inner_dtype[field_start:])
+    return fields
+
+
+def prep_df_for_arrow_schema(df, arrow_schema):
+    """
+    Converts the columns of a DataFrame that Arrow cannot convert to their
+    type in 'arrow_schema' by itself - floats bound for decimal columns are
+    rounded to the decimal's scale and converted to decimal.Decimal values
+
+    Args:
+        df (pd.DataFrame): The DataFrame to convert
+        arrow_schema (pa.Schema): The schema the DataFrame is to be written
+            with, from 'map_db_to_arrow_schema'
+    Returns:
+        pd.DataFrame: The converted DataFrame
+    Raises:
+        ValueError: If any values do not fit in their decimal type
+    """
+    for field in arrow_schema:
+        if (pa.types.is_decimal(field.type) and
+                is_float_dtype(df[field.name].dtype)):
+            try:
+                decimals = pa.array(
+                    df[field.name].round(field.type.scale),
+                    from_pandas=True).cast(field.type)
+            except pa.ArrowInvalid as e:
+                raise ValueError(
+                    'Values in column "{}" do not fit in the type '
+                    'DECIMAL({}, {}).'.format(
+                        field.name, field.type.precision,
+                        field.type.scale)) from e
+            df[field.name] = decimals.to_pandas()
+    return df
@@ -0,0 +1,415 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import io
+import json
+import logging
+import os
+from tempfile import TemporaryDirectory
+
+import fastavro
+import numpy as np
+import pandavro as pdx
+from pandas.api.types import is_datetime64_any_dtype
+import pyarrow as pa
+import pyarrow.compute as pc
+import rivet as rv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from honeycomb import dtype_mapping, lake_files
+from honeycomb.config import get_option
+from honeycomb.ddl_building import get_non_null_field_type
+
+
+"""
+Notes on file writing
+
+Most files are written by rivet, but honeycomb writes some formats itself
+where it can do so far faster than rivet's general-purpose writers.
+
+Avro:
+    pandavro converts a DataFrame to a list of row dicts, checks every value
+    of every row in Python, and infers the schema of nested columns by
+    building new DataFrames out of the whole column. Instead:
+        a) The schema of nested columns is inferred from a sample of rows,
+           and the rest of each column is verified against it by converting
+           it to Arrow, which happens in compiled code. If any value does not
+           conform, the schema is inferred from the full DataFrame instead.
+        b) Each column is converted to Python values in one vectorized step,
+           with missing values of any kind written as null, and timestamps
+           converted directly to the integers their logical type stores.
+        c) Records are zipped together lazily from the columns and encoded
+           by fastavro's compiled writer with a pre-parsed schema.
+        d) Optionally, rows are split between processes, each of which
+           encodes its rows as Avro blocks. The blocks are then copied into a
+           single file without being decoded again.
+
+CSV:
+    Hive reads CSV tables with LazySimpleSerDe, which splits each line on
+    the field delimiter and does not recognize quotes. Each level of nesting
+    within a column is split on the next of its delimiters - the collection
+    delimiter declared in the DDL ('|'), followed by Hive's defaults of
+    '\\003', '\\004', and so on - and nulls within collections are written as
+    '\\N'. Every column is converted to Arrow and encoded as strings with
+    Arrow compute functions, including arrays and structs, and then rows are
+    joined into lines in the same way, without any per-row Python.
+
+JSON:
+    Hive reads JSON tables with JsonSerDe, one object per line. Rows are
+    encoded from column values in batches with orjson, if it is installed,
+    or the standard library's json module otherwise.
+
+CSV and JSON files are generated in batches of rows, and streamed straight
+into a multipart upload to S3, rather than being written to disk first.
+"""
+
+avro_infer_sample_size = 1000
+# Below this many rows, encoding in multiple processes costs more in
+# pickling the rows than it saves
+parallel_avro_min_rows = 100000
+
+avro_to_arrow_type_map = {
+    'string': pa.string(),
+    'boolean': pa.bool_(),
+    'bytes': pa.binary(),
+    'int': pa.int32(),
+    'long': pa.int64(),
+    'float': pa.float32(),
+    'double': pa.float64()
+}
+
+# The number of each unit of a logical timestamp type in a nanosecond
+avro_timestamp_divisors = {
+    'timestamp-millis': 10 ** 6,
+    'timestamp-micros': 10 ** 3
+}
+
+# The number of rows encoded at a time when writing text files
+text_batch_rows = 2 ** 16
+csv_field_delimiter = ','
+csv_collection_delimiter = '|'
+# How LazySimpleSerDe represents nulls in text files
+hive_text_null = '\\N'
+hive_timestamp_format = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def write_df(df, key, bucket, storage_type, storage_settings):
+    """
+    Writes a DataFrame to a file in S3, using honeycomb's own writer for the
+    storage type if it has one, and rivet otherwise
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        key (str): The key to write the file to
+        bucket (str): The bucket to write the file to
+        storage_type (str): The format to write the file in
+        storage_settings (dict): Settings for the format's writer
+    """
+    if storage_type == 'avro':
+        with TemporaryDirectory() as tmpdir:
+            local_path = os.path.join(tmpdir, os.path.basename(key))
+            write_avro(df, local_path, **storage_settings)
+            lake_files.upload_file(local_path, bucket, key)
+    elif storage_type == 'csv':
+        lake_files.upload_chunks(gen_csv_chunks(df, **storage_settings),
+                                 bucket, key)
+    elif storage_type == 'json' and storage_settings.get('hive_format'):
+        lake_files.upload_chunks(gen_json_chunks(df), bucket, key)
+    else:
+        rv.write(df, key, bucket, show_progressbar=False, **storage_settings)
+
+
+def infer_avro_schema(df, sample_size=avro_infer_sample_size):
+    """
+    Infers the Avro schema of a DataFrame from a sample of its rows. The
+    types of columns with scalar dtypes come from their dtypes, so only
+    object columns can differ from what the full DataFrame would produce, and
+    each of them is verified against the sampled schema. See notes above.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to infer the schema of
+        sample_size (int, optional):
+            The number of rows to infer the schema from. If not provided,
+            the schema is inferred from every row
+    Returns:
+        dict: The Avro schema
+    """
+    if sample_size is None or len(df) <= sample_size:
+        return pdx.schema_infer(df)
+
+    avro_schema = pdx.schema_infer(dtype_mapping.sample_col(df, sample_size))
+    for field in avro_schema['fields']:
+        col = df[field['name']]
+        if col.dtype != 'object':
+            continue
+        try:
+            arrow_type = avro_type_to_arrow_type(field['type'])
+        except (KeyError, TypeError):
+            arrow_type = None
+        if arrow_type is None or not dtype_mapping.col_conforms_to_arrow_type(
+                col[col.notna()], arrow_type):
+            logging.info(
+                'Values of column \'{}\' do not conform to the Avro schema '
+                'inferred from a sample. Inferring the schema from all '
+                'rows instead.'.format(field['name']))
+            return pdx.schema_infer(df)
+    return avro_schema
+
+
+def avro_type_to_arrow_type(avro_type):
+    """
+    Converts the type of an Avro field, as inferred by pandavro, to the
+    Arrow type its values are converted to
+
+    Raises:
+        KeyError: If the type has no Arrow equivalent
+    """
+    avro_type = get_non_null_field_type(avro_type)
+    if isinstance(avro_type, dict):
+        if 'logicalType' in avro_type:
+            return pa.timestamp('ns')
+        elif avro_type['type'] == 'record':
+            return pa.struct([
+                (field['name'], avro_type_to_arrow_type(field['type']))
+                for field in avro_type['fields']])
+        elif avro_type['type'] == 'array':
+            return pa.list_(avro_type_to_arrow_type(avro_type['items']))
+        avro_type = avro_type['type']
+    return avro_to_arrow_type_map[avro_type]
+
+
+def write_avro(df, local_path, schema=None, codec=None, max_workers=None):
+    """
+    Writes a DataFrame to a local Avro file. See notes above.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        local_path (str): The path to write the file to
+        schema (dict, optional):
+            The Avro schema to write the file with. If not provided, it is
+            inferred with 'infer_avro_schema'
+        codec (str, optional):
+            The codec to compress the file's blocks with - 'null', 'deflate',
+            or 'snappy'. 'snappy' requires 'cramjam' to be installed.
+            Defaults to the 'avro_codec' option
+        max_workers (int, optional):
+            The maximum number of processes to encode the file's blocks in.
+            Defaults to the 'avro_max_workers' option
+    """
+    codec = codec or get_option('avro_codec')
+    max_workers = max_workers or get_option('avro_max_workers')
+    if schema is None:
+        schema = infer_avro_schema(df)
+    parsed_schema = fastavro.parse_schema(schema)
+
+    with open(local_path, 'wb') as f:
+        if max_workers > 1 and len(df) >= parallel_avro_min_rows:
+            writer = fastavro.write.Writer(f, parsed_schema, codec=codec)
+            chunk_size = -(-len(df) // max_workers)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(encode_avro_blocks,
+                                    df.iloc[start:start + chunk_size],
+                                    schema, codec)
+                    for start in range(0, len(df), chunk_size)]
+                for future in futures:
+                    for block in fastavro.block_reader(
+                            io.BytesIO(future.result())):
+                        writer.write_block(block)
+            writer.flush()
+        else:
+            fastavro.writer(f, parsed_schema,
+                            gen_avro_records(df, parsed_schema), codec=codec)
+
+
+def encode_avro_blocks(df, schema, codec):
+    """
+    Encodes a DataFrame as an in-memory Avro file, for its blocks to be
+    copied into a larger file. Run in worker processes by 'write_avro'.
+
+    Returns:
+        bytes: The encoded file
+    """
+    parsed_schema = fastavro.parse_schema(schema)
+    buffer = io.BytesIO()
+    fastavro.writer(buffer, parsed_schema,
+                    gen_avro_records(df, parsed_schema), codec=codec)
+    return buffer.getvalue()
+
+
+def gen_avro_records(df, parsed_schema):
+    """
+    Generates the records of a DataFrame to be encoded by fastavro, from its
+    columns converted to Python values. See notes above.
+    """
+    field_types = {field['name']: field['type']
+                   for field in parsed_schema['fields']}
+    names = list(df.columns)
+    cols = [avro_col_values(df[name], field_types.get(name))
+            for name in names]
+    return (dict(zip(names, row)) for row in zip(*cols))
+
+
+def avro_col_values(col, field_type):
+    """
+    Converts a column to a list of Python values for fastavro, with missing
+    values as None
+
+    Args:
+        col (pd.Series): The column to convert
+        field_type: The Avro type of the column's field
+    Returns:
+        list: The column's values
+    """
+    non_null_type = get_non_null_field_type(field_type)
+    logical_type = (non_null_type.get('logicalType')
+                    if isinstance(non_null_type, dict) else None)
+    if (is_datetime64_any_dtype(col.dtype) and
+            logical_type in avro_timestamp_divisors):
+        # Timezone-aware columns are converted to UTC, which is what
+        # timestamps are stored relative to
+        values = (col.to_numpy(dtype='datetime64[ns]').view(np.int64) //
+                  avro_timestamp_divisors[logical_type]).astype(object)
+        values[col.isna().to_numpy()] = None
+        return values.tolist()
+    return col.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def gen_csv_chunks(df, index=False, header=False, schema=None):
+    """
+    Generates the contents of a CSV file to be read by Hive, in batches of
+    rows. See notes above.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write
+        index (bool, default False): Whether to write the index as a column
+        header (bool, default False): Whether to write a header row
+        schema (pa.Schema, optional): The Arrow schema to convert the
+            DataFrame with, rather than inferring one
+    Yields:
+        bytes: The lines of each batch of rows
+    """
+    if index:
+        df = df.reset_index()
+    if header:
+        yield (csv_field_delimiter.join(map(str, df.columns)) +
+               '\n').encode()
+
+    for start in range(0, len(df), text_batch_rows):
+        table = pa.Table.from_pandas(df.iloc[start:start + text_batch_rows],
+                                     schema=schema, preserve_index=False)
+        cols = []
+        for col in table.columns:
+            is_complex = pa.types.is_nested(col.type)
+            cols.append(pc.fill_null(
+                encode_hive_text_array(col.combine_chunks()),
+                hive_text_null if is_complex else ''))
+        lines = pc.binary_join_element_wise(*cols, csv_field_delimiter)
+        lines = pc.binary_join_element_wise(lines, '\n', '')
+        # The values of a string array are stored contiguously, so the
+        # file's contents can be taken from its buffer in one piece
+        offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32)
+        yield lines.buffers()[2].to_pybytes()[
+            offsets[lines.offset]:offsets[lines.offset + len(lines)]]
+
+
+def encode_hive_text_array(arr, level=0):
+    """
+    Encodes an Arrow array as the strings LazySimpleSerDe reads values of its
+    type from, with the items of arrays and the fields of structs separated by
+    the delimiter for the next level of nesting. See notes above.
+
+    Args:
+        arr (pa.Array): The array to encode
+        level (int, default 0): The level of nesting of the array's values
+    Returns:
+        pa.Array: The encoded strings, with nulls where the values are null
+    """
+    if pa.types.is_dictionary(arr.type):
+        arr = arr.dictionary_decode()
+
+    if pa.types.is_list(arr.type):
+        items = pc.fill_null(encode_hive_text_array(arr.values, level + 1),
+                             hive_text_null)
+        return pc.binary_join(
+            pa.ListArray.from_arrays(arr.offsets, items, mask=arr.is_null()),
+            get_hive_text_delimiter(level + 1))
+    elif pa.types.is_struct(arr.type):
+        fields = [pc.fill_null(encode_hive_text_array(field, level + 1),
+                               hive_text_null)
+                  for field in arr.flatten()]
+        joined = pc.binary_join_element_wise(
+            *fields, get_hive_text_delimiter(level + 1))
+        return pc.if_else(arr.is_null(), pa.scalar(None, pa.string()),
+                          joined)
+    elif pa.types.is_null(arr.type):
+        return pa.nulls(len(arr), pa.string())
+    elif pa.types.is_timestamp(arr.type) and arr.type.tz is not None:
+        # Timestamps are written in the local time of their timezone, as
+        # text files cannot store timezones
+        arr = pc.local_timestamp(arr)
+    return pc.cast(arr, pa.string())
+
+
+def get_hive_text_delimiter(level):
+    """
+    Gets the delimiter LazySimpleSerDe splits values at a level of nesting on
+    """
+    if level == 0:
+        return csv_field_delimiter
+    elif level == 1:
+        return csv_collection_delimiter
+    # Hive's defaults, after the map key delimiter of '\\003'
+    return chr(level + 1)
+
+
+def gen_json_chunks(df):
+    """
+    Generates the contents of a JSON file to be read by Hive, with one
+    object per line, in batches of rows. See notes above.
+
+    Yields:
+        bytes: The lines of each batch of rows
+    """
+    names = list(df.columns)
+    for start in range(0, len(df), text_batch_rows):
+        batch = df.iloc[start:start + text_batch_rows]
+        cols = [json_col_values(batch[name]) for name in names]
+        yield b''.join(encode_json_record(dict(zip(names, row))) + b'\n'
+                       for row in zip(*cols))
+
+
+def json_col_values(col):
+    """
+    Converts a column to a list of Python values to be encoded as JSON, with
+    missing values as None and timestamps in Hive's format
+    """
+    if is_datetime64_any_dtype(col.dtype):
+        values = col.dt.strftime(hive_timestamp_format).astype(object)
+        return values.where(col.notna(), None).tolist()
+    return col.to_numpy(dtype=object, na_value=None).tolist()
+
+
+def encode_json_default(value):
+    """
+    Converts values that JSON encoders cannot encode themselves, such as
+    timestamps nested within complex columns
+    """
+    if isinstance(value, datetime):
+        return value.strftime(hive_timestamp_format)
+    elif isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Values of type \'{}\' cannot be written to JSON.'.format(
+        type(value).__name__))
+
+
+def encode_json_record(record):
+    """Encodes a record as JSON, with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(record, default=encode_json_default,
+                            option=(orjson.OPT_PASSTHROUGH_DATETIME |
+                                    orjson.OPT_SERIALIZE_NUMPY))
+    return json.dumps(record, default=encode_json_default).encode()
@@ -12,7 +12,8 @@ col_prefix_regex = r'^.*\.'
 hive_vector_option_name = 'hive.vectorized.execution.enabled'
 
 
-def run_lake_query(query, engine='hive', complex_join=False):
+def run_lake_query(query, engine='hive', complex_join=False,
+                   configuration=None):
     """
     General wrapper function around querying with different engines
 
@@ -27,11 +28,17 @@ def run_lake_query(query, engine='hive', complex_join=False):
             this beforehand will save query time later, as it allows for
             avoiding error handling associated with running a query like that
             without special treatment. Caused by a hive bug
+        configuration (dict<str:str>, optional):
+            Hive settings to apply to the connection the query is run
+            through, such as those required for dynamic partitioning.
+            Only usable with the 'hive' engine
     """
+    if configuration is not None:
+        # Copied so the caller's dict is not modified by any
+        # settings added below
+        configuration = dict(configuration)
     if complex_join:
-        configuration = _hive_get_nonvectorized_config()
-    else:
-        configuration = None
+        configuration = _hive_get_nonvectorized_config(configuration)
 
     # INSERT OVERWRITE commands on external tables can cause file deletion in
     # S3. As a result, we check that the path being overwritten into is not
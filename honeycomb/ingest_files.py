@@ -0,0 +1,486 @@
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv, json
+import pyarrow.parquet as pq
+import rivet as rv
+
+from honeycomb import check, dtype_mapping, lake_files, meta
+from honeycomb.alter_table import add_partition
+from honeycomb.compaction import default_target_file_size
+from honeycomb.create_table.build_and_run_ddl_stmt import (
+    build_and_run_ddl_stmt
+)
+from honeycomb.create_table.common import (
+    check_for_allowed_overwrite, check_for_comments, handle_existing_table,
+    schema_to_zone_bucket_map
+)
+from honeycomb.inform import inform
+
+
+"""
+Notes on file ingestion
+
+Reading a file into pandas stores every string as a separate Python object,
+which can take several times the memory of the file itself. Files are instead
+read with pyarrow in batches, which keeps strings in contiguous buffers and,
+for CSV and Parquet files, never holds more than a few batches of a file in
+memory at once.
+
+JSON files are the exception. pyarrow has no streaming JSON reader, so each
+JSON file is read into Arrow in full before its batches are written. This is
+still far more compact than pandas, but very large JSON files should be split
+into several smaller files before being ingested.
+
+Batches are converted to the lake's Parquet format and grouped into files of
+roughly 'target_file_size' bytes, which are written and uploaded in the
+background while further batches are read. The table's columns are
+determined by the first file ingested, and every other file must
+contain the same columns.
+"""
+
+# Extensions of compressed files, which pyarrow decompresses automatically
+compression_extensions = ['.bz2', '.gz', '.lz4', '.zst']
+file_format_extensions = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'json',
+    '.parquet': 'parquet'
+}
+default_block_size = 16 * 1024 ** 2
+
+
+def ingest_files(paths, table_name, schema=None, path=None, filename=None,
+                 file_format=None, column_types=None, table_comment=None,
+                 col_comments=None, partitioned_by=None,
+                 partition_values=None, overwrite=False,
+                 target_file_size=default_target_file_size,
+                 block_size=default_block_size, max_workers=4):
+    """
+    Loads CSV, JSON, or Parquet files directly into a table, without reading
+    them into pandas. If the table does not exist, it is created as a
+    Parquet table, with its columns determined from the first file.
+    If it does exist, the files are appended to it.
+    See notes above for further details.
+
+    Args:
+        paths (str or list<str>):
+            Paths to the files to ingest. Can be local paths or S3 URIs
+            ('s3://bucket/key'). Compressed files are decompressed
+            automatically.
+        table_name (str): The name of the table to load the files into
+        schema (str, optional):
+            The name of the schema containing the table
+        path (str, optional):
+            Folder in S3 to store all files for the table in. Only used
+            when creating a new table
+        filename (str, optional):
+            Name to base the names of the stored files on. An index is added
+            to the name of each file. Can be left blank if writing to the
+            experimental zone, in which case a name will be generated.
+        file_format (str, optional):
+            The format of the files being ingested - 'csv', 'json', or
+            'parquet'. If not provided, it is determined from
+            each file's extension.
+        column_types (dict<str:pa.DataType>, optional):
+            Arrow types to use for specific columns rather than inferring
+            them. Useful if a column's type cannot be inferred from the start
+            of a CSV file, such as when its first values are all null.
+        table_comment (str, optional): Documentation on the table's purpose
+        col_comments (dict<str:str>, optional):
+            Dictionary from column name keys to column descriptions.
+        partitioned_by (dict<str:str>,
+                        collections.OrderedDict<str:str>, or
+                        list<tuple<str:str>>, optional):
+            Dictionary or list of tuples containing a partition name and type.
+            Only used when creating a new table
+        partition_values (dict<str:str>):
+            Required if the table is partitioned. The partition to
+            load the files into
+        overwrite (bool, default False):
+            Whether to replace the table if it already exists, rather
+            than appending to it
+        target_file_size (int):
+            The approximate size in bytes of uncompressed data to store in
+            each file written to the table
+        block_size (int):
+            The number of bytes to read from CSV and JSON files at a time.
+            Parquet files are read one row group at a time. JSON files are
+            parsed in blocks, but each is held in memory in full.
+        max_workers (int, default 4):
+            The maximum number of files to be written at once
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if not paths:
+        raise ValueError('At least one file must be provided to ingest.')
+    if isinstance(partitioned_by, list):
+        partitioned_by = OrderedDict(partitioned_by)
+
+    table_name, schema = meta.prep_schema_and_table(table_name, schema)
+
+    if filename is None:
+        filename = meta.gen_filename_if_allowed(schema, 'parquet')
+    filename_stem = os.path.splitext(filename)[0]
+
+    if schema == 'curated':
+        check_for_allowed_overwrite(overwrite)
+    table_exists = check.table_existence(table_name, schema)
+
+    with TemporaryDirectory() as tmpdir:
+        batch_sources = (
+            read_file_batches(local_path, file_format, column_types,
+                              block_size)
+            for local_path in fetch_files(paths, tmpdir))
+        arrow_schema, batches = next(batch_sources)
+        arrow_schema = get_lake_arrow_schema(arrow_schema, column_types)
+
+        tblproperties = {}
+        if table_exists and not overwrite:
+            bucket, path, tblproperties = prep_table_for_ingest(
+                table_name, schema, arrow_schema)
+        else:
+            if schema == 'curated':
+                check_for_comments(table_comment,
+                                   pd.Index(arrow_schema.names),
+                                   col_comments)
+            handle_existing_table(table_name, schema, overwrite)
+            bucket, path = create_table_for_ingest(
+                table_name, schema, path, arrow_schema,
+                table_comment, col_comments, partitioned_by)
+
+        if partition_values:
+            path += add_partition(table_name, schema, partition_values)
+
+        def all_batches():
+            yield from batches
+            for _, file_batches in batch_sources:
+                yield from file_batches
+
+        # Files are compressed with the codec the table was created with
+        writer_settings = meta.get_parquet_writer_settings()
+        writer_settings.update(
+            meta.get_compression_settings('parquet', tblproperties))
+        num_files = write_batches(all_batches(), arrow_schema, bucket, path,
+                                  filename_stem, target_file_size,
+                                  max_workers, writer_settings)
+
+    inform('Ingested {} files into {}.{} as {} files.'.format(
+        len(paths), schema, table_name, num_files))
+
+
+def fetch_files(paths, tmpdir):
+    """
+    Yields local paths to the files being ingested. Files in S3 are
+    downloaded one at a time, as they are needed.
+
+    Args:
+        paths (list<str>): Local paths or S3 URIs of the files
+        tmpdir (str): Folder to download files from S3 into
+    """
+    s3 = None
+    for i, file_path in enumerate(paths):
+        if file_path.startswith('s3://'):
+            s3 = s3 or lake_files.get_s3_client()
+            bucket, key = meta.split_s3_uri(file_path)
+            local_path = os.path.join(
+                tmpdir, '{}_{}'.format(i, os.path.basename(key)))
+            lake_files.download_file(bucket, key, local_path, s3)
+            yield local_path
+            os.remove(local_path)
+        else:
+            yield file_path
+
+
+def get_file_format(local_path):
+    """
+    Determines the format of a file from its extension, ignoring any
+    extension indicating compression
+    """
+    root, ext = os.path.splitext(local_path.lower())
+    if ext in compression_extensions:
+        ext = os.path.splitext(root)[-1]
+    if ext not in file_format_extensions:
+        raise ValueError(
+            'The format of \'{}\' could not be determined from its '
+            'extension. Specify "file_format" to proceed.'.format(
+                local_path))
+    return file_format_extensions[ext]
+
+
+def read_file_batches(local_path, file_format, column_types, block_size):
+    """
+    Opens a file for reading in batches. JSON files are read in full, as
+    pyarrow cannot stream them, and then split into batches
+
+    Args:
+        local_path (str): The file to read
+        file_format (str): The format of the file. Determined if None
+        column_types (dict<str:pa.DataType>):
+            Types to read specific columns as, if the format requires them
+            to be inferred
+        block_size (int): The number of bytes to read from text files at once
+    Returns:
+        tuple<pa.Schema, iterator<pa.RecordBatch>>:
+            The schema of the file, and an iterator over its record batches
+    """
+    file_format = file_format or get_file_format(local_path)
+
+    if file_format == 'csv':
+        reader = csv.open_csv(
+            pa.input_stream(local_path),
+            read_options=csv.ReadOptions(block_size=block_size),
+            convert_options=csv.ConvertOptions(column_types=column_types))
+        return reader.schema, iter(reader)
+    elif file_format == 'json':
+        explicit_schema = (pa.schema(list(column_types.items()))
+                           if column_types else None)
+        table = json.read_json(
+            pa.input_stream(local_path),
+            read_options=json.ReadOptions(block_size=block_size),
+            parse_options=json.ParseOptions(explicit_schema=explicit_schema))
+        return table.schema, iter(table.to_batches())
+    elif file_format == 'parquet':
+        parquet_file = pq.ParquetFile(local_path)
+        return parquet_file.schema_arrow, parquet_file.iter_batches()
+    else:
+        raise ValueError(
+            'Ingestion of \'{}\' files is not supported.'.format(file_format))
+
+
+def get_lake_arrow_schema(arrow_schema, column_types=None):
+    """
+    Converts an Arrow schema into the types that the lake stores its data
+    as, so that every file written to a table has identical column types
+
+    Args:
+        arrow_schema (pa.Schema): The schema of the first file being ingested
+        column_types (dict<str:pa.DataType>, optional):
+            Types to use for specific columns rather than converting them
+    Returns:
+        pa.Schema: The schema to write files with
+    """
+    column_types = column_types or {}
+    return pa.schema([
+        pa.field(field.name, column_types.get(field.name)
+                 or get_lake_arrow_type(field.type))
+        for field in arrow_schema])
+
+
+def get_lake_arrow_type(arrow_type):
+    """
+    Maps an Arrow type to the Arrow type that matches its Hive type.
+    See 'dtype_mapping.arrow_type_to_db_dtype'
+    """
+    if pa.types.is_dictionary(arrow_type):
+        return get_lake_arrow_type(arrow_type.value_type)
+    elif pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return pa.list_(get_lake_arrow_type(arrow_type.value_type))
+    elif pa.types.is_struct(arrow_type):
+        return pa.struct([
+            pa.field(field.name, get_lake_arrow_type(field.type))
+            for field in arrow_type])
+    elif pa.types.is_integer(arrow_type):
+        return pa.int64()
+    elif pa.types.is_floating(arrow_type):
+        return pa.float64()
+    elif pa.types.is_timestamp(arrow_type):
+        # Timezone-aware timestamps are stored in UTC
+        return pa.timestamp('ns')
+    elif pa.types.is_large_string(arrow_type) or pa.types.is_null(arrow_type):
+        return pa.string()
+    elif pa.types.is_large_binary(arrow_type):
+        return pa.binary()
+    return arrow_type
+
+
+def create_table_for_ingest(table_name, schema, path, arrow_schema,
+                            table_comment, col_comments, partitioned_by):
+    """
+    Creates the Parquet table that files are being ingested into
+
+    Returns:
+        tuple<str, str>: The bucket and path of the new table
+    """
+    path = meta.validate_table_path(path, table_name)
+    bucket = schema_to_zone_bucket_map[schema]
+
+    if rv.list_objects(path, bucket):
+        raise KeyError((
+            'Files are already present in s3://{}/{}. Creation of a new table '
+            'requires a dedicated, empty folder. Either specify a different '
+            'path for the table or ensure the directory is empty before '
+            'attempting table creation.').format(bucket, path))
+
+    col_defs = dtype_mapping.map_arrow_to_db_dtypes(arrow_schema)
+    build_and_run_ddl_stmt(None, table_name, schema, col_defs, 'parquet',
+                           bucket, path, filename='',
+                           col_comments=col_comments,
+                           table_comment=table_comment,
+                           partitioned_by=partitioned_by,
+                           auto_upload_df=False)
+    return bucket, path
+
+
+def prep_table_for_ingest(table_name, schema, arrow_schema):
+    """
+    Checks that the files being ingested can be appended to an existing
+    table, and reorders the ingested columns to match the table's
+
+    Returns:
+        tuple<str, str, dict>:
+            The bucket, path, and table properties of the table
+    Raises:
+        ValueError:
+            If the table is not a Parquet table, is bucketed, or the files
+            being ingested do not contain the same columns as the table
+        TypeError:
+            If the types of the columns being ingested do not match
+            the table's
+    """
+    table_metadata = meta.get_table_metadata(table_name, schema)
+    if table_metadata['storage_type'] != 'parquet':
+        raise ValueError(
+            'Files can only be ingested into Parquet tables.')
+    if table_metadata.get('bucketing'):
+        # Ingested files are not split into buckets
+        raise ValueError(
+            'Files cannot be ingested into bucketed tables.')
+
+    table_cols = meta.get_table_column_order(table_name, schema,
+                                             include_dtypes=True)
+    table_dtypes = dict(zip(table_cols['col_name'], table_cols['dtype']))
+    ingest_dtypes = dtype_mapping.map_arrow_to_db_dtypes(arrow_schema)
+    ingest_dtypes = dict(zip(ingest_dtypes['col_name'].str.lower(),
+                             ingest_dtypes['dtype']))
+
+    if set(table_dtypes) != set(ingest_dtypes):
+        raise ValueError(
+            'The files being ingested must contain the same columns as '
+            'the table. Missing columns: {}. Extra columns: {}.'.format(
+                sorted(set(table_dtypes) - set(ingest_dtypes)),
+                sorted(set(ingest_dtypes) - set(table_dtypes))))
+
+    def normalize(dtype):
+        return dtype.replace(' ', '').lower()
+    mismatched_cols = [col for col in table_dtypes
+                       if normalize(table_dtypes[col]) !=
+                       normalize(ingest_dtypes[col])]
+    if mismatched_cols:
+        raise TypeError(
+            'The types of the following columns do not match the types of '
+            'the table\'s columns: {}.'.format(', '.join(mismatched_cols)))
+
+    return (table_metadata['bucket'],
+            meta.ensure_path_ends_w_slash(table_metadata['path']),
+            table_metadata.get('tblproperties') or {})
+
+
+def conform_batch(batch, arrow_schema):
+    """
+    Casts a record batch to the schema being written. Columns are
+    matched by name, ignoring case and order.
+
+    Args:
+        batch (pa.RecordBatch): The batch to conform
+        arrow_schema (pa.Schema): The schema to conform it to
+    Returns:
+        pa.RecordBatch: The conformed batch
+    """
+    batch_cols = {name.lower(): col for name, col
+                  in zip(batch.schema.names, batch.columns)}
+    schema_cols = [name.lower() for name in arrow_schema.names]
+    if set(batch_cols) != set(schema_cols):
+        raise ValueError(
+            'All files being ingested must contain the same columns. '
+            'Expected columns: {}. Found columns: {}.'.format(
+                sorted(schema_cols), sorted(batch_cols)))
+
+    arrays = []
+    for field, col in zip(arrow_schema, schema_cols):
+        try:
+            arrays.append(batch_cols[col].cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise TypeError(
+                'Column \'{}\' could not be cast to type \'{}\'.'.format(
+                    field.name, field.type)) from e
+    return pa.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+
+
+def write_batches(batches, arrow_schema, bucket, path, filename_stem,
+                  target_file_size, max_workers, writer_settings):
+    """
+    Groups record batches into files of roughly 'target_file_size' bytes,
+    and writes and uploads those files in the background. No more than
+    'max_workers' files are held in memory waiting to be written.
+
+    Returns:
+        int: The number of files written
+    """
+    in_flight = deque()
+    s3 = lake_files.get_s3_client()
+    num_files = 0
+
+    def submit(pending):
+        if len(in_flight) >= max_workers:
+            in_flight.popleft().result()
+        key = path + '{}_{:05d}.parquet'.format(filename_stem, num_files)
+        in_flight.append(executor.submit(
+            write_parquet_file, pa.Table.from_batches(pending, arrow_schema),
+            bucket, key, writer_settings, s3))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            pending = []
+            pending_size = 0
+            for batch in batches:
+                batch = conform_batch(batch, arrow_schema)
+                pending.append(batch)
+                pending_size += batch.nbytes
+                if pending_size >= target_file_size:
+                    submit(pending)
+                    num_files += 1
+                    pending = []
+                    pending_size = 0
+            # Tables are given a file even if no rows were ingested, so
+            # that the files' schema is still stored
+            if pending or not num_files:
+                submit(pending)
+                num_files += 1
+
+            while in_flight:
+                in_flight.popleft().result()
+        except Exception as e:
+            for future in in_flight:
+                future.cancel()
+            raise e
+
+    return num_files
+
+
+def write_parquet_file(table, bucket, key, writer_settings, s3):
+    """
+    Writes an Arrow table to a Parquet file in the lake's format, and
+    uploads it to S3
+
+    Args:
+        table (pa.Table): The data to write
+        bucket (str): The bucket to upload the file to
+        key (str): The key to upload the file to
+        writer_settings (dict): The settings to pass to pyarrow's writer
+        s3 (botocore.client.S3): The client to upload the file with
+    """
+    if rv.exists(key, bucket):
+        raise KeyError('A file already exists at s3://{}/{}, '
+                       'Which will be overwritten by this operation. '
+                       'Specify a different filename to proceed.'.format(
+                           bucket, key))
+
+    with TemporaryDirectory() as tmpdir:
+        local_path = os.path.join(tmpdir, os.path.basename(key))
+        pq.write_table(table, local_path, **writer_settings)
+        lake_files.upload_file(local_path, bucket, key, s3)
@@ -0,0 +1,222 @@
+import io
+
+import boto3
+
+
+"""
+Lower-level S3 operations on the files underlying lake tables.
+
+rivet is used for reading and writing DataFrames, but operations that work
+with many files at once - often in parallel - need object sizes and a single
+client that can be shared across threads, neither of which rivet provides.
+"""
+
+# Maximum number of keys that can be deleted in a single S3 request
+delete_batch_size = 1000
+# Size of the parts of streamed uploads. S3 requires every part but the last
+# to be at least 5 MB
+upload_part_size = 8 * 1024 ** 2
+
+
+def get_s3_client():
+    """
+    Creates an S3 client. Clients are thread-safe once created, but creating
+    them is not, so one client should be created and then shared between
+    any threads that need it.
+    """
+    return boto3.client('s3')
+
+
+def list_data_files(bucket, path, s3=None):
+    """
+    Lists the files directly within a folder in S3, along with their sizes.
+    Nested folders are not included, and neither are files or folders that
+    Hive considers to be hidden (names beginning with '_' or '.')
+
+    Args:
+        bucket (str): The bucket to list files in
+        path (str): The folder to list files in
+        s3 (botocore.client.S3, optional): The client to list files with
+    Returns:
+        list<dict>:
+            Dictionaries containing the 'key' and 'size' of each file,
+            sorted by key
+    """
+    s3 = s3 or get_s3_client()
+
+    files = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=path, Delimiter='/'):
+        for obj in page.get('Contents', []):
+            filename = obj['Key'][len(path):]
+            if not filename or filename.startswith(('_', '.')):
+                continue
+            files.append({'key': obj['Key'], 'size': obj['Size']})
+
+    return sorted(files, key=lambda file: file['key'])
+
+
+def download_file(bucket, key, local_path, s3=None):
+    """Downloads an object from S3 to a local file"""
+    s3 = s3 or get_s3_client()
+    s3.download_file(bucket, key, local_path)
+
+
+def upload_file(local_path, bucket, key, s3=None):
+    """Uploads a local file to S3"""
+    s3 = s3 or get_s3_client()
+    s3.upload_file(local_path, bucket, key)
+
+
+def read_object(bucket, key, s3=None):
+    """Reads the contents of an object from S3 into memory"""
+    s3 = s3 or get_s3_client()
+    return s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def put_object(bucket, key, body, s3=None):
+    """Writes the contents of an object to S3 directly from memory"""
+    s3 = s3 or get_s3_client()
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def open_object(bucket, key, s3=None, buffer_size=io.DEFAULT_BUFFER_SIZE):
+    """
+    Opens an object in S3 as a read-only, seekable binary file. See
+    'S3ObjectReader' - small reads are buffered, while large reads are
+    fetched directly.
+
+    Args:
+        bucket (str): The bucket containing the object
+        key (str): The key of the object
+        s3 (botocore.client.S3, optional): The client to read with
+        buffer_size (int): The size of the buffer for small reads
+    Returns:
+        io.BufferedReader: The opened object
+    """
+    return io.BufferedReader(S3ObjectReader(bucket, key, s3), buffer_size)
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    A read-only, seekable file over an object in S3, which fetches only the
+    byte ranges that are read from it. Allows columnar formats, such as
+    Parquet, to read their footers and just the columns that are needed,
+    without downloading the whole object.
+    """
+    def __init__(self, bucket, key, s3=None):
+        self.bucket = bucket
+        self.key = key
+        self.s3 = s3 or get_s3_client()
+        self.size = self.s3.head_object(
+            Bucket=bucket, Key=key)['ContentLength']
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        return self.pos
+
+    def readinto(self, buffer):
+        end = min(self.pos + len(buffer), self.size)
+        if self.pos >= end:
+            return 0
+        body = self.s3.get_object(
+            Bucket=self.bucket, Key=self.key,
+            Range='bytes={}-{}'.format(self.pos, end - 1))['Body'].read()
+        buffer[:len(body)] = body
+        self.pos += len(body)
+        return len(body)
+
+
+def upload_chunks(chunks, bucket, key, s3=None):
+    """
+    Uploads an object to S3 from an iterable of bytes, as they are generated.
+    Chunks are buffered into parts of 'upload_part_size' bytes and uploaded
+    as a multipart upload, so neither the whole object nor a local file is
+    ever needed. Objects smaller than a single part are uploaded in one
+    request. If uploading fails, the multipart upload is aborted.
+
+    Args:
+        chunks (iterable<bytes>): The contents of the object
+        bucket (str): The bucket to upload the object to
+        key (str): The key to upload the object to
+        s3 (botocore.client.S3, optional): The client to upload with
+    """
+    s3 = s3 or get_s3_client()
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+
+    def upload_part(body):
+        part_number = len(parts) + 1
+        response = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                  PartNumber=part_number, Body=body)
+        parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= upload_part_size:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(
+                        Bucket=bucket, Key=key)['UploadId']
+                upload_part(bytes(buffer))
+                buffer = bytearray()
+
+        if upload_id is None:
+            s3.put_object(Bucket=bucket, Key=key, Body=bytes(buffer))
+            return
+        if buffer:
+            upload_part(bytes(buffer))
+        s3.complete_multipart_upload(Bucket=bucket, Key=key,
+                                     UploadId=upload_id,
+                                     MultipartUpload={'Parts': parts})
+    except Exception as e:
+        if upload_id is not None:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key,
+                                      UploadId=upload_id)
+        raise e
+
+
+def copy_file(bucket, source_key, dest_key, s3=None):
+    """
+    Copies an object within a bucket. The copy is done entirely within S3,
+    without the object being downloaded.
+    """
+    s3 = s3 or get_s3_client()
+    s3.copy({'Bucket': bucket, 'Key': source_key}, bucket, dest_key)
+
+
+def delete_files(bucket, keys, s3=None):
+    """
+    Deletes specific objects from a bucket, in as few requests as possible
+
+    Args:
+        bucket (str): The bucket containing the objects
+        keys (list<str>): The keys of the objects to delete
+        s3 (botocore.client.S3, optional): The client to delete files with
+    """
+    s3 = s3 or get_s3_client()
+    keys = list(keys)
+    for i in range(0, len(keys), delete_batch_size):
+        s3.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': key}
+                        for key in keys[i:i + delete_batch_size]],
+            'Quiet': True
+        })
@@ -0,0 +1,331 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from honeycomb import lake_files, meta
+from honeycomb.alter_table import (
+    add_partition, set_partition_location, set_table_location
+)
+from honeycomb.append_table import (
+    get_append_target, get_storage_settings, prep_df_for_appending,
+    validate_filename_for_target
+)
+from honeycomb.file_writing import write_df
+from honeycomb.inform import inform
+
+
+"""
+Notes on merging
+
+Upserting rows into a table by reading it with a query, merging in pandas,
+and recreating the table moves every row of the table twice, and cannot be
+done for partitioned tables. Merging instead reads and rewrites only the
+files that contain rows being replaced.
+
+How a DataFrame is merged:
+    a) The DataFrame is split by the values of the table's partition columns,
+       and each partition it touches is merged separately. Partitions it
+       does not touch are never read.
+    b) Only the key columns of the files in a partition are read, with
+       ranged requests to S3, so the rest of each file is never downloaded.
+       The keys are matched against the DataFrame's keys in pandas, without
+       iterating over rows.
+    c) A new, versioned folder within the partition's location is filled:
+       files with no matching keys are copied as-is within S3, files with
+       matching keys are rewritten without the matching rows, and the
+       DataFrame's rows for the partition are written as a new file.
+    d) The partition is pointed at the new folder, and its original files
+       are deleted. As with compaction, queries see either the original
+       rows or the merged rows, never both.
+
+Partitions that do not exist yet are created, and their rows are appended.
+Unpartitioned tables are merged in the same way, as a single location.
+
+Keys are matched within each partition, so a row whose partition values
+have changed will not be removed from the partition it was in before.
+"""
+
+
+def merge_df_into_table(df, table_name, key_cols, schema=None,
+                        filename=None, dtypes=None, timezones=None,
+                        copy_df=True, max_workers=8):
+    """
+    Merges a DataFrame into an existing table, replacing the rows of the
+    table whose keys are in the DataFrame, and appending the rest. Only
+    the partitions - and within them, only the files - that contain rows
+    being replaced are rewritten. See notes above for further details.
+    Only Parquet tables that are not bucketed are supported.
+
+    Args:
+        df (pd.DataFrame): The rows to merge into the table
+        table_name (str): The table to merge into
+        key_cols (list<str>):
+            The columns that identify each row. Must not contain duplicates
+            within the DataFrame
+        schema (str, optional): The schema that contains the table
+        filename (str, optional):
+            Name to store the DataFrame's rows under in each partition. Can
+            be left blank if writing to the experimental zone, in which case
+            a name will be generated.
+        dtypes (dict<str:str>, optional): A dictionary specifying dtypes for
+            specific columns to be cast to prior to uploading.
+        timezones (dict<str, str>):
+            Dictionary from datetime columns to the timezone they
+            represent. See 'append_df_to_table' for further details.
+        copy_df (bool):
+            Whether the operations performed on df should be performed on the
+            original or a copy
+        max_workers (int, default 8):
+            The maximum number of files to be read or written at once
+    Returns:
+        pd.DataFrame:
+            A report containing each location merged into, the number of
+            files in it that were rewritten, the number of rows replaced,
+            and the number of rows written from the DataFrame
+    Raises:
+        ValueError:
+            If the table is in the curated zone, outside of a production
+            environment
+    """
+    if copy_df:
+        df = df.copy()
+
+    table_name, schema = meta.prep_schema_and_table(table_name, schema)
+    # Merging rewrites and deletes the table's existing files
+    if schema == 'curated' and not os.getenv('HC_PROD_ENV'):
+        raise ValueError(
+            'Merging is not available for curated tables. Contact a lake '
+            'administrator if modification of a curated table is needed.')
+
+    target = get_append_target(table_name, schema)
+    if target['storage_type'] != 'parquet':
+        raise ValueError('Merging is only supported for Parquet tables.')
+    if target['bucketing']:
+        raise ValueError('Merging into bucketed tables is not supported.')
+
+    if filename is None:
+        filename = meta.gen_filename_if_allowed(schema, 'parquet')
+    validate_filename_for_target(filename, target)
+
+    # Hive reports column names in lowercase
+    lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+    partition_cols = meta.get_partition_cols(table_name, schema) or []
+    missing_cols = [col for col in list(key_cols) + partition_cols
+                    if col.lower() not in lower_to_orig_col_map]
+    if missing_cols:
+        raise ValueError(
+            'Key and partition columns are not present in the DataFrame: '
+            '{}'.format(', '.join(missing_cols)))
+    key_cols = [lower_to_orig_col_map[col.lower()] for col in key_cols
+                if col.lower() not in partition_cols]
+    if not key_cols:
+        raise ValueError(
+            'At least one key column that is not a partition column '
+            'must be provided.')
+    if df.duplicated(key_cols + [lower_to_orig_col_map[col]
+                                 for col in partition_cols]).any():
+        raise ValueError('The DataFrame contains duplicate keys.')
+    null_partition_cols = [lower_to_orig_col_map[col]
+                           for col in partition_cols
+                           if df[lower_to_orig_col_map[col]].isna().any()]
+    if null_partition_cols:
+        raise ValueError(
+            'Partition columns cannot contain null values: {}'.format(
+                ', '.join(null_partition_cols)))
+
+    s3 = lake_files.get_s3_client()
+    report = []
+    if not partition_cols:
+        df = prep_df_for_appending(df, target, dtypes, timezones, None,
+                                   require_identical_columns=True)
+        report.append(merge_df_into_location(
+            df, key_cols, target, None, target['bucket'], target['path'],
+            filename, max_workers, s3))
+    else:
+        existing_partitions = [
+            tuple(partition[col] for col in partition_cols)
+            for partition in meta.get_partitions(table_name, schema)]
+        orig_partition_cols = [lower_to_orig_col_map[col]
+                               for col in partition_cols]
+
+        # Grouping by a single column gives its values as scalars
+        grouper = (orig_partition_cols if len(orig_partition_cols) > 1
+                   else orig_partition_cols[0])
+        for values, partition_df in df.groupby(grouper, sort=False):
+            if not isinstance(values, tuple):
+                values = (values,)
+            partition_values = dict(zip(
+                partition_cols, map(format_partition_value, values)))
+            partition_df = prep_df_for_appending(
+                partition_df.drop(columns=orig_partition_cols), target,
+                dtypes, timezones, partition_values,
+                require_identical_columns=True)
+
+            if tuple(partition_values.values()) in existing_partitions:
+                bucket, path = meta.get_partition_s3_location(
+                    table_name, schema, partition_values)
+                report.append(merge_df_into_location(
+                    partition_df, key_cols, target, partition_values,
+                    bucket, path, filename, max_workers, s3))
+            else:
+                path = target['path'] + add_partition(
+                    table_name, schema, partition_values)
+                write_df(partition_df, path + filename, target['bucket'],
+                         'parquet',
+                         get_storage_settings(target, None, partition_df))
+                report.append({
+                    'location': 's3://{}/{}'.format(target['bucket'], path),
+                    'files_rewritten': 0,
+                    'rows_replaced': 0,
+                    'rows_written': len(partition_df)
+                })
+
+    return pd.DataFrame(report, columns=['location', 'files_rewritten',
+                                         'rows_replaced', 'rows_written'])
+
+
+def format_partition_value(value):
+    """
+    Formats a partition value the way Hive lists it, with datetimes
+    represented by their date, as they are when partitions are added
+    """
+    if isinstance(value, datetime):
+        return str(value.date())
+    return str(value)
+
+
+def merge_df_into_location(df, key_cols, target, partition_values,
+                           bucket, path, filename, max_workers, s3):
+    """
+    Merges a prepared DataFrame into the files of a table/partition, and
+    swaps the table/partition to the merged files
+
+    Args:
+        df (pd.DataFrame): The prepared rows to merge
+        key_cols (list<str>): The columns that identify each row
+        target (dict): The table being merged into, from 'get_append_target'
+        partition_values (dict<str:str>):
+            The partition being merged into. None if the table is not
+            partitioned
+        bucket (str): The bucket containing the files
+        path (str): The current location of the table/partition
+        filename (str): The name to store the DataFrame's rows under
+        max_workers (int): The maximum number of files to read/write at once
+        s3 (botocore.client.S3): The client to perform S3 operations with
+    Returns:
+        dict: The location's entry in the report of 'merge_df_into_table'
+    """
+    path = meta.ensure_path_ends_w_slash(path)
+    files = lake_files.list_data_files(bucket, path, s3)
+    if any(file['key'] == path + filename for file in files):
+        raise KeyError('A file already exists at s3://{}/{}. Specify a '
+                       'different filename to proceed.'.format(
+                           bucket, path + filename))
+
+    keys = pd.MultiIndex.from_frame(df[key_cols])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        replaced_masks = list(executor.map(
+            lambda file: find_replaced_rows(bucket, file['key'], key_cols,
+                                            keys, s3),
+            files))
+    num_rewritten = sum(mask.any() for mask in replaced_masks)
+    inform('Merging {} rows into s3://{}/{}, rewriting {} of {} '
+           'files...'.format(len(df), bucket, path, num_rewritten,
+                             len(files)))
+
+    new_path = meta.gen_versioned_path(path)
+    writer_settings = meta.get_parquet_writer_settings()
+    writer_settings.update(meta.get_compression_settings(
+        'parquet', target.get('tblproperties')))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            for file, replaced in zip(files, replaced_masks):
+                dest_key = new_path + file['key'][len(path):]
+                if not replaced.any():
+                    futures.append(executor.submit(
+                        lake_files.copy_file, bucket, file['key'], dest_key,
+                        s3))
+                # Files whose rows are all replaced are left out entirely
+                elif not replaced.all():
+                    futures.append(executor.submit(
+                        rewrite_file_without_rows, bucket, file['key'],
+                        dest_key, replaced, writer_settings, s3))
+            futures.append(executor.submit(
+                write_df, df, new_path + filename, bucket, 'parquet',
+                get_storage_settings(target, None, df)))
+            for future in futures:
+                future.result()
+
+        if partition_values is None:
+            set_table_location(target['table_name'], target['schema'],
+                               bucket, new_path)
+        else:
+            set_partition_location(target['table_name'], target['schema'],
+                                   partition_values, bucket, new_path)
+    except Exception as e:
+        # The table/partition has not been swapped to the new folder,
+        # so anything written to it can be safely discarded
+        written_keys = [file['key'] for file in
+                        lake_files.list_data_files(bucket, new_path, s3)]
+        lake_files.delete_files(bucket, written_keys, s3)
+        raise e
+
+    lake_files.delete_files(bucket, [file['key'] for file in files], s3)
+    return {
+        'location': 's3://{}/{}'.format(bucket, new_path),
+        'files_rewritten': num_rewritten,
+        'rows_replaced': int(sum(mask.sum() for mask in replaced_masks)),
+        'rows_written': len(df)
+    }
+
+
+def find_replaced_rows(bucket, key, key_cols, keys, s3):
+    """
+    Reads only the key columns of a Parquet file, and finds the rows whose
+    keys are being replaced
+
+    Args:
+        bucket (str): The bucket containing the file
+        key (str): The key of the file
+        key_cols (list<str>): The columns that identify each row
+        keys (pd.MultiIndex): The keys of the rows being merged
+        s3 (botocore.client.S3): The client to read the file with
+    Returns:
+        np.ndarray: A boolean mask of the file's rows that are replaced
+    """
+    with lake_files.open_object(bucket, key, s3) as f:
+        parquet_file = pq.ParquetFile(f)
+        file_cols = {col.lower(): col
+                     for col in parquet_file.schema_arrow.names}
+        missing_cols = [col for col in key_cols
+                        if col.lower() not in file_cols]
+        if missing_cols:
+            raise ValueError(
+                'Key columns are not present in s3://{}/{}: {}'.format(
+                    bucket, key, ', '.join(missing_cols)))
+        file_keys = parquet_file.read(
+            columns=[file_cols[col.lower()] for col in key_cols]).to_pandas()
+    return pd.MultiIndex.from_frame(file_keys).isin(keys)
+
+
+def rewrite_file_without_rows(bucket, source_key, dest_key, replaced,
+                              writer_settings, s3):
+    """
+    Rewrites a Parquet file without the rows that are being replaced. The
+    rows that are kept are never converted to pandas, so they are written
+    with exactly the same types they were read with.
+    """
+    with lake_files.open_object(bucket, source_key, s3) as f:
+        table = pq.read_table(f)
+
+    with TemporaryDirectory() as tmpdir:
+        local_path = os.path.join(tmpdir, os.path.basename(dest_key))
+        pq.write_table(table.filter(pa.array(~replaced)), local_path,
+                       **writer_settings)
+        lake_files.upload_file(local_path, bucket, dest_key, s3)
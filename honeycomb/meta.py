@@ -1,6 +1,8 @@
 from datetime import datetime
 import re
 
+import pandas as pd
+
 from honeycomb import hive
 from honeycomb.describe_table import describe_table
 
@@ -48,7 +50,128 @@ storage_type_specs = {
     }
 }
 
+# pandas-only settings that pyarrow's Parquet writer does not accept
+pandas_only_parquet_settings = ['engine']
+
 create_stmt_query_template = 'SHOW CREATE TABLE {schema}.{table_name}'
+bucketing_regex = (r'CLUSTERED BY \((.*?)\)\s*'
+                   r'(?:SORTED BY \((.*?)\)\s*)?INTO (\d+) BUCKETS')
+tblproperty_regex = r"'((?:[^'\\]|\\.)*)'='((?:[^'\\]|\\.)*)'"
+# A column in a CREATE TABLE statement, along with the comma or parenthesis
+# that follows it, and its comment if it has one
+col_def_regex = (r"^\s*`([^`]+)`\s+(.*?)"
+                 r"(?:\s+COMMENT\s+'(?:[^'\\]|\\.)*')?[,)]?$")
+
+# Table property recording the columns a table's files are sorted by
+sort_by_tblproperty = 'honeycomb.sort_by'
+
+# Table properties recording the codec a table's files are compressed with.
+# Hive compresses the ORC files it writes with 'orc.compress' itself, and
+# honeycomb writes Parquet and Avro files with the recorded codec
+compression_tblproperties = {
+    'avro': 'avro.output.codec',
+    'orc': 'orc.compress',
+    'parquet': 'parquet.compression'
+}
+# The codecs each storage format can be compressed with, from the names
+# accepted by 'compression' to the values recorded in the table properties.
+# LZ4 is excluded for Parquet, as pyarrow writes it as LZ4_RAW, which
+# Hive's Parquet reader does not support
+compression_codecs = {
+    'avro': {
+        'none': 'null',
+        'deflate': 'deflate',
+        'snappy': 'snappy',
+        'zstd': 'zstandard',
+        'bzip2': 'bzip2',
+        'xz': 'xz'
+    },
+    'orc': {
+        'none': 'NONE',
+        'zlib': 'ZLIB',
+        'snappy': 'SNAPPY',
+        'lz4': 'LZ4',
+        'zstd': 'ZSTD'
+    },
+    'parquet': {
+        'none': 'UNCOMPRESSED',
+        'snappy': 'SNAPPY',
+        'gzip': 'GZIP',
+        'zstd': 'ZSTD'
+    }
+}
+
+# Versioned folders are prefixed with an underscore, which Hive treats as
+# hidden. This keeps their files from being picked up by anything reading
+# their parent folder, even recursively.
+versioned_folder_template = '_v{}/'
+versioned_folder_regex = r'_v\d{20}/$'
+
+
+def get_parquet_writer_settings():
+    """
+    Gets the settings honeycomb uses for Parquet files, in the form accepted
+    by pyarrow's Parquet writer rather than by pandas
+    """
+    return {setting: value for setting, value
+            in storage_type_specs['parquet']['settings'].items()
+            if setting not in pandas_only_parquet_settings}
+
+
+def get_compression_tblproperties(storage_type, compression):
+    """
+    Gets the table properties recording the codec a table's files are to be
+    compressed with
+
+    Args:
+        storage_type (str): The storage format of the table
+        compression (str): The codec, as one of the keys of
+            'compression_codecs' for the storage format
+    Returns:
+        dict<str:str>: The table properties
+    Raises:
+        ValueError: If the codec is not supported for the storage format
+    """
+    codecs = compression_codecs.get(storage_type)
+    if codecs is None:
+        raise ValueError(
+            'Compression is not supported for {} tables. Supported storage '
+            'formats are {}.'.format(storage_type,
+                                     ', '.join(compression_codecs)))
+    if compression not in codecs:
+        raise ValueError(
+            'Compression codec \'{}\' is not supported for {} tables. '
+            'Supported codecs are {}.'.format(compression, storage_type,
+                                              ', '.join(codecs)))
+    return {compression_tblproperties[storage_type]: codecs[compression]}
+
+
+def get_compression_settings(storage_type, tblproperties):
+    """
+    Gets the settings to write files to a table with, so that they are
+    compressed with the codec recorded in the table's properties, if any.
+    Hive compresses ORC files itself, so no settings are needed for them.
+
+    Args:
+        storage_type (str): The storage format of the table
+        tblproperties (dict<str:str>): The table's properties
+    Returns:
+        dict: The settings, to update the storage format's settings with
+    """
+    tblproperty = compression_tblproperties.get(storage_type)
+    if (tblproperty is None or storage_type == 'orc' or
+            tblproperty not in (tblproperties or {})):
+        return {}
+
+    recorded_codec = tblproperties[tblproperty].lower()
+    for compression, codec in compression_codecs[storage_type].items():
+        if codec.lower() == recorded_codec:
+            if storage_type == 'parquet':
+                return {'compression': compression}
+            return {'codec': codec}
+    raise ValueError(
+        'Table property \'{}\'=\'{}\' is not a supported codec.'.format(
+            tblproperty, tblproperties[tblproperty]))
 
 
 def prep_schema_and_table(table, schema):
@@ -84,6 +207,23 @@ def validate_table_path(path, table_name):
     return path
 
 
+def gen_versioned_path(path):
+    """
+    Generates a new, unique folder for a table or partition to be relocated
+    to. The folder is nested within the original storage location of the
+    table/partition, and if the path is already versioned, the new
+    version will replace the old one rather than being nested under it.
+
+    Args:
+        path (str): The current path of the table or partition
+    Returns:
+        str: The versioned path
+    """
+    path = re.sub(versioned_folder_regex, '', ensure_path_ends_w_slash(path))
+    version = datetime.strftime(datetime.now(), '%Y%m%d%H%M%S%f')
+    return path + versioned_folder_template.format(version)
+
+
 def gen_filename_if_allowed(schema, storage_type=None):
     """
     Pass-through to name generation fn, if writing to the experimental zone
@@ -151,36 +291,91 @@ def get_table_metadata(table_name, schema):
     Args:
         table_name (str): The table to get the metadata of
         schema (str): The schema the table is in
+    Returns:
+        dict:
+            The table's 'bucket', 'path', 'storage_type', 'tblproperties',
+            'bucketing', and the names and types of its columns in
+            'col_defs', excluding partition columns
     """
-    bucket, path = get_table_s3_location(table_name, schema)
-    storage_type = get_table_storage_type(table_name, schema)
+    create_stmt = get_table_create_stmt(table_name, schema)
+    bucket, path = parse_s3_location(create_stmt)
 
     metadata_dict = {
         'bucket': bucket,
         'path': path,
-        'storage_type': storage_type
+        'storage_type': parse_storage_type(create_stmt),
+        'tblproperties': parse_tblproperties(create_stmt),
+        'bucketing': parse_bucketing(create_stmt),
+        'col_defs': parse_col_defs(create_stmt)
     }
     return metadata_dict
 
 
-def get_table_s3_location(table_name, schema):
+def get_table_create_stmt(table_name, schema):
     """
-    Extracts the underlying S3 location a table uses from its metadata
+    Gets the CREATE TABLE statement of a table, as returned by Hive
 
     Args:
-        table_metadata (pd.DataFrame):
-            The metadata of a table in the lake as returned from
-            'get_table_metadata'
+        table_name (str): The table to get the statement of
+        schema (str): The schema the table is in
+    Returns:
+        pd.DataFrame:
+            The statement, one line per row in the column 'createtab_stmt'
     """
     create_stmt_query = create_stmt_query_template.format(
         schema=schema,
         table_name=table_name
     )
-    table_metadata = hive.run_lake_query(create_stmt_query)
+    return hive.run_lake_query(create_stmt_query)
+
+
+def get_table_s3_location(table_name, schema):
+    """
+    Extracts the underlying S3 location a table uses from its metadata
+
+    Args:
+        table_name (str): The table to get the location of
+        schema (str): The schema the table is in
+    """
+    return parse_s3_location(get_table_create_stmt(table_name, schema))
+
+
+def get_table_storage_type(table_name, schema):
+    """
+    Identifies the format a table's underlying files are stored in using
+    the table's metadata.
+
+    Args:
+        table_name (str): The table to get the storage type of
+        schema (str): The schema the table is in
+    """
+    return parse_storage_type(get_table_create_stmt(table_name, schema))
+
+
+def get_table_properties(table_name, schema):
+    """
+    Gets the TBLPROPERTIES of a table
 
-    loc_label_idx = table_metadata.index[
-        table_metadata['createtab_stmt'].str.strip() == "LOCATION"].values[0]
-    location = table_metadata.loc[
+    Args:
+        table_name (str): The table to get the properties of
+        schema (str): The schema the table is in
+    """
+    return parse_tblproperties(get_table_create_stmt(table_name, schema))
+
+
+def parse_s3_location(create_stmt):
+    """
+    Extracts the S3 location of a table from its CREATE TABLE statement
+
+    Args:
+        create_stmt (pd.DataFrame):
+            The statement, as returned from 'get_table_create_stmt'
+    Returns:
+        tuple<str, str>: The bucket and path of the table
+    """
+    loc_label_idx = create_stmt.index[
+        create_stmt['createtab_stmt'].str.strip() == "LOCATION"].values[0]
+    location = create_stmt.loc[
         loc_label_idx + 1, 'createtab_stmt'].strip()[1:-1]
 
     prefix = 's3://'
@@ -190,20 +385,14 @@ def get_table_s3_location(table_name, schema):
     return bucket, path
 
 
-def get_table_storage_type(table_name, schema):
+def parse_storage_type(create_stmt):
     """
-    Identifies the format a table's underlying files are stored in using
-    the table's metadata.
+    Identifies the storage format of a table from its CREATE TABLE statement
 
     Args:
-        table_metadata (pd.DataFrame): Metadata of the table being examined
+        create_stmt (pd.DataFrame):
+            The statement, as returned from 'get_table_create_stmt'
     """
-    create_stmt_query = create_stmt_query_template.format(
-        schema=schema,
-        table_name=table_name
-    )
-    table_metadata = hive.run_lake_query(create_stmt_query)
-
     hive_input_format_to_storage_type = {
         'org.apache.hadoop.hive.ql.io.avro.AvroContainerInputFormat': 'avro',
         'org.apache.hadoop.mapred.TextInputFormat': 'text',
@@ -211,10 +400,10 @@ def get_table_storage_type(table_name, schema):
             'parquet',
         'org.apache.hadoop.hive.ql.io.orc.OrcInputFormat': 'orc'
     }
-    format_label_idx = table_metadata.index[
-        table_metadata['createtab_stmt'].str.strip() ==
+    format_label_idx = create_stmt.index[
+        create_stmt['createtab_stmt'].str.strip() ==
         "STORED AS INPUTFORMAT"].values[0]
-    input_format = table_metadata.loc[
+    input_format = create_stmt.loc[
         format_label_idx + 1, 'createtab_stmt'].strip()[1:-1]
 
     storage_format = hive_input_format_to_storage_type[input_format]
@@ -222,10 +411,10 @@ def get_table_storage_type(table_name, schema):
         # Both CSV and JSON tables will have a storage format of 'text',
         # so we must further differentiate them by checking the
         # serde type
-        serde_label_idx = table_metadata.index[
-            table_metadata['createtab_stmt'].str.strip() ==
+        serde_label_idx = create_stmt.index[
+            create_stmt['createtab_stmt'].str.strip() ==
             "ROW FORMAT SERDE"].values[0]
-        serde_type = table_metadata.loc[
+        serde_type = create_stmt.loc[
             serde_label_idx + 1, 'createtab_stmt'].strip()[1:-1]
         if serde_type == 'org.apache.hadoop.hive.serde2.JsonSerDe':
             storage_format = 'json'
@@ -235,6 +424,130 @@ def get_table_storage_type(table_name, schema):
     return storage_format
 
 
+def parse_tblproperties(create_stmt):
+    """
+    Extracts the TBLPROPERTIES of a table from its CREATE TABLE statement.
+    Property values can span multiple lines (such as Avro schema literals),
+    so the lines are rejoined before being parsed.
+
+    Args:
+        create_stmt (pd.DataFrame):
+            The statement, as returned from 'get_table_create_stmt'
+    Returns:
+        dict<str:str>: The table's properties
+    """
+    lines = create_stmt['createtab_stmt']
+    label_idx = lines.index[lines.str.strip() == 'TBLPROPERTIES ('].values
+    if not len(label_idx):
+        return {}
+
+    tblproperties_str = '\n'.join(lines.loc[label_idx[0] + 1:])
+    return {
+        prop_name: prop_val
+        for prop_name, prop_val in re.findall(
+            tblproperty_regex, tblproperties_str, flags=re.DOTALL)
+    }
+
+
+def parse_bucketing(create_stmt):
+    """
+    Extracts the bucketing of a table from its CREATE TABLE statement
+
+    Args:
+        create_stmt (pd.DataFrame):
+            The statement, as returned from 'get_table_create_stmt'
+    Returns:
+        dict:
+            The table's 'bucketed_by' columns, 'num_buckets', and
+            'sorted_by' columns, or None if the table is not bucketed
+    """
+    match = re.search(bucketing_regex,
+                      ' '.join(create_stmt['createtab_stmt']),
+                      flags=re.DOTALL)
+    if match is None:
+        return None
+
+    def parse_cols(cols_str):
+        # Sort columns are listed along with their sort direction
+        return [col.strip().split(' ')[0].strip('`')
+                for col in cols_str.split(',')]
+
+    bucketed_by, sorted_by, num_buckets = match.groups()
+    return {
+        'bucketed_by': parse_cols(bucketed_by),
+        'num_buckets': int(num_buckets),
+        'sorted_by': parse_cols(sorted_by) if sorted_by else None
+    }
+
+
+def parse_col_defs(create_stmt):
+    """
+    Extracts the names and types of a table's columns from its CREATE TABLE
+    statement. Partition columns are listed separately in the statement,
+    and are not included.
+
+    Args:
+        create_stmt (pd.DataFrame):
+            The statement, as returned from 'get_table_create_stmt'
+    Returns:
+        pd.DataFrame:
+            A DataFrame with the columns 'col_name' and 'dtype', with a row
+            for each column, in order
+    """
+    col_defs = []
+    # Columns are listed one per line, directly after the first line
+    for line in create_stmt['createtab_stmt'].iloc[1:]:
+        match = re.match(col_def_regex, line)
+        if match is None:
+            break
+        col_defs.append(match.groups())
+    return pd.DataFrame(col_defs, columns=['col_name', 'dtype'])
+
+
+def get_sort_by(tblproperties):
+    """
+    Gets the columns a table's files are sorted by from its properties,
+    or None if they are not sorted
+    """
+    sort_by = tblproperties.get(sort_by_tblproperty)
+    return sort_by.split(',') if sort_by else None
+
+
+def sort_df(df, sort_by):
+    """
+    Sorts a DataFrame by the specified columns, so that the files it is
+    written to are clustered by them. Clustered files have narrower min/max
+    statistics per row group/stripe, which allows query engines to skip
+    the ones that cannot match a filter.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to sort
+        sort_by (list<str>):
+            The columns to sort by, in order of precedence. Matched to the
+            DataFrame's columns regardless of case
+    Returns:
+        pd.DataFrame: The sorted DataFrame
+    Raises:
+        ValueError: If any of the columns are not in the DataFrame
+    """
+    lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+    missing_cols = [col for col in sort_by
+                    if col.lower() not in lower_to_orig_col_map]
+    if missing_cols:
+        raise ValueError(
+            'Columns to sort by are not present in the DataFrame: '
+            '{}'.format(', '.join(missing_cols)))
+
+    # The sort order is computed from the sort columns alone, and then
+    # every column is gathered into that order exactly once
+    sort_cols = [lower_to_orig_col_map[col.lower()] for col in sort_by]
+    order = (df[sort_cols].reset_index(drop=True)
+             .sort_values(sort_cols, kind='stable').index.to_numpy())
+    df = df.take(order)
+    df.index = pd.RangeIndex(len(df))
+    return df
+
+
 def is_partitioned_table(table_name, schema):
     desc = describe_table(table_name, schema)
     if any(desc['col_name'] == '# Partition Information'):
@@ -242,6 +555,74 @@ def is_partitioned_table(table_name, schema):
     return False
 
 
+def split_s3_uri(uri):
+    """Splits an S3 URI into its bucket and path"""
+    prefix = 's3://'
+    return uri[len(prefix):].split('/', 1)
+
+
+def get_partition_s3_location(table_name, schema, partition_values):
+    """
+    Extracts the underlying S3 location of a partition from its metadata
+
+    Args:
+        table_name (str): The table containing the partition
+        schema (str): The schema the table is in
+        partition_values (dict<str:str>):
+            Mapping from partition name to partition value, identifying the
+            partition to get the location of
+    """
+    partition_string = ', '.join([
+        '{}=\'{}\''.format(partition_key, partition_value)
+        for partition_key, partition_value in partition_values.items()])
+    partition_metadata = hive.run_lake_query(
+        'DESCRIBE FORMATTED {}.{} PARTITION ({})'.format(
+            schema, table_name, partition_string),
+        engine='hive'
+    )
+
+    # The DataFrame returned by DESCRIBE queries are not organized like a
+    # normal DataFrame, hence the inaccurate column names
+    partition_location = partition_metadata.loc[
+        partition_metadata['col_name'].str.strip() == 'Location:',
+        'data_type'
+    ].values[0].strip()
+
+    bucket, path = split_s3_uri(partition_location)
+    return bucket, path
+
+
+def get_partitions(table_name, schema, partition_values=None):
+    """
+    Lists the partitions of a table, optionally filtered to those that
+    match a subset of partition values
+
+    Args:
+        table_name (str): The table to list the partitions of
+        schema (str): The schema the table is in
+        partition_values (dict<str:str>, optional):
+            Mapping from partition names to values to filter by. Partition
+            names that are not included will match any value
+    Returns:
+        list<dict<str:str>>:
+            Mappings from partition names to values, for each partition
+    """
+    partition_spec = ''
+    if partition_values:
+        partition_spec = ' PARTITION({})'.format(', '.join(
+            ['{}=\'{}\''.format(partition_key, partition_value)
+             for partition_key, partition_value in partition_values.items()]))
+    partitions = hive.run_lake_query(
+        'SHOW PARTITIONS {}.{}{}'.format(schema, table_name, partition_spec),
+        engine='hive')['partition']
+
+    return [
+        dict(partition_value_str.split('=', 1)
+             for partition_value_str in partition.split('/'))
+        for partition in partitions
+    ]
+
+
 def get_partition_cols(table_name, schema):
     if not is_partitioned_table(table_name, schema):
         return None
@@ -1,7 +1,11 @@
+from collections import OrderedDict
 import os
+import uuid
 
-from honeycomb import hive, meta
-from honeycomb.alter_table import build_partition_strings
+import rivet as rv
+
+from honeycomb import check, dtype_mapping, hive, meta
+from honeycomb.alter_table import add_partition, build_partition_strings
 from honeycomb.create_table.build_and_run_ddl_stmt import (
     build_and_run_ddl_stmt
 )
@@ -10,15 +14,22 @@ from honeycomb.__danger import __nuke_table
 
 
 temp_table_name_template = '{}_temp_orc_conv'
+# Staging tables of batch writers are given a unique suffix, so that
+# writers appending to the same table at once do not share one
+batch_temp_table_name_template = '{}_temp_orc_batch_{}'
 temp_storage_type = 'parquet'
 temp_schema = 'landing'
+# The most partitions a single dynamic-partition INSERT may create
+max_dynamic_partitions = 10000
 
 
 def create_orc_table_from_df(df, table_name, schema, col_defs,
                              bucket, path, filename,
                              col_comments=None, table_comment=None,
                              partitioned_by=None, partition_values=None,
-                             hive_functions=None):
+                             hive_functions=None, sort_by=None,
+                             bucketed_by=None, num_buckets=None,
+                             sorted_by=None, compression=None):
     """
     Wrapper around the additional steps required for creating an ORC table
     from a DataFrame, as opposed to any other storage format.
@@ -52,6 +63,16 @@ def create_orc_table_from_df(df, table_name, schema, col_defs,
         hive_functions (dict<str:str> or dict<str:dict>):
             Specifications on what hive functions to apply to which columns.
             See inspected structure in documentation below
+        sort_by (list<str>, optional):
+            Columns to sort the table's files by
+        bucketed_by (list<str>, optional):
+            Columns to bucket the table by. Hive assigns rows to buckets
+            itself when converting them to ORC
+        num_buckets (int, optional): The number of buckets in the table
+        sorted_by (list<str>, optional):
+            Columns that rows within each bucket are sorted by
+        compression (str, optional):
+            The codec for Hive to compress the table's files with
     """
 
     # Create temp table to store data in prior to ORC conversion
@@ -76,10 +97,14 @@ def create_orc_table_from_df(df, table_name, schema, col_defs,
                                storage_type, bucket, path, filename,
                                col_comments, table_comment,
                                partitioned_by, partition_values,
-                               auto_upload_df=False)
+                               auto_upload_df=False, sort_by=sort_by,
+                               bucketed_by=bucketed_by,
+                               num_buckets=num_buckets, sorted_by=sorted_by,
+                               compression=compression)
 
         insert_into_orc_table(table_name, schema, temp_table_name, temp_schema,
-                              partition_values, hive_functions)
+                              partition_values, hive_functions,
+                              sort_by=sort_by)
     finally:
         __nuke_table(temp_table_name, temp_schema)
 
@@ -87,7 +112,7 @@ def create_orc_table_from_df(df, table_name, schema, col_defs,
 def append_df_to_orc_table(df, table_name, schema,
                            bucket, path, filename,
                            partition_values=None,
-                           hive_functions=None):
+                           hive_functions=None, sort_by=None):
     """
     Wrapper around the additional steps required for appending a DataFrame
     to an ORC table, as opposed to any other storage format
@@ -109,6 +134,8 @@ def append_df_to_orc_table(df, table_name, schema,
         hive_functions (dict<str:str> or dict<str:dict>):
             Specifications on what hive functions to apply to which columns.
             See inspected structure in documentation below
+        sort_by (list<str>, optional):
+            Columns to sort the appended data by
     """
     temp_table_name = temp_table_name_template.format(table_name)
     temp_path = temp_table_name_template.format(path[:-1]) + '/'
@@ -125,11 +152,199 @@ def append_df_to_orc_table(df, table_name, schema,
                            auto_upload_df=True)
     try:
         insert_into_orc_table(table_name, schema, temp_table_name, temp_schema,
-                              partition_values, hive_functions)
+                              partition_values, hive_functions,
+                              sort_by=sort_by)
     finally:
         __nuke_table(temp_table_name, temp_schema)
 
 
+class OrcBatchWriter:
+    """
+    Context manager for appending many DataFrames to an ORC table with a
+    single conversion job.
+
+    Appending to an ORC table normally requires a full Hive INSERT for every
+    DataFrame, each of which produces at least one (often small) ORC file.
+    Within this context, DataFrames are instead staged as Parquet files under
+    one temporary table, which mirrors the partitioning of the ORC table.
+    On exit, everything staged is converted with a single INSERT, using
+    dynamic partitioning if the ORC table is partitioned. If an exception
+    is raised within the context, nothing is inserted. The staging table
+    is removed either way.
+
+    Usage:
+        with OrcBatchWriter('table_name', 'experimental') as writer:
+            writer.add(df0, partition_values={'year': '2020'})
+            writer.add(df1, partition_values={'year': '2021'})
+
+    Args:
+        table_name (str): The ORC table to append to
+        schema (str, optional): The schema that contains the table
+        hive_functions (dict<str:str> or dict<str:dict>):
+            Specifications on what hive functions to apply to which columns
+            during conversion. See documentation below
+        sort_by (list<str>, optional):
+            Columns to sort the converted data by. If not provided, the
+            columns recorded in the table's properties are used, if any
+    """
+    def __init__(self, table_name, schema=None, hive_functions=None,
+                 sort_by=None):
+        self.table_name, self.schema = meta.prep_schema_and_table(
+            table_name, schema)
+        self.hive_functions = hive_functions
+        self.sort_by = sort_by
+        self._staging_id = uuid.uuid4().hex
+        self.temp_table_name = batch_temp_table_name_template.format(
+            self.table_name, self._staging_id)
+
+        self.n_files_staged = 0
+        self._staged_partition_paths = {}
+        self._staging_table_created = False
+
+    def __enter__(self):
+        if not check.table_existence(self.table_name, self.schema):
+            raise ValueError(
+                'Table \'{}.{}\' does not exist. '.format(
+                    self.schema, self.table_name))
+
+        table_metadata = meta.get_table_metadata(self.table_name, self.schema)
+        if table_metadata['storage_type'] != 'orc':
+            raise ValueError(
+                'OrcBatchWriter can only be used with ORC tables.')
+
+        if self.sort_by is None:
+            self.sort_by = meta.get_sort_by(
+                table_metadata.get('tblproperties', {}))
+
+        self.bucket = table_metadata['bucket']
+        path = meta.ensure_path_ends_w_slash(table_metadata['path'])
+        self.temp_path = batch_temp_table_name_template.format(
+            path[:-1], self._staging_id) + '/'
+
+        self.col_defs = meta.get_table_column_order(
+            self.table_name, self.schema, include_dtypes=True)
+        self.partition_cols = meta.get_partition_cols(
+            self.table_name, self.schema) or []
+
+        # Partition values are always strings when provided to 'add',
+        # and are cast to the ORC table's partition types on insertion
+        temp_partitioned_by = OrderedDict(
+            (partition_col, 'STRING') for partition_col in self.partition_cols)
+
+        try:
+            build_and_run_ddl_stmt(None, self.temp_table_name, temp_schema,
+                                   self.col_defs, temp_storage_type,
+                                   self.bucket, self.temp_path, filename='',
+                                   partitioned_by=temp_partitioned_by,
+                                   auto_upload_df=False)
+        except Exception as e:
+            # '__exit__' is not called if '__enter__' fails, so the staging
+            # table is removed here in case it was created regardless
+            hive.run_lake_query('DROP TABLE IF EXISTS {}.{}'.format(
+                temp_schema, self.temp_table_name), engine='hive')
+            rv.delete(self.temp_path, self.bucket, recursive=True)
+            raise e
+        self._staging_table_created = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None and self.n_files_staged:
+                # Every partition key is given no value, so that all
+                # partitions are populated dynamically from the staged data
+                partition_values = {partition_col: ''
+                                    for partition_col in self.partition_cols}
+                insert_into_orc_table(self.table_name, self.schema,
+                                      self.temp_table_name, temp_schema,
+                                      partition_values, self.hive_functions,
+                                      sort_by=self.sort_by)
+        finally:
+            if self._staging_table_created:
+                _nuke_temp_table(self.temp_table_name)
+                self._staging_table_created = False
+        return False
+
+    def add(self, df, partition_values=None, dtypes=None, timezones=None,
+            copy_df=True):
+        """
+        Stages a DataFrame for conversion into the ORC table
+
+        Args:
+            df (pd.DataFrame): The DataFrame to append
+            partition_values (dict<str:str>, optional):
+                Mapping from partition keys to the values to store the
+                DataFrame under. Required if the ORC table is partitioned.
+            dtypes (dict<str:str>, optional): A dictionary specifying dtypes
+                for specific columns to be cast to prior to uploading.
+            timezones (dict<str, str>):
+                Dictionary from datetime columns to the timezone they
+                represent. See 'append_df_to_table' for further details.
+            copy_df (bool):
+                Whether the operations performed on df should be performed on
+                the original or a copy.
+        """
+        if not self._staging_table_created:
+            raise ValueError(
+                'OrcBatchWriter must be used as a context manager.')
+
+        partition_values = partition_values or {}
+        if set(partition_values) != set(self.partition_cols):
+            raise ValueError(
+                'Values must be provided for exactly the partition columns '
+                'of {}.{}: {}'.format(self.schema, self.table_name,
+                                      self.partition_cols))
+
+        if copy_df:
+            df = df.copy()
+        df = dtype_mapping.special_dtype_handling(
+            df, spec_dtypes=dtypes, spec_timezones=timezones,
+            schema=self.schema)
+
+        # The staging table's columns are taken directly from the ORC table,
+        # so the DataFrame must match them exactly, in the same order
+        table_col_order = self.col_defs['col_name'].to_list()
+        lower_to_orig_col_map = dict(zip(df.columns.str.lower(), df.columns))
+        if sorted(lower_to_orig_col_map) != sorted(table_col_order):
+            raise ValueError(
+                'The provided dataframe\'s columns do not match '
+                'the columns of the table.')
+        df = df[[lower_to_orig_col_map[col] for col in table_col_order]]
+
+        path = self.temp_path
+        if partition_values:
+            # Ordered according to the table's partitioning
+            partition_values = OrderedDict(
+                (partition_col, partition_values[partition_col])
+                for partition_col in self.partition_cols)
+            partition_key = tuple(partition_values.items())
+            if partition_key not in self._staged_partition_paths:
+                self._staged_partition_paths[partition_key] = add_partition(
+                    self.temp_table_name, temp_schema, partition_values)
+            path += self._staged_partition_paths[partition_key]
+
+        path += '{:05d}.{}'.format(self.n_files_staged, temp_storage_type)
+        storage_settings = dict(
+            meta.storage_type_specs[temp_storage_type]['settings'])
+        if dtype_mapping.has_narrow_db_dtypes(self.col_defs):
+            # The staging table has the ORC table's column types, so its
+            # files must be written in matching physical types
+            storage_settings['schema'] = (
+                dtype_mapping.map_db_to_arrow_schema(df, self.col_defs))
+            df = dtype_mapping.prep_df_for_arrow_schema(
+                df, storage_settings['schema'])
+        rv.write(df, path, self.bucket,
+                 show_progressbar=False, **storage_settings)
+        self.n_files_staged += 1
+
+
+def _nuke_temp_table(temp_table_name):
+    """
+    Removes a staging table and its files. Defined outside of any class,
+    as name mangling would otherwise apply to '__nuke_table'
+    """
+    __nuke_table(temp_table_name, temp_schema)
+
+
 def replace_file_extension(filename):
     """ Replaces extension of filename with the temp storage_type """
     return os.path.splitext(filename)[0] + '.' + temp_storage_type
@@ -139,13 +354,22 @@ def insert_into_orc_table(table_name, schema, source_table_name, source_schema,
                           partition_values=None, hive_functions=None,
                           matching_partitions=False,
                           allow_hive_reserved_words=False,
-                          overwrite=False):
+                          overwrite=False, sort_by=None):
     """
     Inserts all the values in a particular table into its corresponding ORC
     table. We can't simple do a SELECT *, because that will include partition
     columns, which cannot be included in an INSERT statement (since they're
     technically metadata, rather than part of the dataset itself)
 
+    Partition keys in 'partition_values' that are given no value
+    (None or '') are treated as dynamic partitions. Their values are
+    taken from the identically named columns of the source table, which are
+    appended to the end of the SELECT list, and Hive creates and registers
+    every resulting partition as part of the INSERT itself, so a source
+    table spanning many partitions is converted in a single job. When any
+    key is dynamic, every partition key of the table must be provided, and
+    static keys must precede dynamic ones in the table's partitioning.
+
     Args:
         table_name (str): The ORC table to be inserted into
         schema (str): The schema that the destination table is stored in
@@ -165,19 +389,49 @@ def insert_into_orc_table(table_name, schema, source_table_name, source_schema,
             allow the table to be inserted from
         overwrite (bool, default False):
             Whether the insert type should be 'INTO' or 'OVERWRITE'
+        sort_by (list<str>, optional):
+            Columns to sort the inserted data by. Hive does not preserve the
+            order of the source table, so the sort is part of the INSERT
     """
     # List of reserved words in Hive that could reasonably be used as column
     # names. This list may expand with time
     hive_reserved_words = ['date', 'time', 'timestamp', 'order', 'primary']
 
+    if partition_values is None:
+        partition_values = {}
+    dynamic_partition_keys = [
+        partition_key
+        for partition_key, partition_value in partition_values.items()
+        if partition_value is None or str(partition_value) == '']
+    if dynamic_partition_keys:
+        # Hive reads dynamic partition values from the SELECT list in the
+        # order of the table's partitioning
+        partition_values = order_dynamic_partition_values(
+            table_name, schema, partition_values)
+        dynamic_partition_keys = [
+            partition_key for partition_key in partition_values
+            if partition_key in dynamic_partition_keys]
+    static_partition_values = {
+        partition_key: partition_value
+        for partition_key, partition_value in partition_values.items()
+        if partition_key not in dynamic_partition_keys}
+
     # This discludes partition columns, which is desired behavior
     col_names = meta.get_table_column_order(table_name, schema)
     partition_strings = (
-        ' PARTITION ({})'.format(build_partition_strings(partition_values))
+        ' PARTITION ({})'.format(build_partition_strings({
+            partition_key: ('' if partition_key in dynamic_partition_keys
+                            else partition_value)
+            for partition_key, partition_value in partition_values.items()
+        }))
         if partition_values
         else ''
     )
 
+    # Dynamic partition values are read from the last columns selected,
+    # in the same order as they appear in the PARTITION clause
+    col_names += dynamic_partition_keys
+
     for i in range(len(col_names)):
         if col_names[i] in hive_reserved_words:
             if allow_hive_reserved_words:
@@ -198,22 +452,92 @@ def insert_into_orc_table(table_name, schema, source_table_name, source_schema,
         col_names = insert_hive_fns_into_col_names(col_names, hive_functions)
 
     where_clause = ''
-    if matching_partitions:
+    if matching_partitions and static_partition_values:
         where_clause = '\nWHERE ' + ' AND '.join(
             ['source_table.{}="{}"'.format(partition_key, partition_value)
-             for partition_key, partition_value in partition_values.items()])
+             for partition_key, partition_value
+             in static_partition_values.items()])
+    sort_by_clause = ''
+    if sort_by:
+        sort_by_clause = '\nSORT BY {}'.format(', '.join(
+            ['`{}`'.format(col) if col in hive_reserved_words else col
+             for col in sort_by]))
     insert_command = (
         'INSERT {} TABLE {}.{}{}\n'.format(insert_type, schema, table_name,
                                            partition_strings) +
         'SELECT\n'
         '    {}\n'.format(',\n    '.join(col_names)) +
         'FROM {}.{} source_table'.format(source_schema, source_table_name) +
-        '{}'.format(where_clause)
+        '{}{}'.format(where_clause, sort_by_clause)
     )
 
+    configuration = None
+    if dynamic_partition_keys:
+        configuration = get_dynamic_partition_config()
+
     inform(insert_command)
 
-    hive.run_lake_query(insert_command)
+    hive.run_lake_query(insert_command, configuration=configuration)
+
+
+def order_dynamic_partition_values(table_name, schema, partition_values):
+    """
+    Orders the partition values of a dynamic-partition INSERT according to
+    the destination table's partitioning, as Hive requires
+
+    Args:
+        table_name (str): The table being inserted into
+        schema (str): The schema that contains the table
+        partition_values (dict<str:str>):
+            The partition keys of the table, with no value for those that
+            are dynamic
+    Returns:
+        collections.OrderedDict<str:str>: The ordered partition values
+    Raises:
+        ValueError:
+            If not every partition key of the table is provided, or if a
+            static partition key follows a dynamic one
+    """
+    partition_cols = meta.get_partition_cols(table_name, schema) or []
+    # Hive reports column names in lowercase
+    lower_to_orig_key_map = {partition_key.lower(): partition_key
+                             for partition_key in partition_values}
+    if sorted(lower_to_orig_key_map) != sorted(partition_cols):
+        raise ValueError(
+            'Values, or no value for dynamic partitions, must be provided '
+            'for exactly the partition columns of {}.{}: {}'.format(
+                schema, table_name, partition_cols))
+
+    ordered_partition_values = OrderedDict(
+        (lower_to_orig_key_map[partition_col],
+         partition_values[lower_to_orig_key_map[partition_col]])
+        for partition_col in partition_cols)
+    is_dynamic = [partition_value is None or str(partition_value) == ''
+                  for partition_value in ordered_partition_values.values()]
+    if any(is_dynamic[i] and not is_dynamic[i + 1]
+           for i in range(len(is_dynamic) - 1)):
+        raise ValueError(
+            'Static partition keys cannot follow dynamic partition keys. '
+            'The partition columns of {}.{} are, in order: {}'.format(
+                schema, table_name, partition_cols))
+    return ordered_partition_values
+
+
+def get_dynamic_partition_config():
+    """
+    Hive settings required for an INSERT to create partitions from the
+    values of the data being inserted, rather than from literal values
+    provided in its PARTITION clause
+    """
+    return {
+        'hive.exec.dynamic.partition': 'true',
+        'hive.exec.dynamic.partition.mode': 'nonstrict',
+        # Hive's defaults fail INSERTs that create more than 100
+        # partitions on any one node, or 1000 in total
+        'hive.exec.max.dynamic.partitions': str(max_dynamic_partitions),
+        'hive.exec.max.dynamic.partitions.pernode': str(
+            max_dynamic_partitions)
+    }
 
 
 """
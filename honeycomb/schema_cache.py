@@ -0,0 +1,202 @@
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import threading
+
+from honeycomb import dtype_mapping
+from honeycomb.file_writing import avro_type_to_arrow_type
+
+
+"""
+Notes on schema caching
+
+Loaders that run on a schedule often create or replace tables from
+DataFrames with the same structure every time, and inferring the DDL of
+nested columns from scratch on each run is the most expensive part of
+preparing them. A SchemaCache remembers what was inferred for each
+structure of DataFrame, so that it only needs to be inferred once.
+
+A DataFrame's structure is fingerprinted from its column names, its dtypes,
+the options its DDL was inferred with, and the shape - the nested keys and
+value types - of a few values from each of its object columns. A cached
+result is only reused after a sample of each object column's values has
+been checked to conform to the cached DDL. If they do not, the DDL is
+inferred again, and replaces the cached result.
+
+Avro schemas are fingerprinted and validated the same way. Records in an
+Avro schema are inferred from the values of object columns, and fastavro
+silently drops any keys of a dict that are missing from its record, so a
+cached schema is only reused if every sampled value fits it.
+"""
+
+
+class SchemaCache:
+    """
+    An in-memory cache of the column definitions and Avro schemas inferred
+    for DataFrames, to be passed to 'create_table_from_df'. See notes above
+    for further details.
+
+    Example usage:
+        schema_cache = hc.SchemaCache()
+        for df in hourly_dfs:
+            hc.create_table_from_df(df, 'events', overwrite=True,
+                                    schema_cache=schema_cache)
+
+    Args:
+        max_size (int, default 128):
+            The maximum number of results to cache. Once reached, the least
+            recently used result is discarded
+        sample_size (int, default 100):
+            The number of values of each object column to check against
+            the cached DDL before it is reused
+    """
+    def __init__(self, max_size=128, sample_size=100):
+        self.max_size = max_size
+        self.sample_size = sample_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Removes every cached result"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_col_defs(self, df, **options):
+        """
+        Gets the column definitions cached for a DataFrame's structure, if
+        they are present and a sample of its values conforms to them
+
+        Args:
+            df (pd.DataFrame): The DataFrame to get column definitions for
+            options: The options that the definitions are inferred with
+        Returns:
+            pd.DataFrame: The column definitions, or None if not cached
+        """
+        col_defs = self._get(fingerprint(df, 'col_defs', **options))
+        if col_defs is None:
+            return None
+
+        db_dtypes = dict(zip(col_defs['col_name'], col_defs['dtype']))
+        try:
+            arrow_types = {
+                col: dtype_mapping.db_dtype_to_arrow_type(db_dtypes[col])
+                for col in df.columns[df.dtypes == 'object']}
+        except (KeyError, TypeError):
+            return None
+        if not self._sample_conforms(df, arrow_types):
+            return None
+        return col_defs
+
+    def put_col_defs(self, df, col_defs, **options):
+        """Caches the column definitions inferred for a DataFrame"""
+        self._put(fingerprint(df, 'col_defs', **options), col_defs)
+
+    def get_avro_schema(self, df):
+        """
+        Gets the Avro schema cached for a DataFrame's structure, if it is
+        present and a sample of its values conforms to it, or None if not
+        """
+        avro_schema = self._get(fingerprint(df, 'avro_schema'))
+        if avro_schema is None:
+            return None
+
+        field_types = {field['name']: field['type']
+                       for field in avro_schema.get('fields', [])}
+        try:
+            arrow_types = {
+                col: avro_type_to_arrow_type(field_types[col])
+                for col in df.columns[df.dtypes == 'object']}
+        except (KeyError, TypeError):
+            return None
+        if not self._sample_conforms(df, arrow_types):
+            return None
+        return avro_schema
+
+    def put_avro_schema(self, df, avro_schema):
+        """Caches the Avro schema inferred for a DataFrame"""
+        self._put(fingerprint(df, 'avro_schema'), avro_schema)
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            # Copied, as callers may modify what they are given, such as
+            # by adding comments to Avro schemas
+            return copy.deepcopy(self._entries[key])
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = copy.deepcopy(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _sample_conforms(self, df, arrow_types):
+        """
+        Checks that a sample of the values in each of a DataFrame's object
+        columns conforms to the Arrow type of the column's cached result
+        """
+        for col, arrow_type in arrow_types.items():
+            non_null_values = df[col][df[col].notna()]
+            if len(non_null_values) > self.sample_size:
+                non_null_values = dtype_mapping.sample_col(
+                    non_null_values, self.sample_size)
+            if not dtype_mapping.col_conforms_to_arrow_type(non_null_values,
+                                                            arrow_type):
+                return False
+        return True
+
+
+def fingerprint(df, kind, **options):
+    """
+    Generates a fingerprint of a DataFrame's structure. See notes above for
+    further details.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to fingerprint
+        kind (str): The kind of result the fingerprint is a key for
+        options: Any options that the result depends on
+    Returns:
+        str: The fingerprint
+    """
+    dtypes = []
+    value_shapes = {}
+    for col, dtype in df.dtypes.items():
+        if dtype.name == 'category':
+            dtypes.append([col, 'category', str(dtype.categories.dtype)])
+        else:
+            dtypes.append([col, str(dtype)])
+
+        if dtype == 'object':
+            non_null_values = df[col][df[col].notna()]
+            if len(non_null_values):
+                value_shapes[col] = [
+                    get_value_shape(non_null_values.iloc[i])
+                    for i in [0, len(non_null_values) // 2, -1]]
+
+    structure = {
+        'kind': kind,
+        'dtypes': dtypes,
+        'value_shapes': value_shapes,
+        'options': options
+    }
+    return hashlib.sha1(json.dumps(structure, sort_keys=True,
+                                   default=str).encode()).hexdigest()
+
+
+def get_value_shape(value):
+    """
+    Gets the shape of a value - the keys of any dicts in it, and the type
+    of every value - in a form that can be serialized
+    """
+    if isinstance(value, dict):
+        return {str(key): get_value_shape(subvalue)
+                for key, subvalue in value.items()}
+    elif isinstance(value, list):
+        return [get_value_shape(value[0])] if value else []
+    return type(value).__name__
@@ -0,0 +1,172 @@
+from honeycomb import meta
+from honeycomb.alter_table import add_partition
+from honeycomb.append_table import (
+    get_append_target, prep_df_and_filename_for_target, write_df_to_target
+)
+from honeycomb.inform import inform
+
+
+"""
+Notes on table writers
+
+Before anything is written, each call to 'append_df_to_table' checks that
+the table exists, gets its metadata and column order, and checks whether
+the partition being appended to exists - five to seven Hive queries, which
+often take longer than writing the DataFrame itself. A TableWriter makes
+these queries once, and reuses their results for every DataFrame appended
+through it.
+
+Cached metadata can become stale if the table is altered or recreated while
+the writer is in use. Preparing a DataFrame fails if its columns no longer
+match the cached ones, so when it does, the writer refreshes its metadata
+and, if the table has changed, prepares the DataFrame again. Nothing has
+been written at that point, so retrying is safe. Refreshes can also be
+performed explicitly with 'refresh'.
+
+Partitions are cached once they have been added or found, so a partition
+dropped while the writer is in use will not be recreated until the writer
+is refreshed.
+"""
+
+# The parts of a table's metadata that a change to would invalidate
+# DataFrames prepared for it
+target_drift_keys = ['bucket', 'path', 'storage_type', 'tblproperties',
+                     'bucketing', 'col_order']
+
+
+class TableWriter:
+    """
+    A handle for appending many DataFrames to an existing table, which
+    gets the table's metadata once rather than once per DataFrame. See
+    notes above for further details.
+
+    Example usage:
+        writer = hc.TableWriter('events', 'experimental')
+        for df in hourly_dfs:
+            writer.append(df, partition_values={'hour': df['hour'][0]})
+
+    Args:
+        table_name (str): The name of the table to append to
+        schema (str, optional): Name of the schema containing the table
+        sort_by (list<str>, optional):
+            Columns to sort appended data by. If not provided, the
+            columns recorded in the table's properties when it was
+            created are used, if any
+    """
+    def __init__(self, table_name, schema=None, sort_by=None):
+        self.table_name, self.schema = meta.prep_schema_and_table(
+            table_name, schema)
+        self.sort_by = sort_by
+        self.target = None
+        self._partition_paths = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Gets the table's metadata again, and forgets which partitions exist
+
+        Returns:
+            bool: Whether the table has changed since it was last refreshed
+        """
+        prev_target = self.target
+        self.target = get_append_target(self.table_name, self.schema,
+                                        self.sort_by)
+        self._partition_paths = {}
+        return prev_target is not None and not targets_match(
+            prev_target, self.target)
+
+    def append(self, df, partition_values=None, filename=None, dtypes=None,
+               timezones=None, copy_df=True, overwrite_file=False,
+               require_identical_columns=True, avro_schema=None,
+               hive_functions=None, idempotent=False):
+        """
+        Appends a DataFrame to the table. Takes the same options as
+        'append_df_to_table', besides those describing the table itself.
+
+        Args:
+            df (pd.DataFrame): The DataFrame to append
+            partition_values (dict<str:str>, optional):
+                The partition to store the DataFrame under. If it does not
+                exist, it will be created.
+            filename (str, optional):
+                Name to store the file under. Can be left blank if writing to
+                the experimental zone, in which case a name will be generated.
+            dtypes (dict<str:str>, optional): A dictionary specifying dtypes
+                for specific columns to be cast to prior to uploading.
+            timezones (dict<str, str>):
+                Dictionary from datetime columns to the timezone they
+                represent. See 'append_df_to_table' for further details.
+            copy_df (bool):
+                Whether the operations performed on df should be performed
+                on the original or a copy
+            overwrite_file (bool):
+                Whether to overwrite the file if a file with a matching name
+                to "filename" is already present in S3.
+            require_identical_columns (bool, default True):
+                Whether extra/missing columns should be allowed and handled,
+                or if they should lead to an error being raised.
+            avro_schema (dict, optional):
+                Schema to use when writing a DataFrame to an Avro file
+            hive_functions (dict<str:str> or dict<str:dict>):
+                Specifications on what hive functions to apply to which
+                columns. Only usable when working with ORC tables
+            idempotent (bool, default False):
+                Whether to name the file after a hash of the DataFrame's
+                contents, and skip it if it has already been appended.
+                See 'append_df_to_table'
+        Returns:
+            bool: Whether the DataFrame was appended
+        """
+        # The DataFrame may need to be prepared twice, so the original is
+        # left untouched unless specified otherwise
+        if copy_df:
+            df = df.copy()
+
+        prep_args = (filename, dtypes, timezones, partition_values,
+                     require_identical_columns, idempotent)
+        try:
+            prepped_df, prepped_filename = prep_df_and_filename_for_target(
+                df, self.target, *prep_args)
+        except ValueError as e:
+            if not self.refresh():
+                raise e
+            inform('Table {}.{} has changed since its metadata was cached. '
+                   'Retrying with its current metadata.'.format(
+                       self.schema, self.table_name))
+            prepped_df, prepped_filename = prep_df_and_filename_for_target(
+                df, self.target, *prep_args)
+
+        path = self.target['path']
+        if partition_values:
+            path += self._get_partition_path(partition_values)
+
+        return write_df_to_target(prepped_df, self.target, path,
+                                  prepped_filename, partition_values,
+                                  overwrite_file, avro_schema, hive_functions,
+                                  idempotent)
+
+    def _get_partition_path(self, partition_values):
+        """
+        Gets the subpath of a partition, adding the partition if it has not
+        been added or found since the writer was last refreshed
+        """
+        partition_key = tuple((key, str(value))
+                              for key, value in partition_values.items())
+        if partition_key not in self._partition_paths:
+            self._partition_paths[partition_key] = add_partition(
+                self.table_name, self.schema, partition_values)
+        return self._partition_paths[partition_key]
+
+
+def targets_match(target, other_target):
+    """
+    Checks whether two sets of a table's metadata, from 'get_append_target',
+    describe the same table
+    """
+    if any(target.get(key) != other_target.get(key)
+           for key in target_drift_keys):
+        return False
+    col_defs, other_col_defs = target['col_defs'], other_target['col_defs']
+    if col_defs is None or other_col_defs is None:
+        return col_defs is other_col_defs
+    return col_defs.equals(other_col_defs)
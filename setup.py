@@ -83,12 +83,15 @@ setup(
     packages=find_packages(),
     install_requires=[
         'pandas>=0.25.3',
+        'pyarrow>=10.0',
         'pyhive[hive, presto]>=0.6.1',
         'rivet>=1.6',
-        'pandavro>=1.6'
+        'pandavro>=1.6',
+        'fastavro>=1.0'
     ],
     extras_require={
         'bigquery':  ['google-auth>=1.22', 'pandas-gbq>=0.14'],
+        'json': ['orjson>=3.0'],
         'salesforce': ['simple-salesforce>=1.1.0']
     },
     cmdclass={
@@ -13,3 +13,23 @@ def test_add_partition_builds_path(mocker):
                                 partition_values=partition_values)
 
     assert actual_path == expected_path
+
+
+def test_add_partition_existing_partition_path(mocker):
+    """
+    Tests that the actual location of an existing partition is used,
+    rather than the path that would be built for a new partition
+    """
+    mocker.patch('honeycomb.check.partition_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_s3_location',
+                 return_value=('bucket', 'table'))
+    mocker.patch('honeycomb.meta.get_partition_s3_location',
+                 return_value=('bucket',
+                               'table/2020/01/_v20200101000000000000'))
+
+    partition_values = {'year_partition': '2020', 'month_partition': '01'}
+
+    actual_path = add_partition(table_name='table', schema='experimental',
+                                partition_values=partition_values)
+
+    assert actual_path == '2020/01/_v20200101000000000000/'
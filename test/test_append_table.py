@@ -1,8 +1,15 @@
+import re
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 
 import rivet as rv
 
-from honeycomb import append_df_to_table
+from honeycomb import append_df_to_table, append_dfs_to_table
+from honeycomb.append_table import hash_df_contents
 
 
 def test_append_df_to_table(mocker, setup_bucket_w_contents,
@@ -22,7 +29,9 @@ def test_append_df_to_table(mocker, setup_bucket_w_contents,
     mocker.patch('honeycomb.meta.get_table_metadata', return_value={
         'bucket': test_bucket,
         'path': test_schema,
-        'storage_type': storage_type
+        'storage_type': storage_type,
+        'bucketing': None,
+        'col_defs': None
     })
     append_df_to_table(test_df, 'test_table',
                        schema=test_schema, filename=appended_filename)
@@ -42,3 +51,202 @@ def test_append_df_to_table_already_exists(mocker, test_df):
 
     with pytest.raises(ValueError, match='Table .* does not exist'):
         append_df_to_table(test_df, 'test_table')
+
+
+def test_append_df_to_table_sorted(mocker, setup_bucket_w_contents,
+                                   test_schema, test_bucket, test_df):
+    """
+    Tests that appends to a table whose properties record sort columns
+    are sorted by those columns automatically
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=test_df.columns.to_list())
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': test_schema,
+        'storage_type': 'csv',
+        'tblproperties': {'honeycomb.sort_by': 'strcol'},
+        'bucketing': None,
+        'col_defs': None
+    })
+
+    append_df_to_table(test_df, 'test_table',
+                       schema=test_schema, filename='sorted.csv')
+
+    df = rv.read(test_schema + '/sorted.csv', test_bucket, header=None)
+    assert df[1].to_list() == sorted(test_df['strcol'])
+
+
+def test_append_df_to_table_narrow_types(mocker, setup_bucket_w_contents,
+                                         test_schema, test_bucket, tmp_path):
+    """
+    Tests that appends to a Parquet table with narrow column types are
+    written with the table's physical types, rather than the DataFrame's
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=['intcol', 'deccol'])
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': test_schema,
+        'storage_type': 'parquet',
+        'bucketing': None,
+        'col_defs': pd.DataFrame({'col_name': ['intcol', 'deccol'],
+                                  'dtype': ['int', 'decimal(5,1)']})
+    })
+
+    df = pd.DataFrame({'intcol': [1, 2], 'DecCol': [1.25, None]})
+    append_df_to_table(df, 'test_table', schema=test_schema,
+                       filename='narrow.parquet')
+
+    local_path = str(tmp_path / 'narrow.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, test_schema + '/narrow.parquet', local_path)
+    assert pq.read_schema(local_path).remove_metadata() == pa.schema([
+        ('intcol', pa.int32()), ('DecCol', pa.decimal128(5, 1))])
+
+
+def test_append_df_to_table_compression(mocker, setup_bucket_w_contents,
+                                        test_schema, test_bucket, test_df,
+                                        tmp_path):
+    """
+    Tests that appends to a table are compressed with the codec recorded in
+    its properties
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=test_df.columns.to_list())
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': test_schema,
+        'storage_type': 'parquet',
+        'tblproperties': {'parquet.compression': 'GZIP'},
+        'bucketing': None,
+        'col_defs': None
+    })
+
+    append_df_to_table(test_df, 'test_table', schema=test_schema,
+                       filename='compressed.parquet')
+
+    local_path = str(tmp_path / 'compressed.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, test_schema + '/compressed.parquet', local_path)
+    assert pq.ParquetFile(local_path).metadata.row_group(0).column(
+        0).compression == 'GZIP'
+
+
+def test_append_df_to_table_idempotent(mocker, setup_bucket_w_contents,
+                                       test_schema, test_bucket, test_df):
+    """
+    Tests that appending the same DataFrame twice with 'idempotent' only
+    writes it once, to a file named after its contents
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=test_df.columns.to_list())
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': test_schema,
+        'storage_type': 'csv',
+        'bucketing': None,
+        'col_defs': None
+    })
+
+    def list_appended_keys():
+        return [obj['Key'] for obj in boto3.client('s3').list_objects_v2(
+            Bucket=test_bucket, Prefix=test_schema + '/retried')['Contents']]
+
+    assert append_df_to_table(test_df, 'test_table', schema=test_schema,
+                              filename='retried.csv', idempotent=True)
+    appended_keys = list_appended_keys()
+    assert len(appended_keys) == 1
+    assert re.match(r'^{}/retried_[0-9a-f]{{16}}\.csv$'.format(test_schema),
+                    appended_keys[0])
+
+    assert not append_df_to_table(test_df.copy(), 'test_table',
+                                  schema=test_schema, filename='retried.csv',
+                                  idempotent=True)
+    assert list_appended_keys() == appended_keys
+
+    append_df_to_table(test_df.iloc[::-1], 'test_table', schema=test_schema,
+                       filename='retried.csv', idempotent=True)
+    assert len(list_appended_keys()) == 2
+
+    with pytest.raises(ValueError, match='filename must be provided'):
+        append_df_to_table(test_df, 'test_table', schema=test_schema,
+                           idempotent=True)
+
+
+def test_hash_df_contents():
+    """
+    Tests that DataFrames are hashed by their columns and values, including
+    columns of lists and dicts, regardless of their index
+    """
+    df = pd.DataFrame({'intcol': [1, 2], 'arraycol': [[1], [2, 3]],
+                       'structcol': [{'a': 1}, None]})
+    content_hash = hash_df_contents(df)
+
+    assert hash_df_contents(df.set_index(pd.Index([5, 6]))) == content_hash
+    assert hash_df_contents(df.rename(columns={'intcol': 'i'})) != (
+        content_hash)
+    assert hash_df_contents(df.assign(arraycol=[[1], [2, 4]])) != (
+        content_hash)
+
+
+def test_append_dfs_to_table(mocker, setup_bucket_w_contents,
+                             test_schema, test_bucket, test_df):
+    """
+    Tests that appending an iterable of DataFrames writes each to its own
+    file, while only retrieving the table's metadata once
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    col_order_mock = mocker.patch('honeycomb.meta.get_table_column_order',
+                                  return_value=test_df.columns.to_list())
+    metadata_mock = mocker.patch(
+        'honeycomb.meta.get_table_metadata', return_value={
+            'bucket': test_bucket,
+            'path': test_schema,
+            'storage_type': 'csv',
+            'bucketing': None,
+            'col_defs': None
+        })
+
+    chunks = (test_df.iloc[i:i + 1] for i in range(len(test_df)))
+    append_dfs_to_table(chunks, 'test_table', schema=test_schema,
+                        filename='chunk.csv', max_in_flight=2)
+
+    for i in range(len(test_df)):
+        df = rv.read('{}/chunk_{:05d}.csv'.format(test_schema, i),
+                     test_bucket, header=None)
+        assert (df.values == test_df.iloc[i:i + 1].values).all()
+    assert col_order_mock.call_count == 1
+    assert metadata_mock.call_count == 1
+
+
+def test_append_dfs_to_table_stops_on_error(mocker, setup_bucket_w_contents,
+                                            test_schema, test_bucket,
+                                            test_df):
+    """
+    Tests that an error while preparing a DataFrame is raised, and that
+    no further DataFrames are appended afterwards
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=test_df.columns.to_list())
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': test_schema,
+        'storage_type': 'csv',
+        'bucketing': None,
+        'col_defs': None
+    })
+
+    chunks = [test_df, test_df.rename(columns={'intcol': 'badcol'}), test_df]
+    with pytest.raises(ValueError):
+        append_dfs_to_table(chunks, 'test_table', schema=test_schema,
+                            filename='chunk.csv')
+
+    assert rv.exists('{}/chunk_00000.csv'.format(test_schema), test_bucket)
+    assert not rv.exists('{}/chunk_00002.csv'.format(test_schema),
+                         test_bucket)
@@ -0,0 +1,88 @@
+import boto3
+import pandas as pd
+
+import rivet as rv
+
+from honeycomb.bucketing import (assign_buckets, get_next_copy_numbers,
+                                 hash_col, write_bucketed_df)
+
+
+def test_hash_col():
+    """
+    Tests that values are hashed the same way Hive hashes them for bucketing.
+    Expected hashes are Murmur3 with Hive's seed, of each value's UTF-8
+    bytes (strings) or big-endian bytes (integers). Nulls hash to 0.
+    """
+    string_hashes = hash_col(pd.Series(['abc', '', 'hello world', None]))
+    assert string_hashes.tolist() == [3409700625, 3329588566, 705886192, 0]
+
+    int_hashes = hash_col(pd.Series([1, -1, None], dtype='Int64'))
+    assert int_hashes.tolist() == [3381304636, 4057177987, 0]
+
+    # Categorical values hash the same as the values of their categories
+    cat_hashes = hash_col(pd.Series(pd.Categorical(['hello world', None,
+                                                    'abc', 'abc'])))
+    assert cat_hashes.tolist() == [705886192, 0, 3409700625, 3409700625]
+
+
+def test_hash_col_narrow_ints():
+    """
+    Tests that integers are hashed at the width of their Hive type. Hashes
+    of 1 match the standard Murmur3 of its 1, 2, 4, and 8 big-endian bytes.
+    Those of -1 differ from it for TINYINT and SMALLINT, as Hive
+    sign-extends trailing bytes
+    """
+    col = pd.Series([1, -1, None], dtype='Int64')
+    assert hash_col(col, 'TINYINT').tolist() == [3205320099, 3258502008, 0]
+    assert hash_col(col, 'SMALLINT').tolist() == [1484957954, 3074350284, 0]
+    assert hash_col(col, 'INT').tolist() == [1321152925, 1626716813, 0]
+    assert hash_col(col, 'BIGINT').tolist() == [3381304636, 4057177987, 0]
+
+    # The width comes from the table's type, not the DataFrame's dtype
+    df = pd.DataFrame({'intcol': pd.Series([1, -1], dtype='int64')})
+    col_defs = pd.DataFrame({'col_name': ['intcol'], 'dtype': ['INT']})
+    assert assign_buckets(df, ['intcol'], 4, col_defs).tolist() == [
+        (1321152925 & 0x7fffffff) % 4, (1626716813 & 0x7fffffff) % 4]
+
+
+def test_assign_buckets():
+    """
+    Tests that the hashes of multiple bucketing columns are combined the
+    way Hive combines them
+    """
+    df = pd.DataFrame({'intcol': [1, -1], 'strcol': ['abc', 'abc']})
+
+    # (31 * 3381304636 + 3409700625) mod 2^32 = 855961941, and
+    # (31 * 4057177987 + 3409700625) mod 2^32 = 333199342
+    expected_buckets = [(855961941 & 0x7fffffff) % 4,
+                        (333199342 & 0x7fffffff) % 4]
+    assert assign_buckets(df, ['intcol', 'strcol'], 4).tolist() == (
+        expected_buckets)
+
+
+def test_write_bucketed_df(setup_bucket_wo_contents, test_bucket, test_df):
+    """
+    Tests that every bucket is written to a file on creation, and that
+    appends only write to non-empty buckets, named as copies
+    """
+    storage_settings = {'index': False, 'header': False}
+    write_bucketed_df(test_df, test_bucket, 'test_table', 'csv',
+                      storage_settings, ['intcol'], 4, sorted_by=['strcol'])
+
+    copy_nums = get_next_copy_numbers(test_bucket, 'test_table/', 4)
+    assert copy_nums == [1, 1, 1, 1]
+    write_bucketed_df(test_df.iloc[:1], test_bucket, 'test_table', 'csv',
+                      storage_settings, ['intcol'], 4, copy_nums=copy_nums)
+
+    bucket_nums = assign_buckets(test_df, ['intcol'], 4)
+    keys = [obj['Key'] for obj in boto3.client('s3').list_objects_v2(
+        Bucket=test_bucket, Prefix='test_table/')['Contents']]
+    assert sorted(keys) == sorted(
+        ['test_table/{:06d}_0.csv'.format(i) for i in range(4)] +
+        ['test_table/{:06d}_0_copy_1.csv'.format(bucket_nums[0])])
+
+    for bucket_num in set(bucket_nums):
+        df = rv.read('test_table/{:06d}_0.csv'.format(bucket_num),
+                     test_bucket, header=None)
+        assert df[0].to_list() == sorted(
+            test_df['intcol'][bucket_nums == bucket_num])
@@ -0,0 +1,166 @@
+import re
+
+import boto3
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import rivet as rv
+
+from honeycomb.compaction import bin_files, compact, merge_parquet_files
+
+
+def test_bin_files():
+    """
+    Tests that files are packed into as few bins as possible without
+    exceeding the target size, and that large files are left on their own
+    """
+    files = [{'key': 'a', 'size': 60}, {'key': 'b', 'size': 50},
+             {'key': 'c', 'size': 40}, {'key': 'd', 'size': 150},
+             {'key': 'e', 'size': 10}]
+
+    bins = bin_files(files, target_file_size=100)
+
+    assert [[file['key'] for file in file_bin] for file_bin in bins] == [
+        ['d'], ['a', 'c'], ['b', 'e']]
+
+
+def setup_small_files(test_bucket, test_df, table_path, n_files):
+    for i in range(n_files):
+        rv.write(test_df, '{}file_{}.parquet'.format(table_path, i),
+                 test_bucket, show_progressbar=False, index=False)
+
+
+def mock_table(mocker, test_bucket, table_path, tblproperties=None):
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': table_path,
+        'storage_type': 'parquet',
+        'tblproperties': tblproperties or {}
+    })
+    mocker.patch('honeycomb.meta.is_partitioned_table', return_value=False)
+    return mocker.patch('honeycomb.hive.run_lake_query')
+
+
+def test_compact(mocker, setup_bucket_wo_contents, test_bucket, test_df):
+    """
+    Tests that the small files of a table are merged into one file in a new
+    folder, that the table is pointed at the new folder, and that the
+    original files are removed
+    """
+    table_path = 'test_table/'
+    setup_small_files(test_bucket, test_df, table_path, n_files=3)
+    run_lake_query = mock_table(mocker, test_bucket, table_path)
+
+    report = compact('test_table', 'experimental')
+
+    assert report.loc[0, 'files_before'] == 3
+    assert report.loc[0, 'files_after'] == 1
+
+    remaining_files = rv.list_objects(table_path, test_bucket, recursive=True)
+    assert len(remaining_files) == 1
+    assert re.match(r'^_v\d{20}/compacted_00000\.parquet$',
+                    remaining_files[0])
+
+    set_location_query = run_lake_query.call_args[0][0]
+    new_path = table_path + remaining_files[0].split('/')[0] + '/'
+    assert set_location_query == (
+        'ALTER TABLE experimental.test_table SET LOCATION '
+        '\'s3://{}/{}\''.format(test_bucket, new_path))
+
+    df = rv.read(table_path + remaining_files[0], test_bucket)
+    expected_df = pd.concat([test_df] * 3, ignore_index=True)
+    assert df.equals(expected_df)
+
+
+def test_compact_dry_run(mocker, setup_bucket_wo_contents,
+                         test_bucket, test_df):
+    """Tests that a dry run reports expected file counts without changes"""
+    table_path = 'test_table/'
+    setup_small_files(test_bucket, test_df, table_path, n_files=3)
+    run_lake_query = mock_table(mocker, test_bucket, table_path)
+
+    report = compact('test_table', 'experimental', dry_run=True)
+
+    assert report.loc[0, 'files_before'] == 3
+    assert report.loc[0, 'files_after'] == 1
+    assert len(rv.list_objects(table_path, test_bucket)) == 3
+    run_lake_query.assert_not_called()
+
+
+def test_compact_table_codec(mocker, setup_bucket_wo_contents, tmp_path,
+                             test_bucket, test_df):
+    """
+    Tests that merged files are compressed with the codec recorded in the
+    table's properties
+    """
+    table_path = 'test_table/'
+    setup_small_files(test_bucket, test_df, table_path, n_files=3)
+    mock_table(mocker, test_bucket, table_path,
+               tblproperties={'parquet.compression': 'ZSTD'})
+
+    compact('test_table', 'experimental')
+
+    remaining_file = rv.list_objects(table_path, test_bucket,
+                                     recursive=True)[0]
+    local_path = str(tmp_path / 'compacted.parquet')
+    boto3.client('s3').download_file(test_bucket, table_path + remaining_file,
+                                     local_path)
+    metadata = pq.ParquetFile(local_path).metadata
+    assert metadata.row_group(0).column(0).compression == 'ZSTD'
+
+
+def test_merge_parquet_files_row_groups(mocker, tmp_path, test_df):
+    """
+    Tests that the batches of merged files are accumulated into row groups
+    of the configured size, rather than one row group per batch
+    """
+    mocker.patch('honeycomb.compaction.merged_row_group_rows', 4)
+    local_paths = []
+    for i in range(3):
+        local_paths.append(str(tmp_path / 'file_{}.parquet'.format(i)))
+        test_df.to_parquet(local_paths[-1], index=False)
+    merged_path = str(tmp_path / 'merged.parquet')
+
+    merge_parquet_files(local_paths, merged_path)
+
+    metadata = pq.ParquetFile(merged_path).metadata
+    assert [metadata.row_group(i).num_rows
+            for i in range(metadata.num_row_groups)] == [4, 4, 1]
+    expected_df = pd.concat([test_df] * 3, ignore_index=True)
+    assert pd.read_parquet(merged_path).equals(expected_df)
+
+
+def test_merge_parquet_files_added_columns(tmp_path, test_df):
+    """
+    Tests that files missing columns that other files contain are merged,
+    with null values for the missing columns
+    """
+    old_path = str(tmp_path / 'old.parquet')
+    test_df[['intcol', 'strcol']].to_parquet(old_path, index=False)
+    new_path = str(tmp_path / 'new.parquet')
+    test_df.to_parquet(new_path, index=False)
+    merged_path = str(tmp_path / 'merged.parquet')
+
+    merge_parquet_files([old_path, new_path], merged_path)
+
+    df = pd.read_parquet(merged_path)
+    assert df.columns.to_list() == ['intcol', 'strcol', 'floatcol']
+    assert df['floatcol'].isna().to_list() == [True] * 3 + [False] * 3
+    assert df['intcol'].to_list() == test_df['intcol'].to_list() * 2
+
+
+def test_compact_bucketed_table_fails(mocker):
+    """Tests that bucketed tables cannot be compacted"""
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': 'test_bucket',
+        'path': 'test_table/',
+        'storage_type': 'parquet',
+        'bucketing': {'bucketed_by': ['intcol'], 'num_buckets': 4,
+                      'sorted_by': None}
+    })
+
+    with pytest.raises(ValueError, match='bucketed'):
+        compact('test_table', 'experimental')
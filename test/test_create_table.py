@@ -1,8 +1,18 @@
+import json
+import re
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
 
 import rivet as rv
 
 from honeycomb.create_table.create_table_from_df import create_table_from_df
+from honeycomb.create_table.flash_update_table_from_df import (
+    flash_update_table_from_df
+)
 
 
 def test_create_table_from_df_csv(mocker, setup_bucket_wo_contents,
@@ -31,6 +41,224 @@ def test_create_table_from_df_csv(mocker, setup_bucket_wo_contents,
     assert (df.values == test_df.values).all()
 
 
+def test_create_table_from_df_csv_complex_types(mocker,
+                                                setup_bucket_wo_contents,
+                                                test_bucket):
+    """
+    Tests that tables with array and struct columns can be created as CSV,
+    with their values written using the table's collection delimiter
+    """
+    schema = 'experimental'
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {schema: test_bucket}, clear=True)
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    df = pd.DataFrame({'intcol': [1, 2],
+                       'arraycol': [['a', 'b'], []],
+                       'structcol': [{'a': 1, 'b': 'x'}, None]})
+    create_table_from_df(df, table_name='test_table', schema=schema,
+                         filename='test_file.csv')
+
+    contents = boto3.client('s3').get_object(
+        Bucket=test_bucket, Key='test_table/test_file.csv')['Body'].read()
+    assert contents == b'1,a|b,1|x\n2,,\\N\n'
+    assert 'COLLECTION ITEMS TERMINATED BY \'|\'' in (
+        run_lake_query.call_args_list[0][0][0])
+
+
+def test_create_table_from_df_sort_by(mocker, setup_bucket_wo_contents,
+                                      test_bucket, test_df):
+    """
+    Tests that a table's data is sorted when the table is created with
+    sort columns, and that the columns are recorded in its properties
+    """
+    schema = 'experimental'
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {schema: test_bucket}, clear=True)
+
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    create_table_from_df(test_df, table_name='test_table', schema=schema,
+                         filename='test_file.csv', sort_by=['strcol'])
+
+    df = rv.read('test_table/test_file.csv', test_bucket, header=None)
+    assert df[1].to_list() == sorted(test_df['strcol'])
+    assert '\'honeycomb.sort_by\'=\'strcol\'' in (
+        run_lake_query.call_args_list[0][0][0])
+
+
+def test_create_table_from_df_narrow_types(mocker, setup_bucket_wo_contents,
+                                           test_bucket, tmp_path):
+    """
+    Tests that narrow types, dates, and decimals are declared in a table's
+    DDL, and written with matching physical types
+    """
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    df = pd.DataFrame({
+        'tinycol': pd.Series([1, 2], dtype='int8'),
+        'ucol': pd.Series([1, None], dtype='UInt16'),
+        'floatcol': pd.Series([1.5, 2.5], dtype='float32'),
+        'datecol': pd.to_datetime(['2020-01-01', '2020-01-02']),
+        'deccol': [1.234, None],
+        'structcol': [{'a': 1}, {'a': 2}]
+    })
+    create_table_from_df(df, 'test_table', filename='test_file.parquet',
+                         narrow_types=True, date_cols=['datecol'],
+                         decimals={'deccol': (10, 2)})
+
+    ddl = run_lake_query.call_args_list[0][0][0]
+    for col_def in ['tinycol TINYINT', 'ucol INT', 'floatcol FLOAT',
+                    'datecol DATE', 'deccol DECIMAL(10, 2)',
+                    'structcol STRUCT <a: BIGINT>']:
+        assert col_def in ddl
+
+    local_path = str(tmp_path / 'test_file.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, 'test_table/test_file.parquet', local_path)
+    assert pq.read_schema(local_path).remove_metadata() == pa.schema([
+        ('tinycol', pa.int8()),
+        ('ucol', pa.int32()),
+        ('floatcol', pa.float32()),
+        ('datecol', pa.date32()),
+        ('deccol', pa.decimal128(10, 2)),
+        ('structcol', pa.struct([('a', pa.int64())]))
+    ])
+
+
+@pytest.mark.parametrize('narrow_types', [False, True])
+def test_create_table_from_df_categorical(mocker, setup_bucket_wo_contents,
+                                          test_bucket, tmp_path,
+                                          narrow_types):
+    """
+    Tests that categorical columns are written to Parquet as
+    dictionary-encoded columns of their categories' type
+    """
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    df = pd.DataFrame({
+        'catcol': pd.Categorical(['a', 'b', None, 'a']),
+        'intcol': pd.Series([1, 2, 3, 4], dtype='int16')
+    })
+    create_table_from_df(df, 'test_table', filename='test_file.parquet',
+                         narrow_types=narrow_types)
+
+    assert 'catcol STRING' in run_lake_query.call_args_list[0][0][0]
+    local_path = str(tmp_path / 'test_file.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, 'test_table/test_file.parquet', local_path)
+    cat_type = pq.read_schema(local_path).field('catcol').type
+    assert pa.types.is_dictionary(cat_type)
+    assert cat_type.value_type == pa.string()
+    assert pq.ParquetFile(local_path).metadata.row_group(0).column(
+        0).has_dictionary_page
+    pd.testing.assert_frame_equal(pd.read_parquet(local_path), df)
+
+
+def test_create_table_from_df_avro_schema_url(mocker,
+                                              setup_bucket_wo_contents,
+                                              test_bucket, test_df):
+    """
+    Tests that Avro schemas are uploaded and referenced by URL when requested,
+    and that tables with identical schemas share a single schema file
+    """
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    for table_name in ['test_table', 'other_table']:
+        create_table_from_df(test_df, table_name, filename='test_file.avro',
+                             avro_schema_url=True)
+
+    schema_urls = []
+    for call in run_lake_query.call_args_list:
+        ddl = call[0][0]
+        assert 'avro.schema.literal' not in ddl
+        schema_urls.append(
+            re.search(r"'avro.schema.url'='([^']+)'", ddl).group(1))
+    assert schema_urls[0] == schema_urls[1]
+
+    schema_keys = [obj['Key'] for obj in boto3.client('s3').list_objects_v2(
+        Bucket=test_bucket, Prefix='_avro_schemas/')['Contents']]
+    assert schema_urls[0] == 's3://{}/{}'.format(test_bucket, schema_keys[0])
+    assert len(schema_keys) == 1
+    avro_schema = json.loads(boto3.client('s3').get_object(
+        Bucket=test_bucket, Key=schema_keys[0])['Body'].read())
+    assert [field['name'] for field in avro_schema['fields']] == list(
+        test_df.columns)
+    pd.testing.assert_frame_equal(
+        rv.read('test_table/test_file.avro', test_bucket), test_df)
+
+
+def test_create_table_from_df_compression(mocker, setup_bucket_wo_contents,
+                                          test_bucket, test_df, tmp_path):
+    """
+    Tests that a table's files are compressed with the codec it is created
+    with, and that the codec is recorded in its properties
+    """
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    create_table_from_df(test_df, 'test_table', filename='test_file.parquet',
+                         compression='zstd')
+
+    local_path = str(tmp_path / 'test_file.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, 'test_table/test_file.parquet', local_path)
+    assert pq.ParquetFile(local_path).metadata.row_group(0).column(
+        0).compression == 'ZSTD'
+    assert '\'parquet.compression\'=\'ZSTD\'' in (
+        run_lake_query.call_args_list[0][0][0])
+
+
+def test_create_table_from_df_unsupported_compression_fails(mocker,
+                                                            test_df):
+    """
+    Tests that codecs cannot be used with storage formats that do not
+    support them
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+    mocker.patch('rivet.list_objects', return_value=[])
+    with pytest.raises(ValueError, match='not supported for csv tables'):
+        create_table_from_df(test_df, 'test_table', filename='test_file.csv',
+                             compression='zstd')
+    with pytest.raises(ValueError, match='\'lz4\' is not supported'):
+        create_table_from_df(test_df, 'test_table',
+                             filename='test_file.parquet', compression='lz4')
+
+
+def test_create_table_from_df_narrow_types_csv_fails(mocker, test_df):
+    """Tests that narrow types cannot be used with text formats"""
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+    mocker.patch('rivet.list_objects', return_value=[])
+    with pytest.raises(ValueError, match='only supported'):
+        create_table_from_df(test_df, 'test_table', filename='test_file.csv',
+                             narrow_types=True)
+
+
 def test_create_table_from_df_already_exists(mocker, test_df):
     """
     Tests that creating a table will fail if a table already exists
@@ -40,3 +268,156 @@ def test_create_table_from_df_already_exists(mocker, test_df):
 
     with pytest.raises(ValueError, match='already exists'):
         create_table_from_df(test_df, 'test_table')
+
+
+def test_create_table_from_df_ddl_failure_removes_file(
+        mocker, setup_bucket_wo_contents, test_bucket, test_df):
+    """
+    Tests that the file uploaded alongside the table's creation is deleted
+    if the table cannot be created
+    """
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    mocker.patch('honeycomb.hive.run_lake_query',
+                 side_effect=RuntimeError('metastore unavailable'))
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+
+    with pytest.raises(RuntimeError, match='metastore unavailable'):
+        create_table_from_df(test_df, 'test_table',
+                             filename='test_file.parquet')
+    assert list_keys(test_bucket, 'test_table/') == []
+
+
+def test_create_table_from_df_upload_failure_drops_table(
+        mocker, setup_bucket_wo_contents, test_bucket, test_df):
+    """
+    Tests that a table is dropped if its DataFrame cannot be uploaded
+    """
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=None)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+    mocker.patch(
+        'honeycomb.create_table.build_and_run_ddl_stmt.write_df',
+        side_effect=OSError('upload failed'))
+
+    with pytest.raises(OSError, match='upload failed'):
+        create_table_from_df(test_df, 'test_table',
+                             filename='test_file.parquet')
+    assert run_lake_query.call_args_list[-1][0][0] == (
+        'DROP TABLE IF EXISTS experimental.test_table')
+
+
+@pytest.fixture
+def mock_flash_update_target(mocker, test_bucket):
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.is_partitioned_table', return_value=False)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': 'test_table',
+        'storage_type': 'parquet',
+        'tblproperties': {'parquet.compression': 'GZIP', 'other': 'x'},
+        'bucketing': None,
+        'col_defs': pd.DataFrame({
+            'col_name': ['intcol', 'strcol', 'floatcol'],
+            'dtype': ['bigint', 'string', 'double']})
+    })
+    return mocker.patch('honeycomb.hive.run_lake_query', return_value=None)
+
+
+def list_keys(bucket, prefix):
+    return sorted(obj['Key'] for obj in boto3.client('s3').list_objects_v2(
+        Bucket=bucket, Prefix=prefix).get('Contents', []))
+
+
+def test_flash_update_table_from_df(setup_bucket_wo_contents, test_bucket,
+                                    test_df, mock_flash_update_target):
+    """
+    Tests that a multi-file table's data is replaced by writing new files to
+    a versioned folder and swapping the table's location to it, and that
+    the original files are deleted afterwards
+    """
+    for filename in ['a.parquet', 'b.parquet']:
+        rv.write(test_df, 'test_table/' + filename, test_bucket)
+
+    cleanup = flash_update_table_from_df(test_df, 'test_table',
+                                         max_rows_per_file=2)
+    cleanup.result()
+
+    keys = list_keys(test_bucket, 'test_table/')
+    assert len(keys) == 2
+    assert all(re.match(r'test_table/_v\d{20}/a_0000[01]\.parquet$', key)
+               for key in keys)
+    swap_query = mock_flash_update_target.call_args_list[-1][0][0]
+    assert swap_query.startswith('ALTER TABLE experimental.test_table SET '
+                                 'LOCATION \'s3://{}/{}'.format(
+                                     test_bucket, keys[0].rsplit('/', 1)[0]))
+    df = pd.concat([rv.read(key, test_bucket) for key in keys])
+    assert df.reset_index(drop=True).equals(test_df)
+
+
+def test_flash_update_table_from_df_new_columns(setup_bucket_wo_contents,
+                                                test_bucket, test_df,
+                                                mock_flash_update_target):
+    """
+    Tests that a table is recreated at the new folder if the DataFrame's
+    columns differ from the table's, keeping its compression
+    """
+    rv.write(test_df, 'test_table/a.parquet', test_bucket)
+
+    flash_update_table_from_df(test_df.assign(newcol=1),
+                               'test_table').result()
+
+    queries = [call[0][0] for call in
+               mock_flash_update_target.call_args_list]
+    assert queries[-2] == 'DROP TABLE IF EXISTS experimental.test_table'
+    assert re.search(r"LOCATION 's3://{}/test_table/_v\d{{20}}/'".format(
+        test_bucket), queries[-1])
+    assert "'parquet.compression'='GZIP'" in queries[-1]
+    assert "'other'" not in queries[-1]
+
+
+def test_flash_update_table_from_df_narrow_types(mocker,
+                                                 setup_bucket_wo_contents,
+                                                 test_bucket, test_df,
+                                                 mock_flash_update_target,
+                                                 tmp_path):
+    """
+    Tests that a table with narrow types is kept, rather than recreated,
+    when the DataFrame's columns can be converted to its types, and that
+    the new files are written in the table's types and column order
+    """
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': 'test_table',
+        'storage_type': 'parquet',
+        'tblproperties': {},
+        'bucketing': None,
+        'col_defs': pd.DataFrame({
+            'col_name': ['strcol', 'intcol', 'floatcol'],
+            'dtype': ['string', 'int', 'float']})
+    })
+    rv.write(test_df, 'test_table/a.parquet', test_bucket)
+
+    flash_update_table_from_df(test_df, 'test_table').result()
+
+    swap_query = mock_flash_update_target.call_args_list[-1][0][0]
+    assert swap_query.startswith('ALTER TABLE experimental.test_table SET '
+                                 'LOCATION')
+    keys = list_keys(test_bucket, 'test_table/')
+    local_path = str(tmp_path / 'a.parquet')
+    boto3.client('s3').download_file(test_bucket, keys[0], local_path)
+    assert pq.read_schema(local_path).remove_metadata() == pa.schema([
+        ('strcol', pa.string()), ('intcol', pa.int32()),
+        ('floatcol', pa.float32())])
+
+
+def test_flash_update_partitioned_table_requires_partition(
+        mocker, mock_flash_update_target, test_df):
+    """Tests that the partition to update must be provided"""
+    mocker.patch('honeycomb.meta.is_partitioned_table', return_value=True)
+    with pytest.raises(ValueError, match='partition_values'):
+        flash_update_table_from_df(test_df, 'test_table')
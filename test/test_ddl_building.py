@@ -1,11 +1,13 @@
 import pandas as pd
 
-from honeycomb.ddl_building import (add_comments_to_col_defs,
+import pytest
+
+from honeycomb.ddl_building import (build_create_table_ddl,
                                     format_col_defs,
                                     add_comments_to_avro_schema)
 
 
-def test_add_comments_to_col_defs(test_df):
+def test_format_col_defs_comments():
     """Tests that comments are added to column definitions as expected"""
     col_defs = pd.DataFrame({
         'col_name': ['objcol', 'intcol', 'floatcol',
@@ -23,19 +25,42 @@ def test_add_comments_to_col_defs(test_df):
         'timedeltacol': 'This column is type "timedelta"'
     }
 
-    expected_df = col_defs.copy()
-    expected_df['comment'] = [
-        ' COMMENT \'This column is type "object"\'',
-        ' COMMENT \'This column is type "int64"\'',
-        ' COMMENT \'This column is type "float64"\'',
-        ' COMMENT \'This column is type "bool"\'',
-        ' COMMENT \'This column is type "datetime64"\'',
-        ' COMMENT \'This column is type "timedelta"\''
-    ]
+    expected_ddl = ',\n    '.join([
+        'objcol object COMMENT \'This column is type "object"\'',
+        'intcol int64 COMMENT \'This column is type "int64"\'',
+        'floatcol float64 COMMENT \'This column is type "float64"\'',
+        'boolcol bool COMMENT \'This column is type "bool"\'',
+        'dtcol datetime64 COMMENT \'This column is type "datetime64"\'',
+        'timedeltacol timedelta COMMENT \'This column is type "timedelta"\''
+    ])
+
+    assert format_col_defs(col_defs, comments) == expected_ddl
+
+
+def test_format_col_defs_wide_nested():
+    """
+    Tests that long nested column definitions are not truncated, and that
+    columns without comments are not given one
+    """
+    struct_ddl = 'STRUCT <{}>'.format(', '.join(
+        'field_{}: DECIMAL(10, 2)'.format(i) for i in range(200)))
+    col_defs = pd.DataFrame({'col_name': ['index_col', 'struct_col'],
+                             'dtype': ['BIGINT', struct_ddl]})
+
+    column_ddl = format_col_defs(
+        col_defs, {'struct_col.field_199': 'The last field'})
+
+    assert column_ddl == (
+        'index_col BIGINT,\n    struct_col ' +
+        struct_ddl[:-1] + ' COMMENT \'The last field\'>')
 
-    col_defs_w_comments = add_comments_to_col_defs(col_defs, comments)
 
-    assert col_defs_w_comments.equals(expected_df)
+def test_format_col_defs_missing_subfield_fails():
+    col_defs = pd.DataFrame({'col_name': ['struct_col'],
+                             'dtype': ['ARRAY <STRUCT <a: STRING>>']})
+
+    with pytest.raises(ValueError, match='Sub-field b not found'):
+        format_col_defs(col_defs, {'struct_col.b': 'Not a field'})
 
 
 def test_struct_col_nested_comments():
@@ -99,7 +124,7 @@ def test_array_of_struct_col_nested_comments():
 def test_nested_array_of_struct_col_nested_comments():
     base_ddl = (
         '{}ARRAY <STRUCT <nested_1: ARRAY <STRUCT <'
-        'deeply_nested: STRING{}>>{}\', nested_2: DOUBLE{}>>{}'
+        'deeply_nested: STRING{}>>{}, nested_2: DOUBLE{}>>{}'
     )
     complex_col = 'double_array_of_struct_col'
     col_defs = pd.DataFrame({
@@ -218,3 +243,18 @@ def test_add_comments_to_avro_schema():
     assert (
         avro_schema['fields'][3]['type']['items']['fields'][0]['doc'] ==
         sub_d_comment)
+
+
+def test_build_create_table_ddl_bucketed():
+    """Tests that bucketing is declared after partitioning"""
+    col_defs = pd.DataFrame({'col_name': ['intcol', 'strcol'],
+                             'dtype': ['BIGINT', 'STRING']})
+
+    ddl = build_create_table_ddl(
+        'test_table', 'experimental', col_defs, None, None, 'parquet',
+        {'year': 'STRING'}, 'test_bucket/test_table/',
+        bucketed_by=['intcol'], num_buckets=8, sorted_by=['strcol'])
+
+    assert ("PARTITIONED BY (year STRING)\n"
+            "CLUSTERED BY (intcol) SORTED BY (strcol) INTO 8 BUCKETS\n"
+            "STORED AS PARQUET") in ddl
@@ -1,11 +1,23 @@
+from collections import OrderedDict
 import logging
 import pytest
+import warnings
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+import honeycomb as hc
 from pandas.core.dtypes.api import is_datetime64_any_dtype
 
 from honeycomb.dtype_mapping import (apply_spec_dtypes,
                                      map_pd_to_db_dtypes,
+                                     reduce_complex_type,
+                                     handle_array_col,
+                                     complex_col_to_db_dtype,
+                                     arrow_type_to_db_dtype,
+                                     db_dtype_to_arrow_type,
+                                     infer_complex_col_from_sample,
                                      convert_to_spec_timezones,
                                      make_datetimes_timezone_naive)
 
@@ -25,14 +37,14 @@ def test_map_pd_to_db_dtypes(test_df_all_types):
 def test_map_pd_to_db_dtypes_unsupported_fails():
     """
     Tests that dtype mapping fails if a dataframe contains the unsupported
-    categorical type
+    timedelta type, or the categorical type when saving as Avro
     """
     cat_df = pd.DataFrame({
         'catcol': pd.Series(pd.Categorical([1, 2, 3, 4], categories=[1, 2, 3]))
     })
 
     with pytest.raises(TypeError, match='categorical.* not supported'):
-        map_pd_to_db_dtypes(cat_df, storage_type='csv')
+        map_pd_to_db_dtypes(cat_df, storage_type='avro')
 
     td_df = pd.DataFrame({
         'timedeltacol': [pd.Timedelta('1 days'), pd.Timedelta('2 days')]
@@ -42,6 +54,17 @@ def test_map_pd_to_db_dtypes_unsupported_fails():
         map_pd_to_db_dtypes(td_df, storage_type='csv')
 
 
+def test_map_pd_to_db_dtypes_categorical():
+    """Tests that categorical columns are mapped to their categories' type"""
+    cat_df = pd.DataFrame({
+        'strcol': pd.Categorical(['a', None, 'b']),
+        'intcol': pd.Categorical([1, 2, 1]),
+        'emptycol': pd.Categorical([None, None, None])
+    })
+    assert map_pd_to_db_dtypes(cat_df, 'parquet')['dtype'].to_list() == [
+        'STRING', 'BIGINT', 'STRING']
+
+
 def test_map_pd_to_db_dtypes_pdv1_types(test_df_pdv1_types):
     expected_dtypes = pd.DataFrame({
         'col_name': ['int8col', 'int16col', 'int32col', 'int64col',
@@ -58,6 +81,213 @@ def test_avro_disallows_pdv1_types(test_df_pdv1_types):
         map_pd_to_db_dtypes(test_df_pdv1_types, storage_type='avro')
 
 
+@pytest.mark.parametrize('values,expected_type', [
+    (['a', None, np.nan, pd.NA], 'string'),
+    ([None, None], 'string'),
+    ([1, 2.5, None], 'numeric'),
+    ([True, None], 'bool'),
+    ([[1], None, []], 'list'),
+    ([{'a': 1}, OrderedDict(a=2), None], 'dict')
+])
+def test_reduce_complex_type(values, expected_type):
+    """
+    Tests that complex columns are reduced to a single type,
+    ignoring missing values
+    """
+    col = pd.Series(values, dtype=object)
+    assert reduce_complex_type(col) == expected_type
+
+
+@pytest.mark.parametrize('values', [
+    ['a', 1],
+    [1, True],
+    [[1], {'a': 1}],
+    [{'a': 1}, [1]],
+    [[1], 'a'],
+    [b'bytes']
+])
+def test_reduce_complex_type_mixed_fails(values):
+    """Tests that mixed or unsupported complex columns are rejected"""
+    col = pd.Series(values, dtype=object, name='mixedcol')
+    with pytest.raises(TypeError, match='"mixedcol" .* mixed types'):
+        reduce_complex_type(col)
+
+
+def test_handle_array_col():
+    """
+    Tests that array DDL is generated from the items of every array,
+    including nested arrays and items that are themselves complex
+    """
+    nested_col = pd.Series([[['a'], []], None, [['b', None]]])
+    assert handle_array_col(nested_col) == 'ARRAY <ARRAY <STRING>>'
+
+    bool_col = pd.Series([[True, None], []])
+    assert handle_array_col(bool_col) == 'ARRAY <BOOLEAN>'
+
+    struct_col = pd.Series([[{'a': 1}], [{'a': 2}, {'a': 3}]])
+    assert handle_array_col(struct_col) == 'ARRAY <STRUCT <a: BIGINT>>'
+
+    empty_col = pd.Series([[], None])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert handle_array_col(empty_col) == 'ARRAY <DOUBLE>'
+
+
+@pytest.fixture(params=['pandas', 'arrow'])
+def complex_type_inference(request):
+    """Runs a test with each backend for inferring complex types"""
+    hc.set_option('complex_type_inference', request.param)
+    yield request.param
+    hc.set_option('complex_type_inference', 'pandas')
+
+
+def test_complex_col_to_db_dtype(complex_type_inference):
+    """
+    Tests that both inference backends generate the same DDL for nested
+    structs, unifying fields that are missing from some values
+    """
+    struct_col = pd.Series([
+        {'a': 1.5, 'b': {'c': ['x']}},
+        None,
+        {'a': 2.5, 'b': {'c': ['y', 'z']}, 'd': True}
+    ])
+    assert complex_col_to_db_dtype(struct_col) == (
+        'STRUCT <a: DOUBLE, b: STRUCT <c: ARRAY <STRING>>, d: BOOLEAN>')
+
+
+def test_complex_col_to_db_dtype_arrow_mixed_fails():
+    """Tests that the Arrow backend rejects nested fields of mixed types"""
+    hc.set_option('complex_type_inference', 'arrow')
+    mixed_col = pd.Series([{'a': 1}, {'a': 'x'}], name='mixedcol')
+    try:
+        with pytest.raises(TypeError, match='"mixedcol" .* mixed types'):
+            complex_col_to_db_dtype(mixed_col)
+    finally:
+        hc.set_option('complex_type_inference', 'pandas')
+
+
+def test_arrow_type_to_db_dtype_map():
+    """Tests that Arrow maps are converted to Hive MAP types"""
+    assert arrow_type_to_db_dtype(pa.map_(pa.string(), pa.int32())) == (
+        'MAP <STRING, BIGINT>')
+
+
+def test_infer_complex_col_from_sample(mocker):
+    """
+    Tests that DDL is inferred from a sample when the rest of the column
+    conforms to it, and from the full column when it does not
+    """
+    full_inference = mocker.spy(hc.dtype_mapping, 'handle_struct_col')
+    struct_col = pd.Series([{'a': i, 'b': ['x']} for i in range(1000)])
+    assert infer_complex_col_from_sample(struct_col, 10) == (
+        'STRUCT <a: BIGINT, b: ARRAY <STRING>>')
+    assert len(full_inference.call_args_list[0][0][0]) == 10
+
+    # A field that only appears outside the sample
+    struct_col[500] = {'a': 500, 'b': ['x'], 'c': 1.5}
+    assert infer_complex_col_from_sample(struct_col, .01) == (
+        'STRUCT <a: BIGINT, b: ARRAY <STRING>, c: DOUBLE>')
+    assert len(full_inference.call_args_list[-1][0][0]) == 1000
+
+
+def test_infer_complex_col_from_sample_mixed_fails():
+    """Tests that mixed values outside of the sample are still rejected"""
+    struct_col = pd.Series([{'a': 1}] * 100, name='mixedcol')
+    struct_col[50] = {'a': 'x'}
+    with pytest.raises(TypeError, match='"a"'):
+        infer_complex_col_from_sample(struct_col, 10)
+
+
+@pytest.mark.parametrize('infer_sample', [0, -5, 1.5, 0., '10'])
+def test_map_pd_to_db_dtypes_invalid_sample(infer_sample):
+    """Tests that invalid sample sizes are rejected"""
+    with pytest.raises(ValueError, match='infer_sample'):
+        map_pd_to_db_dtypes(pd.DataFrame({'a': [1]}),
+                            infer_sample=infer_sample)
+
+
+def test_map_pd_to_db_dtypes_parallel(mocker, complex_type_inference):
+    """
+    Tests that complex columns inferred in separate processes are merged
+    back in their original order, using the configured inference backend
+    """
+    mocker.patch('honeycomb.dtype_mapping.parallel_inference_min_values', 1)
+    df = pd.DataFrame({
+        'intcol': [1, 2],
+        'structcol': [{'a': 1}, {'a': None}],
+        'arraycol': [['x'], []],
+        'strcol': ['a', 'b']
+    })
+
+    col_defs = map_pd_to_db_dtypes(df, max_workers=2)
+    assert col_defs['col_name'].to_list() == list(df.columns)
+    assert col_defs['dtype'].to_list() == [
+        'BIGINT',
+        'STRUCT <a: {}>'.format(
+            'BIGINT' if complex_type_inference == 'arrow' else 'DOUBLE'),
+        'ARRAY <STRING>',
+        'STRING'
+    ]
+
+
+def test_map_pd_to_db_dtypes_parallel_opt_in(mocker):
+    """
+    Tests that complex columns are only inferred in separate processes
+    once enabled with the 'inference_max_workers' option
+    """
+    mocker.patch('honeycomb.dtype_mapping.parallel_inference_min_values', 1)
+    executor = mocker.patch('honeycomb.dtype_mapping.ProcessPoolExecutor')
+    df = pd.DataFrame({'structcol': [{'a': 1}], 'arraycol': [['x']]})
+
+    map_pd_to_db_dtypes(df)
+    executor.assert_not_called()
+
+    hc.set_option('inference_max_workers', 2)
+    try:
+        map_pd_to_db_dtypes(df)
+    finally:
+        hc.set_option('inference_max_workers', 1)
+    executor.assert_called_once_with(max_workers=2)
+
+
+def test_map_pd_to_db_dtypes_dates_and_decimals():
+    """
+    Tests that only date-only datetimes can be stored as dates, and only
+    valid precisions and scales can be used for decimals
+    """
+    df = pd.DataFrame({
+        'timecol': pd.to_datetime(['2020-01-01 12:00']),
+        'deccol': [1.5]
+    })
+    with pytest.raises(ValueError, match='time component'):
+        map_pd_to_db_dtypes(df, 'parquet', date_cols=['timecol'])
+    with pytest.raises(ValueError, match='precision'):
+        map_pd_to_db_dtypes(df, 'parquet', decimals={'deccol': (2, 3)})
+    with pytest.raises(TypeError, match='"timecol" cannot be stored'):
+        map_pd_to_db_dtypes(df, 'parquet', decimals={'timecol': (10, 2)})
+
+
+@pytest.mark.parametrize('db_dtype', [
+    'STRUCT <a: DECIMAL(10, 2), b: ARRAY <STRUCT <c: TINYINT>>>',
+    'struct<a:decimal(10,2),b:array<struct<c:tinyint>>>'
+])
+def test_db_dtype_to_arrow_type(db_dtype):
+    """
+    Tests that Hive types are converted to Arrow types, whether in the form
+    honeycomb generates them or the form Hive describes them in
+    """
+    assert db_dtype_to_arrow_type(db_dtype) == pa.struct([
+        ('a', pa.decimal128(10, 2)),
+        ('b', pa.list_(pa.struct([('c', pa.int8())])))
+    ])
+
+
+def test_set_option_invalid_choice():
+    """Tests that options with fixed choices reject other values"""
+    with pytest.raises(ValueError, match='must be one of'):
+        hc.set_option('complex_type_inference', 'numpy')
+
+
 def test_apply_spec_dtypes(test_df_all_types):
     """
     Tests that applying specified dtypes behaves as expected under
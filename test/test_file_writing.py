@@ -0,0 +1,176 @@
+import json
+
+import boto3
+import fastavro
+import numpy as np
+import pandas as pd
+import pandavro as pdx
+
+from honeycomb import dtype_mapping, file_writing, lake_files
+from honeycomb.append_table import get_table_avro_schema
+
+
+def read_avro_records(path):
+    with open(path, 'rb') as f:
+        return list(fastavro.reader(f))
+
+
+def test_write_avro(tmp_path):
+    """
+    Tests that Avro files are written with the same records that pandavro
+    writes, and that missing values of any kind are written as null,
+    including those pandavro cannot write
+    """
+    df = pd.DataFrame({
+        'intcol': [1, 2, 3],
+        'strcol': ['a', None, 'c'],
+        'dtcol': pd.to_datetime(['2021-01-01', '2021-01-02',
+                                 '2021-01-03 12:00']),
+        'tzcol': pd.to_datetime(['2021-01-01', '2021-01-02',
+                                 '2021-01-03']).tz_localize('US/Central'),
+        'structcol': [{'a': 1, 'b': ['x']}, None, {'a': 2, 'b': []}]
+    })
+    avro_schema = pdx.schema_infer(df)
+    pandavro_path = str(tmp_path / 'pandavro.avro')
+    pdx.to_avro(pandavro_path, df, schema=avro_schema)
+    honeycomb_path = str(tmp_path / 'honeycomb.avro')
+    file_writing.write_avro(df, honeycomb_path, avro_schema, codec='deflate')
+
+    assert (read_avro_records(honeycomb_path) ==
+            read_avro_records(pandavro_path))
+
+    null_df = pd.DataFrame({'floatcol': [1.5, np.nan],
+                            'nullable_intcol': pd.array([1, None]),
+                            'dtcol': pd.to_datetime(['1970-01-01', None])})
+    file_writing.write_avro(null_df, honeycomb_path)
+    records = read_avro_records(honeycomb_path)
+    assert records[1] == {'floatcol': None, 'nullable_intcol': None,
+                          'dtcol': None}
+    assert records[0]['dtcol'].timestamp() == 0
+
+
+def test_write_avro_parallel(mocker, tmp_path):
+    """
+    Tests that blocks encoded in separate processes are combined into a
+    single file with every record in order
+    """
+    mocker.patch.object(file_writing, 'parallel_avro_min_rows', 1)
+    df = pd.DataFrame({'intcol': range(1000),
+                       'arraycol': [[i] for i in range(1000)]})
+    local_path = str(tmp_path / 'test.avro')
+    file_writing.write_avro(df, local_path, codec='deflate', max_workers=2)
+
+    assert read_avro_records(local_path) == df.to_dict('records')
+
+
+def test_infer_avro_schema_from_sample():
+    """
+    Tests that Avro schemas are inferred from a sample of rows, and inferred
+    from every row if any value does not conform to the sampled schema
+    """
+    df = pd.DataFrame({'intcol': range(1000),
+                       'structcol': [{'a': 1}] * 1000})
+    sample_size = 10
+    unsampled_row = next(i for i in range(1000) if i not in set(
+        dtype_mapping.sample_col(df, sample_size).index))
+
+    def structcol_fields(avro_schema):
+        struct_type = avro_schema['fields'][1]['type'][1]
+        return [field['name'] for field in struct_type['fields']]
+
+    assert structcol_fields(file_writing.infer_avro_schema(
+        df, sample_size)) == ['a']
+
+    df.at[unsampled_row, 'structcol'] = {'a': 1, 'b': 'x'}
+    assert structcol_fields(file_writing.infer_avro_schema(
+        df, sample_size)) == ['a', 'b']
+
+
+def test_get_table_avro_schema():
+    """
+    Tests that appends to Avro tables use the schema stored in the table's
+    properties, unless it does not match the DataFrame being appended
+    """
+    table_schema = {'type': 'record', 'name': 'Root', 'fields': [
+        {'name': 'intcol', 'type': ['null', 'long'],
+         'doc': "The table's integer column"}]}
+    target = {'tblproperties': {
+        'avro.schema.literal': json.dumps(table_schema).replace(
+            "'", "\\\\'")}}
+
+    assert get_table_avro_schema(
+        target, pd.DataFrame({'intcol': [1]})) == table_schema
+    assert get_table_avro_schema(
+        target, pd.DataFrame({'othercol': [1]}))['fields'][0]['name'] == (
+            'othercol')
+
+
+def test_gen_csv_chunks():
+    """
+    Tests that CSV files are written as Hive reads them, with the items of
+    arrays and the fields of structs separated by the delimiter for their
+    level of nesting, and nulls within them written as '\\N'
+    """
+    df = pd.DataFrame({
+        'intcol': [1, None],
+        'strcol': ['a', None],
+        'arraycol': [[1, None], None],
+        'structcol': [{'a': 'x', 'b': ['y', 'z']}, {'a': None, 'b': []}],
+        'dtcol': pd.to_datetime(['2021-01-01 01:02:03.5', None])
+    })
+    schema = dtype_mapping.map_db_to_arrow_schema(df, pd.DataFrame({
+        'col_name': df.columns,
+        'dtype': ['DOUBLE', 'STRING', 'ARRAY <BIGINT>',
+                  'STRUCT <b: ARRAY <STRING>, a: STRING>', 'TIMESTAMP']}))
+
+    assert b''.join(file_writing.gen_csv_chunks(df, header=True)) == (
+        b'intcol,strcol,arraycol,structcol,dtcol\n'
+        b'1,a,1|\\N,x|y\x03z,2021-01-01 01:02:03.500000000\n'
+        b',,\\N,\\N|,\n')
+    # Struct fields are written in the order the table declares them in
+    assert b''.join(file_writing.gen_csv_chunks(df, schema=schema)).split(
+        b',')[3] == b'y\x03z|x'
+
+
+def test_gen_json_chunks(mocker):
+    """
+    Tests that JSON files are written with one object per line, with the
+    same values whether or not orjson is installed
+    """
+    df = pd.DataFrame({
+        'intcol': [1, 2],
+        'floatcol': [1.5, np.nan],
+        'structcol': [{'a': [1, 2]}, None],
+        'dtcol': pd.to_datetime(['2021-01-01 01:02:03', None])
+    })
+    expected_records = [
+        {'intcol': 1, 'floatcol': 1.5, 'structcol': {'a': [1, 2]},
+         'dtcol': '2021-01-01 01:02:03.000000'},
+        {'intcol': 2, 'floatcol': None, 'structcol': None, 'dtcol': None}
+    ]
+
+    def read_json_records(contents):
+        return [json.loads(line) for line in contents.splitlines()]
+
+    assert read_json_records(b''.join(
+        file_writing.gen_json_chunks(df))) == expected_records
+    mocker.patch.object(file_writing, 'orjson', None)
+    assert read_json_records(b''.join(
+        file_writing.gen_json_chunks(df))) == expected_records
+
+
+def test_upload_chunks(mocker, setup_bucket_wo_contents, test_bucket):
+    """
+    Tests that chunks are uploaded as one object, in a multipart upload once
+    they exceed the size of a single part
+    """
+    mocker.patch.object(lake_files, 'upload_part_size', 5 * 1024 ** 2)
+    s3 = boto3.client('s3')
+    chunks = [bytes([i]) * 1024 ** 2 for i in range(6)]
+    lake_files.upload_chunks(iter(chunks), test_bucket, 'multipart')
+    lake_files.upload_chunks(iter(chunks[:1]), test_bucket, 'single')
+
+    assert s3.get_object(Bucket=test_bucket, Key='multipart')[
+        'Body'].read() == b''.join(chunks)
+    assert s3.get_object(Bucket=test_bucket, Key='single')[
+        'Body'].read() == chunks[0]
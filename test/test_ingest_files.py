@@ -0,0 +1,132 @@
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import rivet as rv
+
+from honeycomb.dtype_mapping import map_arrow_to_db_dtypes
+from honeycomb.ingest_files import ingest_files
+
+
+@pytest.fixture
+def setup_ingest(mocker, setup_bucket_wo_contents, test_bucket):
+    """Mocks table creation in the experimental zone"""
+    mocker.patch.dict(
+        'honeycomb.create_table.common.schema_to_zone_bucket_map',
+        {'experimental': test_bucket}, clear=True)
+    mocker.patch('honeycomb.check.table_existence', return_value=False)
+    return mocker.patch('honeycomb.hive.run_lake_query', return_value=False)
+
+
+def test_ingest_files_csv_and_parquet(setup_ingest, tmp_path,
+                                      test_bucket, test_df):
+    """
+    Tests that CSV and Parquet files, local and in S3, are ingested into a
+    new Parquet table, with the table's DDL derived from the first file
+    """
+    csv_path = str(tmp_path / 'first.csv')
+    test_df.to_csv(csv_path, index=False)
+    parquet_path = str(tmp_path / 'second.parquet')
+    # Different column order, and narrower types than the CSV is read as
+    test_df[['strcol', 'floatcol', 'intcol']].astype(
+        {'intcol': 'int32', 'floatcol': 'float32'}).to_parquet(parquet_path)
+    boto3.client('s3').upload_file(parquet_path, test_bucket,
+                                   'source/second.parquet')
+
+    ingest_files([csv_path, 's3://{}/source/second.parquet'.format(
+        test_bucket)], 'test_table', filename='ingested.parquet',
+        target_file_size=1)
+
+    ddl = setup_ingest.call_args_list[0][0][0]
+    assert 'intcol BIGINT' in ddl
+    assert 'strcol STRING' in ddl
+    assert 'floatcol DOUBLE' in ddl
+    assert 'STORED AS PARQUET' in ddl
+
+    for i in range(2):
+        df = rv.read('test_table/ingested_{:05d}.parquet'.format(i),
+                     test_bucket)
+        pd.testing.assert_frame_equal(df, test_df)
+
+
+def test_ingest_files_mismatched_columns(setup_ingest, tmp_path, test_df):
+    """Tests that files with differing columns cannot be ingested together"""
+    first_path = str(tmp_path / 'first.csv')
+    test_df.to_csv(first_path, index=False)
+    second_path = str(tmp_path / 'second.csv')
+    test_df.rename(columns={'intcol': 'badcol'}).to_csv(second_path,
+                                                        index=False)
+
+    with pytest.raises(ValueError, match='same columns'):
+        ingest_files([first_path, second_path], 'test_table')
+
+
+def test_ingest_files_bucketed_table_fails(mocker, setup_ingest, tmp_path,
+                                           test_bucket, test_df):
+    """Tests that files cannot be ingested into bucketed tables"""
+    csv_path = str(tmp_path / 'first.csv')
+    test_df.to_csv(csv_path, index=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': 'test_table/',
+        'storage_type': 'parquet',
+        'bucketing': {'bucketed_by': ['intcol'], 'num_buckets': 4,
+                      'sorted_by': None}
+    })
+
+    with pytest.raises(ValueError, match='bucketed'):
+        ingest_files(csv_path, 'test_table', filename='ingested.parquet')
+    assert not rv.list_objects('test_table/', test_bucket)
+
+
+def test_ingest_files_table_codec(mocker, setup_ingest, tmp_path,
+                                  test_bucket, test_df):
+    """
+    Tests that files ingested into an existing table are compressed with
+    the codec recorded in the table's properties
+    """
+    csv_path = str(tmp_path / 'first.csv')
+    test_df.to_csv(csv_path, index=False)
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': 'test_table/',
+        'storage_type': 'parquet',
+        'tblproperties': {'parquet.compression': 'ZSTD'}
+    })
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=pd.DataFrame({
+                     'col_name': ['intcol', 'strcol', 'floatcol'],
+                     'dtype': ['bigint', 'string', 'double']}))
+
+    ingest_files(csv_path, 'test_table', filename='ingested.parquet')
+
+    local_path = str(tmp_path / 'ingested.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, 'test_table/ingested_00000.parquet', local_path)
+    metadata = pq.ParquetFile(local_path).metadata
+    assert metadata.row_group(0).column(0).compression == 'ZSTD'
+
+
+def test_map_arrow_to_db_dtypes():
+    """Tests that Arrow types, including nested types, map to Hive DDL"""
+    arrow_schema = pa.schema([
+        ('intcol', pa.int32()),
+        ('nullcol', pa.null()),
+        ('timecol', pa.timestamp('us', tz='UTC')),
+        ('arraycol', pa.list_(pa.string())),
+        ('structcol', pa.struct([('a', pa.float32()),
+                                 ('b', pa.list_(pa.bool_()))]))
+    ])
+    col_defs = map_arrow_to_db_dtypes(arrow_schema)
+
+    assert col_defs['dtype'].to_list() == [
+        'BIGINT',
+        'STRING',
+        'TIMESTAMP',
+        'ARRAY <STRING>',
+        'STRUCT <a: DOUBLE, b: ARRAY <BOOLEAN>>'
+    ]
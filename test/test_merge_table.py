@@ -0,0 +1,131 @@
+import io
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from honeycomb import merge_df_into_table
+
+
+def put_parquet_file(df, bucket, key):
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    boto3.client('s3').put_object(Bucket=bucket, Key=key,
+                                  Body=buffer.getvalue())
+
+
+def read_parquet_files(bucket, path):
+    s3 = boto3.client('s3')
+    keys = sorted(obj['Key'] for obj in s3.list_objects_v2(
+        Bucket=bucket, Prefix=path).get('Contents', []))
+    return {key[len(path):]: pq.read_table(io.BytesIO(s3.get_object(
+        Bucket=bucket, Key=key)['Body'].read())).to_pandas()
+        for key in keys}
+
+
+@pytest.fixture
+def mock_merge_target(mocker, test_bucket):
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=['id', 'val'])
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': 'test_table/',
+        'storage_type': 'parquet',
+        'bucketing': None,
+        'col_defs': None
+    })
+    return mocker.patch('honeycomb.hive.run_lake_query', return_value=None)
+
+
+def test_merge_df_into_table(mocker, setup_bucket_wo_contents, test_bucket,
+                             mock_merge_target):
+    """
+    Tests that only the files containing rows with merged keys are
+    rewritten, and that the table is swapped to the merged files
+    """
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=None)
+    put_parquet_file(pd.DataFrame({'id': [1, 2], 'val': ['a', 'b']}),
+                     test_bucket, 'test_table/first.parquet')
+    put_parquet_file(pd.DataFrame({'id': [3, 4], 'val': ['c', 'd']}),
+                     test_bucket, 'test_table/second.parquet')
+
+    df = pd.DataFrame({'ID': [2, 5], 'val': ['B', 'E']})
+    report = merge_df_into_table(df, 'test_table', key_cols=['id'],
+                                 filename='merged.parquet')
+
+    new_path = report['location'][0][len('s3://{}/'.format(test_bucket)):]
+    assert new_path.startswith('test_table/_v')
+    files = read_parquet_files(test_bucket, 'test_table/')
+    assert sorted(files) == [
+        new_path[len('test_table/'):] + filename
+        for filename in ['first.parquet', 'merged.parquet',
+                         'second.parquet']]
+    assert files[new_path[len('test_table/'):] + 'first.parquet'][
+        'val'].to_list() == ['a']
+    assert report[['files_rewritten', 'rows_replaced',
+                   'rows_written']].values.tolist() == [[1, 1, 2]]
+    assert 'SET LOCATION \'s3://{}/{}\''.format(test_bucket, new_path) in (
+        mock_merge_target.call_args_list[-1][0][0])
+
+
+def test_merge_df_into_partitioned_table(mocker, setup_bucket_wo_contents,
+                                         test_bucket, mock_merge_target):
+    """
+    Tests that only the partitions touched by the DataFrame are merged into,
+    and that partitions that do not exist yet are appended to
+    """
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=['year'])
+    mocker.patch('honeycomb.meta.get_partitions',
+                 return_value=[{'year': '2020'}, {'year': '2021'}])
+    mocker.patch('honeycomb.meta.get_partition_s3_location',
+                 return_value=(test_bucket, 'test_table/2020/'))
+    add_partition = mocker.patch('honeycomb.merge_table.add_partition',
+                                 return_value='2022/')
+    put_parquet_file(pd.DataFrame({'id': [1, 2], 'val': ['a', 'b']}),
+                     test_bucket, 'test_table/2020/first.parquet')
+
+    df = pd.DataFrame({'id': [1, 1], 'val': ['A', 'C'],
+                       'year': [2020, 2022]})
+    report = merge_df_into_table(df, 'test_table', key_cols=['id'],
+                                 filename='merged.parquet')
+
+    assert report[['files_rewritten', 'rows_replaced',
+                   'rows_written']].values.tolist() == [[1, 1, 1], [0, 0, 1]]
+    add_partition.assert_called_once_with('test_table', 'experimental',
+                                          {'year': '2022'})
+    assert read_parquet_files(test_bucket, 'test_table/2022/')[
+        'merged.parquet'].to_dict('list') == {'id': [1], 'val': ['C']}
+    merged_2020 = pd.concat(read_parquet_files(
+        test_bucket, 'test_table/2020/').values()).sort_values('id')
+    assert merged_2020.to_dict('list') == {'id': [1, 2], 'val': ['A', 'b']}
+
+
+def test_merge_df_into_table_duplicate_keys_fails(mocker, mock_merge_target):
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=None)
+    df = pd.DataFrame({'id': [1, 1], 'val': ['a', 'b']})
+    with pytest.raises(ValueError, match='duplicate keys'):
+        merge_df_into_table(df, 'test_table', key_cols=['id'],
+                            filename='merged.parquet')
+
+
+def test_merge_df_into_table_null_partition_values_fails(mocker,
+                                                         mock_merge_target):
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=['dt'])
+    df = pd.DataFrame({'id': [1, 2], 'val': ['a', 'b'],
+                       'dt': ['2021-01-01', None]})
+    with pytest.raises(ValueError, match='cannot contain null'):
+        merge_df_into_table(df, 'test_table', key_cols=['id'],
+                            filename='merged.parquet')
+
+
+def test_merge_df_into_curated_table_fails(monkeypatch, mock_merge_target):
+    """Tests that curated tables cannot be merged into outside production"""
+    monkeypatch.delenv('HC_PROD_ENV', raising=False)
+    df = pd.DataFrame({'id': [1], 'val': ['a']})
+    with pytest.raises(ValueError, match='curated'):
+        merge_df_into_table(df, 'test_table', key_cols=['id'],
+                            schema='curated', filename='merged.parquet')
+    mock_merge_target.assert_not_called()
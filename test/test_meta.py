@@ -0,0 +1,84 @@
+import pandas as pd
+
+from honeycomb import meta
+
+
+def test_get_table_metadata(mocker):
+    """
+    Tests that a table's location, storage type, and properties are all
+    parsed from a single SHOW CREATE TABLE query, including property
+    values that span multiple lines
+    """
+    create_stmt = pd.DataFrame({'createtab_stmt': [
+        'CREATE EXTERNAL TABLE `experimental.test_table`(',
+        "  `deccol` decimal(10,2) COMMENT 'a comment, with a comma',",
+        '  `intcol` bigint)',
+        'ROW FORMAT SERDE',
+        "  'org.apache.hadoop.hive.serde2.avro.AvroSerDe'",
+        'STORED AS INPUTFORMAT',
+        "  'org.apache.hadoop.hive.ql.io.avro.AvroContainerInputFormat'",
+        'OUTPUTFORMAT',
+        "  'org.apache.hadoop.hive.ql.io.avro.AvroContainerOutputFormat'",
+        'LOCATION',
+        "  's3://test_bucket/test_table'",
+        'TBLPROPERTIES (',
+        "  'avro.schema.literal'='{",
+        '    \"type\": \"record\"',
+        "}',",
+        "  'honeycomb.sort_by'='intcol,strcol',",
+        "  'transient_lastDdlTime'='1600000000')"
+    ]})
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query',
+                                  return_value=create_stmt)
+
+    table_metadata = meta.get_table_metadata('test_table', 'experimental')
+
+    assert run_lake_query.call_count == 1
+    assert table_metadata['bucket'] == 'test_bucket'
+    assert table_metadata['path'] == 'test_table'
+    assert table_metadata['storage_type'] == 'avro'
+    assert table_metadata['tblproperties'] == {
+        'avro.schema.literal': '{\n    "type": "record"\n}',
+        'honeycomb.sort_by': 'intcol,strcol',
+        'transient_lastDdlTime': '1600000000'
+    }
+    assert meta.get_sort_by(table_metadata['tblproperties']) == [
+        'intcol', 'strcol']
+    assert table_metadata['col_defs'].values.tolist() == [
+        ['deccol', 'decimal(10,2)'], ['intcol', 'bigint']]
+
+
+def test_sort_df():
+    """
+    Tests that DataFrames are sorted by columns regardless of case,
+    and given a fresh index
+    """
+    df = pd.DataFrame({'A': [2, 1, 2], 'b': ['z', 'y', 'x']},
+                      index=[5, 5, 7])
+
+    sorted_df = meta.sort_df(df, ['a', 'B'])
+
+    assert sorted_df['b'].to_list() == ['y', 'x', 'z']
+    assert sorted_df.index.to_list() == [0, 1, 2]
+
+
+def test_parse_bucketing():
+    """Tests that bucketing is parsed from a CREATE TABLE statement"""
+    create_stmt = pd.DataFrame({'createtab_stmt': [
+        'CREATE EXTERNAL TABLE `experimental.test_table`(',
+        '  `intcol` bigint,',
+        '  `strcol` string)',
+        'CLUSTERED BY ( ',
+        '  intcol) ',
+        'SORTED BY ( ',
+        '  strcol ASC) ',
+        'INTO 8 BUCKETS',
+        'ROW FORMAT SERDE'
+    ]})
+
+    assert meta.parse_bucketing(create_stmt) == {
+        'bucketed_by': ['intcol'],
+        'num_buckets': 8,
+        'sorted_by': ['strcol']
+    }
+    assert meta.parse_bucketing(create_stmt.iloc[:3]) is None
@@ -1,4 +1,15 @@
+import re
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import rivet as rv
+
 from honeycomb.orc import (
+    OrcBatchWriter, insert_into_orc_table,
     insert_hive_fns_into_col_names, change_col_dtype_to_hive_fn_output)
 
 
@@ -56,3 +67,224 @@ def test_change_col_dtype_to_hive_fn_output(test_df):
     assert col_defs.loc[intcol_ind, 'dtype'] == 'BINARY'
     assert col_defs.loc[strcol_ind, 'dtype'] == 'object'
     assert col_defs.loc[floatcol_ind, 'dtype'] == 'STRING'
+
+
+def test_insert_into_orc_table_dynamic_partitions(mocker):
+    """
+    Tests that partition keys without values are inserted into dynamically,
+    with the partition columns selected last and the required Hive settings
+    provided
+    """
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=['intcol', 'strcol'])
+    mocker.patch('honeycomb.meta.get_partition_cols',
+                 return_value=['year', 'month'])
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query')
+
+    insert_into_orc_table('orc_table', 'experimental',
+                          'source_table', 'landing',
+                          partition_values={'month': None, 'year': ''})
+
+    insert_command = run_lake_query.call_args[0][0]
+    assert 'PARTITION (year, month)' in insert_command
+    select_list = insert_command.split('SELECT')[1].split('FROM')[0]
+    assert [col.strip() for col in select_list.split(',')] == [
+        'intcol', 'strcol', 'year', 'month']
+    assert run_lake_query.call_args[1]['configuration'] == {
+        'hive.exec.dynamic.partition': 'true',
+        'hive.exec.dynamic.partition.mode': 'nonstrict',
+        'hive.exec.max.dynamic.partitions': '10000',
+        'hive.exec.max.dynamic.partitions.pernode': '10000'
+    }
+
+
+def test_insert_into_orc_table_mixed_partitions(mocker):
+    """
+    Tests that static partition keys can precede dynamic ones, and that
+    every partition key must be provided in a valid order
+    """
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=['intcol', 'strcol'])
+    mocker.patch('honeycomb.meta.get_partition_cols',
+                 return_value=['year', 'month'])
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query')
+
+    insert_into_orc_table('orc_table', 'experimental',
+                          'source_table', 'landing',
+                          partition_values={'month': '', 'year': '2021'})
+    insert_command = run_lake_query.call_args[0][0]
+    assert 'PARTITION (year="2021", month)' in insert_command
+    select_list = insert_command.split('SELECT')[1].split('FROM')[0]
+    assert [col.strip() for col in select_list.split(',')] == [
+        'intcol', 'strcol', 'month']
+
+    with pytest.raises(ValueError, match='cannot follow'):
+        insert_into_orc_table('orc_table', 'experimental',
+                              'source_table', 'landing',
+                              partition_values={'year': '', 'month': '01'})
+    with pytest.raises(ValueError, match='exactly the partition columns'):
+        insert_into_orc_table('orc_table', 'experimental',
+                              'source_table', 'landing',
+                              partition_values={'year': ''})
+
+
+def test_insert_into_orc_table_sort_by(mocker):
+    """Tests that data inserted into an ORC table can be sorted by Hive"""
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 return_value=['intcol', 'date'])
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query')
+
+    insert_into_orc_table('orc_table', 'experimental',
+                          'source_table', 'landing',
+                          allow_hive_reserved_words=True,
+                          sort_by=['date', 'intcol'])
+
+    insert_command = run_lake_query.call_args[0][0]
+    assert insert_command.endswith('source_table\nSORT BY `date`, intcol')
+
+
+def test_orc_batch_writer(mocker, setup_bucket_wo_contents,
+                          test_bucket, test_df):
+    """
+    Tests that DataFrames added to an OrcBatchWriter are staged under a
+    single temporary table and converted with one dynamic-partition INSERT
+    """
+    table_path = 'orc_table/'
+    col_defs = pd.DataFrame({'col_name': test_df.columns,
+                             'dtype': ['BIGINT', 'STRING', 'DOUBLE']})
+
+    def get_table_column_order(table_name, schema, include_dtypes=False):
+        if include_dtypes:
+            return col_defs.copy()
+        return col_defs['col_name'].to_list()
+
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.check.partition_existence', return_value=False)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': table_path,
+        'storage_type': 'orc'
+    })
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 side_effect=get_table_column_order)
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=['year'])
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query')
+    nuke_table = mocker.patch('honeycomb.orc.__nuke_table')
+
+    with OrcBatchWriter('orc_table', 'experimental') as writer:
+        writer.add(test_df, partition_values={'year': '2020'})
+        writer.add(test_df, partition_values={'year': '2021'})
+        writer.add(test_df, partition_values={'year': '2021'})
+
+    assert re.match(r'^orc_table_temp_orc_batch_[0-9a-f]{32}$',
+                    writer.temp_table_name)
+    assert writer.temp_path == writer.temp_table_name + '/'
+    staged_files = rv.list_objects(writer.temp_path, test_bucket,
+                                   recursive=True)
+    assert staged_files == ['2020/00000.parquet',
+                            '2021/00001.parquet',
+                            '2021/00002.parquet']
+
+    insert_commands = [call[0][0] for call in run_lake_query.call_args_list
+                       if call[0][0].startswith('INSERT')]
+    assert len(insert_commands) == 1
+    assert 'PARTITION (year)' in insert_commands[0]
+    nuke_table.assert_called_once_with(writer.temp_table_name, 'landing')
+
+
+def test_orc_batch_writer_narrow_types(mocker, setup_bucket_wo_contents,
+                                       test_bucket, test_df, tmp_path):
+    """
+    Tests that DataFrames are staged in the physical types of an ORC table
+    with narrow column types
+    """
+    col_defs = pd.DataFrame({'col_name': test_df.columns,
+                             'dtype': ['int', 'string', 'float']})
+
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': test_bucket,
+        'path': 'orc_table/',
+        'storage_type': 'orc'
+    })
+    mocker.patch('honeycomb.meta.get_table_column_order',
+                 side_effect=lambda table_name, schema, include_dtypes=False: (
+                     col_defs.copy() if include_dtypes
+                     else col_defs['col_name'].to_list()))
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=None)
+    mocker.patch('honeycomb.hive.run_lake_query')
+    mocker.patch('honeycomb.orc.__nuke_table')
+
+    with OrcBatchWriter('orc_table', 'experimental') as writer:
+        writer.add(test_df)
+
+    local_path = str(tmp_path / 'staged.parquet')
+    boto3.client('s3').download_file(
+        test_bucket, writer.temp_path + '00000.parquet', local_path)
+    arrow_schema = pq.read_schema(local_path)
+    assert arrow_schema.field('intcol').type == pa.int32()
+    assert arrow_schema.field('floatcol').type == pa.float32()
+
+
+def test_orc_batch_writer_no_insert_on_error(mocker, test_df):
+    """
+    Tests that nothing is inserted if an exception is raised within
+    the context of an OrcBatchWriter, and that the staging table is
+    still removed
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': 'test_bucket',
+        'path': 'orc_table/',
+        'storage_type': 'orc'
+    })
+    mocker.patch('honeycomb.meta.get_table_column_order')
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=None)
+    mocker.patch('honeycomb.orc.build_and_run_ddl_stmt')
+    insert = mocker.patch('honeycomb.orc.insert_into_orc_table')
+    nuke_table = mocker.patch('honeycomb.orc.__nuke_table')
+
+    with pytest.raises(KeyError):
+        with OrcBatchWriter('orc_table', 'experimental'):
+            raise KeyError('Failure while staging')
+
+    insert.assert_not_called()
+    nuke_table.assert_called_once()
+
+
+def test_orc_batch_writer_unique_staging_tables():
+    """Tests that writers appending to the same table stage separately"""
+    writers = [OrcBatchWriter('orc_table', 'experimental') for _ in range(2)]
+    assert writers[0].temp_table_name != writers[1].temp_table_name
+
+
+def test_orc_batch_writer_cleans_up_failed_enter(mocker, test_df):
+    """
+    Tests that the staging table is dropped if creating it fails, as
+    '__exit__' is not called when '__enter__' raises
+    """
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata', return_value={
+        'bucket': 'test_bucket',
+        'path': 'orc_table/',
+        'storage_type': 'orc'
+    })
+    mocker.patch('honeycomb.meta.get_table_column_order')
+    mocker.patch('honeycomb.meta.get_partition_cols', return_value=None)
+    mocker.patch('honeycomb.orc.build_and_run_ddl_stmt',
+                 side_effect=RuntimeError('Hive connection lost'))
+    run_lake_query = mocker.patch('honeycomb.hive.run_lake_query')
+    delete = mocker.patch('rivet.delete')
+
+    writer = OrcBatchWriter('orc_table', 'experimental')
+    with pytest.raises(RuntimeError, match='connection lost'):
+        with writer:
+            pass
+
+    run_lake_query.assert_called_once_with(
+        'DROP TABLE IF EXISTS landing.{}'.format(writer.temp_table_name),
+        engine='hive')
+    delete.assert_called_once_with(writer.temp_path, 'test_bucket',
+                                   recursive=True)
+    with pytest.raises(ValueError, match='context manager'):
+        writer.add(test_df)
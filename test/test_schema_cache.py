@@ -0,0 +1,76 @@
+import pandas as pd
+
+from honeycomb import dtype_mapping, SchemaCache
+from honeycomb.create_table.common import prep_df_and_col_defs
+from honeycomb.file_writing import infer_avro_schema
+
+
+def get_col_defs(df, schema_cache):
+    return prep_df_and_col_defs(df, None, None, 'experimental', 'parquet',
+                                schema_cache=schema_cache)[1]
+
+
+def test_schema_cache(mocker):
+    """
+    Tests that column definitions are only inferred once for DataFrames of
+    the same structure, and inferred again when a sample of a DataFrame's
+    values does not conform to them
+    """
+    map_pd_to_db_dtypes = mocker.spy(dtype_mapping, 'map_pd_to_db_dtypes')
+    schema_cache = SchemaCache()
+
+    df = pd.DataFrame({'intcol': [1, 2],
+                       'structcol': [{'a': 1, 'b': ['x']}, None]})
+    first_col_defs = get_col_defs(df, schema_cache)
+    inference_calls = map_pd_to_db_dtypes.call_count
+    second_col_defs = get_col_defs(df.iloc[::-1], schema_cache)
+
+    assert map_pd_to_db_dtypes.call_count == inference_calls
+    pd.testing.assert_frame_equal(first_col_defs, second_col_defs)
+
+    # The fingerprinted first, middle, and last values are unchanged, but
+    # another value has a field not in the cached DDL
+    structs = [{'a': 1, 'b': ['x']}] * 5
+    structs[1] = {'a': 1, 'b': ['x'], 'c': 1.5}
+    df = pd.DataFrame({'intcol': range(5), 'structcol': structs})
+    third_col_defs = get_col_defs(df, schema_cache)
+
+    assert map_pd_to_db_dtypes.call_count > inference_calls
+    assert third_col_defs['dtype'].to_list() == [
+        'BIGINT', 'STRUCT <a: BIGINT, b: ARRAY <STRING>, c: DOUBLE>']
+
+
+def test_schema_cache_max_size():
+    """Tests that the least recently used results are discarded first"""
+    schema_cache = SchemaCache(max_size=2)
+    cache_options = {'storage_type': 'parquet'}
+    dfs = [pd.DataFrame({col: [1]}) for col in ['a', 'b', 'c']]
+    col_defs = pd.DataFrame({'col_name': ['a'], 'dtype': ['BIGINT']})
+
+    for df in dfs[:2]:
+        schema_cache.put_col_defs(df, col_defs, **cache_options)
+    schema_cache.get_col_defs(dfs[0], **cache_options)
+    schema_cache.put_col_defs(dfs[2], col_defs, **cache_options)
+
+    assert len(schema_cache) == 2
+    assert schema_cache.get_col_defs(dfs[0], **cache_options) is not None
+    assert schema_cache.get_col_defs(dfs[1], **cache_options) is None
+
+
+def test_schema_cache_avro_schema():
+    """
+    Tests that a cached Avro schema is only reused when a sample of a
+    DataFrame's values conforms to it, so that no dict keys are dropped
+    """
+    schema_cache = SchemaCache()
+    structs = [{'a': 1, 'b': 'x'}] * 5
+    df = pd.DataFrame({'intcol': range(5), 'structcol': structs})
+    schema_cache.put_avro_schema(df, infer_avro_schema(df))
+
+    assert schema_cache.get_avro_schema(df.iloc[::-1]) is not None
+
+    # The fingerprinted first, middle, and last values are unchanged, but
+    # another value has a key not in the cached record
+    structs[1] = {'a': 1, 'b': 'x', 'c': 1.5}
+    df = pd.DataFrame({'intcol': range(5), 'structcol': structs})
+    assert schema_cache.get_avro_schema(df) is None
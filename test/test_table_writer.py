@@ -0,0 +1,63 @@
+import pytest
+
+import rivet as rv
+
+from honeycomb import TableWriter
+
+
+@pytest.fixture
+def mock_table(mocker, test_schema, test_bucket, test_df):
+    mocker.patch('honeycomb.check.table_existence', return_value=True)
+    mocker.patch('honeycomb.meta.get_table_metadata',
+                 side_effect=lambda table_name, schema: {
+                     'bucket': test_bucket,
+                     'path': test_schema,
+                     'storage_type': 'csv',
+                     'bucketing': None,
+                     'col_defs': None
+                 })
+    return mocker.patch('honeycomb.meta.get_table_column_order',
+                        return_value=test_df.columns.to_list())
+
+
+def test_table_writer(mocker, setup_bucket_w_contents, mock_table,
+                      test_schema, test_bucket, test_df):
+    """
+    Tests that a TableWriter appends each DataFrame to the table, while
+    only retrieving the table's metadata and partitions once
+    """
+    add_partition = mocker.patch('honeycomb.table_writer.add_partition',
+                                 return_value='2021-01-01/')
+
+    writer = TableWriter('test_table', test_schema)
+    for i in range(2):
+        assert writer.append(test_df, filename='chunk_{}.csv'.format(i),
+                             partition_values={'dt': '2021-01-01'})
+
+    for i in range(2):
+        df = rv.read('{}/2021-01-01/chunk_{}.csv'.format(test_schema, i),
+                     test_bucket, header=None)
+        assert (df.values == test_df.values).all()
+    assert mock_table.call_count == 1
+    assert add_partition.call_count == 1
+
+
+def test_table_writer_refreshes_on_drift(setup_bucket_w_contents, mock_table,
+                                         test_schema, test_bucket, test_df):
+    """
+    Tests that a TableWriter refreshes its metadata when a DataFrame no
+    longer matches it, and only retries if the table has changed
+    """
+    writer = TableWriter('test_table', test_schema)
+
+    new_df = test_df.assign(newcol=1)
+    mock_table.return_value = new_df.columns.to_list()
+    assert writer.append(new_df, filename='new_cols.csv')
+    assert mock_table.call_count == 2
+    df = rv.read('{}/new_cols.csv'.format(test_schema), test_bucket,
+                 header=None)
+    assert (df.values == new_df.values).all()
+
+    with pytest.raises(ValueError, match='columns do not match'):
+        writer.append(test_df, filename='old_cols.csv')
+    assert mock_table.call_count == 3